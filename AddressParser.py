@@ -0,0 +1,111 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# 省份清洗：去掉末尾的“省”，自治区改为简称
+PROVINCE_MAP = {
+    '广西壮族自治区': '广西',
+    '内蒙古自治区': '内蒙古',
+    '宁夏回族自治区': '宁夏',
+}
+# 城市清洗：去掉末尾的“市”，自治州改为简称
+CITY_MAP = {
+    '大理白族自治州': '大理',
+    '延边朝鲜族自治州': '延边',
+}
+CITY_PATTERN = r'^(黔东南|黔西南|西双版纳|.{2}).*族自治州$'
+# 区县清洗：(省, 市, 原区县（None表示不限）, 新区县)，按顺序执行
+DISTRICT_RULES = [
+    ('广东', '东莞', None, '东莞市'),
+    ('广东', '中山', None, '中山市'),
+    ('江苏', '苏州', ('苏州工业园区', '园区'), '吴中区'),
+    ('湖北', '潜江', None, '潜江市'),
+    ('湖北', '仙桃', None, '仙桃市'),
+    ('湖北', '天门', None, '天门市'),
+    ('安徽', '芜湖', ('无为县',), '无为市'),
+]
+# 海南除三亚、海口外，地址里的“市”一级实际是县级市/县：district取原city，city统一为“海南”
+HAINAN_CITIES = ('三亚', '海口')
+
+
+class AddressParser:
+    """
+    收货地址解析：取地址前三段（省 市 区），按上面的规则表清洗。
+    每个不同的地址只拆分一次，每个不同的（省, 市, 区）只清洗一次；清洗结果缓存在 cache_file 中，跨月复用。
+    规则表修改后缓存自动失效。
+    """
+    def __init__(self, cache_file='数据存档/地址清洗缓存.parquet'):
+        self.cache_file = cache_file
+        rules = (PROVINCE_MAP, CITY_MAP, CITY_PATTERN, DISTRICT_RULES, HAINAN_CITIES)
+        self.version = hashlib.md5(repr(rules).encode('utf-8')).hexdigest()
+        self.city_pattern = re.compile(CITY_PATTERN)
+        self.cache = self._load_cache()
+        self.new_prefixes = 0  # 本次新清洗的（省, 市, 区）数
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_file):
+            return {}
+        cache = pd.read_parquet(self.cache_file)
+        cache = cache[cache['rule_version'] == self.version]
+        return {tuple(k): tuple(v) for k, v in zip(cache[['raw_province', 'raw_city', 'raw_district']].values,
+                                                   cache[['province', 'city', 'district']].values)}
+
+    def save(self):
+        keys = pd.DataFrame(list(self.cache.keys()), columns=['raw_province', 'raw_city', 'raw_district'])
+        values = pd.DataFrame(list(self.cache.values()), columns=['province', 'city', 'district'])
+        cache = pd.concat([keys, values], axis=1)
+        cache['rule_version'] = self.version
+        cache.to_parquet(self.cache_file + '.tmp', index=False)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+
+    def province_clean(self, province):
+        if province[-1] == '省':
+            return province[:-1]
+        return PROVINCE_MAP.get(province, province)
+
+    def city_clean(self, city):
+        if city[-1] == '市':
+            return city[:-1]
+        if city in CITY_MAP:
+            return CITY_MAP[city]
+        s = self.city_pattern.search(city)
+        if s:
+            return s.group(1)
+        return city
+
+    def clean_one(self, province, city, district):
+        if province is None or city is None or district is None:
+            return province, city, district
+        province, city = self.province_clean(province), self.city_clean(city)
+        for p, c, districts, new_district in DISTRICT_RULES:
+            if province == p and city == c and (districts is None or district in districts):
+                district = new_district
+        if province == '海南' and city not in HAINAN_CITIES:
+            city, district = '海南', city
+        return province, city, district
+
+    def parse(self, address, city_tier=None):
+        """
+        address: 收货地址Series
+        city_tier: 城市级别表（province, city, district, tier...），传入时一并匹配
+        返回与address等长的DataFrame：province, city, district（以及city_tier的其它列）
+        """
+        codes, uniques = pd.factorize(address)
+        parts = pd.Series(uniques).str.split(n=3, expand=True).reindex(columns=range(3))
+        parts = parts.astype(object).where(parts.notnull(), None)  # 新版pandas的字符串类型会把None转回NaN
+        prefixes = list(zip(parts[0], parts[1], parts[2]))
+        missing = set(prefixes) - self.cache.keys()
+        for prefix in missing:
+            self.cache[prefix] = self.clean_one(*prefix)
+        self.new_prefixes = len(missing)
+
+        res = pd.DataFrame([self.cache[p] for p in prefixes], columns=['province', 'city', 'district'])
+        if city_tier is not None:
+            res = res.merge(city_tier.drop_duplicates(['province', 'city', 'district']),
+                            on=['province', 'city', 'district'], how='left')
+        # 一次按地址编码取回所有行（地址为空时取末尾追加的空行）
+        res = pd.concat([res, pd.DataFrame(np.nan, index=[len(res)], columns=res.columns)], ignore_index=True)
+        return res.iloc[codes].reset_index(drop=True)
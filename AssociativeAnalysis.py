@@ -30,10 +30,16 @@ from graphviz import Digraph
 # Excel输出
 import xlsxwriter
 
+from SubOrderView import SubOrderView
+
 class AssociativeAnalysis:
     def __init__(self, df, df_sub):
+        """
+        df_sub只需要商品级字段，用到的订单级字段（user_id、cate_num、goods_type）按order_id从df关联（SubOrderView）
+        """
         self.df = df
         self.df_sub = df_sub
+        self.sub_view = SubOrderView(df, df_sub)
 
     def run_association_rules(self, dataset, min_sup, min_conf, max_len=None):
         """
@@ -59,14 +65,15 @@ class AssociativeAnalysis:
 
         # 将订单数据处理为嵌套列表
         if basket == 'order': # 订单维度，只采用品类数>1的订单数据
-            dataset = self.df_sub.loc[self.df_sub['cate_num'] > 1, ['order_id', 'category']
+            df_sub = self.sub_view.view(['cate_num'])
+            dataset = df_sub.loc[df_sub['cate_num'] > 1, ['order_id', 'category']
                                      ].drop_duplicates().groupby('order_id')['category'].apply(list).to_list()
         elif basket == 'user': # 用户维度，只采用累计购买品类数>1的用户的数据
-            user_cate = self.df_sub[['user_id', 'category']].drop_duplicates()
-            user_cate_count = user_cate.groupby('user_id').agg(cate_count=('category', 'count'))
+            user_cate = self.sub_view.view(['user_id'])[['user_id', 'category']].drop_duplicates()
+            user_cate_count = user_cate.groupby('user_id', observed=True).agg(cate_count=('category', 'count'))
             user_cate_count = user_cate.merge(user_cate_count, on='user_id', how='left')
             user_cate_count = user_cate_count[user_cate_count['cate_count'] > 1]
-            dataset = user_cate_count.groupby('user_id')['category'].apply(list).to_list()
+            dataset = user_cate_count.groupby('user_id', observed=True)['category'].apply(list).to_list()
 
         # 关联分析
         frequent_itemsets,rules_category = self.run_association_rules(dataset,min_sup, min_conf, max_len=2)
@@ -89,20 +96,22 @@ class AssociativeAnalysis:
 
         # 将订单数据处理为嵌套列表
         if basket == 'order': # 订单维度，只采用品类数>1的订单数据
-            dataset = self.df_sub.loc[self.df_sub['goods_type'] > 1, ['order_id', 'sku_id']
+            df_sub = self.sub_view.view(['goods_type'])
+            dataset = df_sub.loc[df_sub['goods_type'] > 1, ['order_id', 'sku_id']
                                      ].drop_duplicates().groupby('order_id')['sku_id'].apply(list).to_list()
         elif basket == 'user': # 用户维度，只采用累计购买单品数>1的用户的数据
-            user_sku = self.df_sub[['user_id', 'sku_id']].drop_duplicates()
-            user_sku_count = user_sku.groupby('user_id').agg(sku_count=('sku_id', 'count'))
+            user_sku = self.sub_view.view(['user_id'])[['user_id', 'sku_id']].drop_duplicates()
+            user_sku_count = user_sku.groupby('user_id', observed=True).agg(sku_count=('sku_id', 'count'))
             user_sku_count = user_sku.merge(user_sku_count, on='user_id', how='left')
             user_sku_count = user_sku_count[user_sku_count['sku_count'] > 1]
-            dataset = user_sku_count.groupby('user_id')['sku_id'].apply(list).to_list()
+            dataset = user_sku_count.groupby('user_id', observed=True)['sku_id'].apply(list).to_list()
 
         frequent_itemsets,rules_sku = self.run_association_rules(dataset, min_sup, min_conf)
         rules_sku = rules_sku[rules_sku['lift'] > min_lift]
 
         # 增添 品类 和 简化标题
-        sku_info = self.df_sub[['sku_id', 'title_refined', 'title', 'category']].drop_duplicates(['sku_id'])
+        sku_info = self.df_sub[['sku_id', 'title_refined', 'title', 'category']].drop_duplicates(['sku_id']).astype(
+            {'title_refined': 'object', 'title': 'object', 'category': 'object'})
         sku_info['title_refined'].fillna(sku_info['title'], inplace=True)
         sku_title_dict = sku_info[['sku_id', 'title_refined']].set_index('sku_id').to_dict()['title_refined']
         sku_cate_dict = sku_info[['sku_id', 'category']].set_index('sku_id').to_dict()['category']
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+class Binning:
+    """
+    分箱统计：用searchsorted求每个值所在的区间编号，再用bincount计数或按权重求和；可同时按一个分组（如月份、CRM人群）得到二维结果。
+    直接在NumPy数组上计算，不复制数据表，也不生成逐行的区间类别，结果的行只有区间数那么多。
+    - edges: 区间边界（升序）；closed='left'时区间为[a, b)，'right'时为(a, b]
+    - open_end: 最后一个区间不设上限，如“7次及以上”
+    - labels: 各区间的标签，默认为区间本身（pd.Interval）
+    - name: 结果中区间一列的名称
+    """
+    def __init__(self, edges, closed='left', open_end=False, labels=None, name=None):
+        breaks = list(edges) + ([np.inf] if open_end else [])
+        self.edges = np.asarray(breaks, dtype='float64')
+        self.closed = closed
+        bin_num = len(self.edges) - 1
+        if labels is None:
+            labels = pd.IntervalIndex.from_breaks(breaks, closed=closed)
+        if len(labels) != bin_num:
+            raise ValueError(f'区间有{bin_num}个，标签有{len(labels)}个')
+        self.index = pd.Index(labels, name=name)
+
+    def codes(self, values):
+        """
+        每个值所在区间的编号，不在任何区间内（含空值）为-1
+        """
+        values = np.asarray(values, dtype='float64')
+        codes = np.searchsorted(self.edges, values, side='right' if self.closed == 'left' else 'left') - 1
+        codes[(codes < 0) | (codes >= len(self.index))] = -1
+        return codes
+
+    @staticmethod
+    def _group_codes(groups):
+        # 分类型直接用类别编码，结果包含全部类别（与groupby的observed=False一致）；其余按取值排序编码
+        groups = pd.Series(groups) if not isinstance(groups, (pd.Series, pd.Index)) else groups
+        if isinstance(groups.dtype, pd.CategoricalDtype):
+            values = groups.array
+            return values.codes, pd.Index(values.categories, name=groups.name)
+        codes, uniques = pd.factorize(groups, sort=True)
+        return codes, pd.Index(uniques, name=groups.name)
+
+    def count(self, values, groups=None, weights=None):
+        """
+        各区间的个数（给定weights时为权重之和）；给定groups时返回 区间 × 分组 的DataFrame，否则返回Series
+        """
+        codes = self.codes(values)
+        bin_num = len(self.index)
+        if weights is not None:
+            weights = np.asarray(weights, dtype='float64')
+        if groups is None:
+            keep = codes >= 0
+            res = np.bincount(codes[keep], weights=None if weights is None else weights[keep], minlength=bin_num)
+            return pd.Series(res, index=self.index)
+        group_codes, group_index = self._group_codes(groups)
+        keep = (codes >= 0) & (group_codes >= 0)
+        flat = codes[keep] * len(group_index) + group_codes[keep]
+        res = np.bincount(flat, weights=None if weights is None else weights[keep], minlength=bin_num * len(group_index))
+        return pd.DataFrame(res.reshape(bin_num, len(group_index)), index=self.index, columns=group_index)
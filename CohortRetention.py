@@ -0,0 +1,191 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class CohortRetention:
+    """
+    首单月份同期群留存：用户按首单所在月份分组（同期群），统计首单后第0、1、2…个月有下单的用户数、订单数和GMV，
+    可再按首单品类（first_category）、首单促销类型（first_promo_type）细分。
+    结果作为累计状态保存，每批新订单只重算涉及的用户：先减去这些用户原来的贡献，合并新订单后再加回，
+    报表时直接读取，不需要扫描全部历史订单。
+    - users: 每个用户的首单时间、首单日期（first_dt）、订单号、首单月份（cohort_month）、首单品类和促销类型
+    - user_months: 每个用户每个有下单的月份的订单数和GMV
+    - matrix: cohort_month × period（首单后第几个月）× first_category × first_promo_type 的 用户数/订单数/GMV
+    period按自然月计：首单当月为第0个月，下一个自然月为第1个月，与首单后经过的天数无关。
+    补录的订单早于用户原来的首单时，该用户的同期群随之改变，同样只重算这个用户；
+    已入库的订单被替换（upsert）时需用build()重建
+    """
+    keys = ['cohort_month', 'period', 'first_category', 'first_promo_type']
+    values = ['users', 'order_num', 'gmv']
+    order_cols = ['order_id', 'user_id', 'order_time', 'dt', 'order_value', 'category', 'promo_type']
+    labels = {'cohort_month': '首单月份', 'first_category': '首单品类', 'first_promo_type': '首单促销类型'}
+
+    def __init__(self, cohort_dir='数据存档/同期群留存'):
+        self.cohort_dir = cohort_dir
+        self.users, self.user_months, self.matrix = self._empty()
+
+    @staticmethod
+    def _empty():
+        users = pd.DataFrame({
+            'first_order_time': pd.Series(dtype='datetime64[ns]'),
+            'first_dt': pd.Series(dtype='datetime64[ns]'),
+            'first_order_id': pd.Series(dtype='int64'),
+            'cohort_month': pd.Series(dtype='datetime64[ns]'),
+            'first_category': pd.Series(dtype='object'),
+            'first_promo_type': pd.Series(dtype='object'),
+        }, index=pd.Index([], dtype='object', name='user_id'))
+        user_months = pd.DataFrame({
+            'user_id': pd.Series(dtype='object'),
+            'month': pd.Series(dtype='datetime64[ns]'),
+            'order_num': pd.Series(dtype='int64'),
+            'gmv': pd.Series(dtype='float64'),
+        })
+        matrix = pd.DataFrame({
+            'cohort_month': pd.Series(dtype='datetime64[ns]'),
+            'period': pd.Series(dtype='int64'),
+            'first_category': pd.Series(dtype='object'),
+            'first_promo_type': pd.Series(dtype='object'),
+            'users': pd.Series(dtype='int64'),
+            'order_num': pd.Series(dtype='int64'),
+            'gmv': pd.Series(dtype='float64'),
+        })
+        return users, user_months, matrix
+
+    def _path(self, name):
+        return os.path.join(self.cohort_dir, name + '.parquet')
+
+    def load(self):
+        """
+        读取已保存的状态，文件不存在时返回False
+        """
+        if not os.path.exists(self._path('matrix')):
+            return False
+        self.users = pd.read_parquet(self._path('users')).set_index('user_id')
+        if 'first_dt' not in self.users.columns:  # 旧版本保存的状态没有首单日期，由首单时间补上
+            self.users.insert(1, 'first_dt', self.users['first_order_time'].dt.normalize())
+        self.user_months = pd.read_parquet(self._path('user_months'))
+        self.matrix = pd.read_parquet(self._path('matrix'))
+        return True
+
+    def save(self):
+        os.makedirs(self.cohort_dir, exist_ok=True)
+        # matrix最后写，读取时以它是否存在为准
+        for name, data in [('users', self.users.reset_index()), ('user_months', self.user_months), ('matrix', self.matrix)]:
+            data.to_parquet(self._path(name) + '.tmp', index=False)
+            os.replace(self._path(name) + '.tmp', self._path(name))
+
+    @staticmethod
+    def _prepare(orders):
+        """
+        orders: 订单级数据（每单一行），包含order_cols
+        """
+        return pd.DataFrame({
+            'user_id': orders['user_id'].astype('object').to_numpy(),
+            'order_id': orders['order_id'].to_numpy(dtype='int64'),
+            'order_time': pd.to_datetime(orders['order_time']).to_numpy(),
+            'dt': orders['dt'].to_numpy(dtype='datetime64[ns]'),
+            'month': orders['dt'].to_numpy(dtype='datetime64[ns]').astype('datetime64[M]').astype('datetime64[ns]'),
+            'order_value': orders['order_value'].to_numpy(dtype='float64'),
+            'category': orders['category'].astype('object').to_numpy(),
+            'promo_type': orders['promo_type'].astype('object').to_numpy(),
+        })
+
+    @staticmethod
+    def _earliest(users):
+        # 每个用户取最早的一单（下单时间相同时取订单号小的）
+        users = users.sort_values(['first_order_time', 'first_order_id'], kind='mergesort')
+        return users.loc[~users.index.duplicated(keep='first')]
+
+    def _first_orders(self, orders):
+        users = pd.DataFrame({
+            'first_order_time': orders['order_time'].to_numpy(),
+            'first_dt': orders['dt'].to_numpy(),
+            'first_order_id': orders['order_id'].to_numpy(),
+            'cohort_month': orders['month'].to_numpy(),
+            'first_category': orders['category'].to_numpy(),
+            'first_promo_type': orders['promo_type'].to_numpy(),
+        }, index=pd.Index(orders['user_id'].to_numpy(), name='user_id'))
+        return self._earliest(users)
+
+    @staticmethod
+    def _months(orders):
+        return orders.groupby(['user_id', 'month']).agg(order_num=('order_id', 'size'), gmv=('order_value', 'sum')).reset_index()
+
+    def _aggregate(self, users, user_months):
+        """
+        users / user_months 中这些用户对同期群矩阵的贡献
+        """
+        data = user_months.join(users[['cohort_month', 'first_category', 'first_promo_type']], on='user_id')
+        month, cohort = data['month'].dt, data['cohort_month'].dt
+        data['period'] = (month.year - cohort.year) * 12 + (month.month - cohort.month)
+        return data.groupby(self.keys, dropna=False).agg(
+            users=('user_id', 'size'), order_num=('order_num', 'sum'), gmv=('gmv', 'sum')).reset_index()
+
+    def _combine(self, parts):
+        matrix = pd.concat(parts, ignore_index=True)
+        matrix = matrix.groupby(self.keys, dropna=False)[self.values].sum().reset_index()
+        return matrix.loc[matrix['users'] != 0].reset_index(drop=True)
+
+    def build(self, orders):
+        """
+        用全部历史订单重建
+        """
+        self.users, self.user_months, self.matrix = self._empty()
+        if orders.shape[0] > 0:
+            orders = self._prepare(orders)
+            self.users = self._first_orders(orders)
+            self.user_months = self._months(orders)
+            self.matrix = self._aggregate(self.users, self.user_months)
+
+    def add(self, orders):
+        """
+        合并一批新入库的订单：只重算这批订单涉及的用户
+        """
+        if orders.shape[0] == 0:
+            return
+        orders = self._prepare(orders)
+        batch_users = orders['user_id'].unique()
+        old_users = self.users.loc[self.users.index.isin(batch_users)]
+        touched = self.user_months['user_id'].isin(batch_users).to_numpy()
+        old_months = self.user_months.loc[touched]
+        removed = self._aggregate(old_users, old_months)
+        removed[self.values] = -removed[self.values]
+
+        users = self._earliest(pd.concat([old_users, self._first_orders(orders)]))
+        months = pd.concat([old_months, self._months(orders)], ignore_index=True)
+        months = months.groupby(['user_id', 'month'])[['order_num', 'gmv']].sum().reset_index()
+        self.users = pd.concat([self.users.loc[~self.users.index.isin(batch_users)], users])
+        self.user_months = pd.concat([self.user_months.loc[~touched], months], ignore_index=True)
+        self.matrix = self._combine([self.matrix, removed, self._aggregate(users, months)])
+
+    def table(self, value='users', by=None, start=None, end=None):
+        """
+        同期群矩阵：行为首单月份（by为'first_category'或'first_promo_type'时再细分），列为首单后第几个自然月
+        - value: users（下单人数）/ order_num（订单数）/ gmv
+        - start / end: 只看首单日期（first_dt）在[start, end]内的用户，且只统计到end所在的月份（该月整月计入）。
+          首单日期按天精确筛选，月中截取时只重算入选用户的贡献，不按整月的matrix截取
+        """
+        if start is None and end is None:
+            matrix, periods = self.matrix, 0
+        else:
+            users = self.users
+            if start is not None:
+                users = users.loc[users['first_dt'] >= pd.Timestamp(start).normalize()]
+            if end is not None:
+                users = users.loc[users['first_dt'] <= pd.Timestamp(end).normalize()]
+            user_months = self.user_months.loc[self.user_months['user_id'].isin(users.index)]
+            matrix, periods = self._aggregate(users, user_months), 0
+            if end is not None:
+                end_month = pd.Timestamp(end).to_period('M').to_timestamp()
+                last = (end_month.year - matrix['cohort_month'].dt.year) * 12 + (end_month.month - matrix['cohort_month'].dt.month)
+                matrix = matrix.loc[matrix['period'] <= last]
+                periods = last.max() + 1 if matrix.shape[0] else 0
+        rows = ['cohort_month'] + ([by] if by else [])
+        res = matrix.groupby(rows + ['period'], dropna=False)[value].sum().unstack('period', fill_value=0)
+        res = res.reindex(columns=np.arange(max(periods, res.columns.max() + 1 if res.shape[1] else 0)), fill_value=0)
+        res = res.rename(index=lambda x: x.strftime('%Y-%m') if isinstance(x, pd.Timestamp) else x)
+        res.index.names = [self.labels[name] for name in res.index.names]
+        res.columns.name = '首单后第n个自然月'
+        return res
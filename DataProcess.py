@@ -1,52 +1,279 @@
 import numpy as np
 import pandas as pd
-import re
-from datetime import datetime
+import glob
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pandas.io.parsers import TextParser
+
+from HistoryStore import HistoryStore
+from CohortRetention import CohortRetention
+from OrderCube import OrderCube
+from OrderIdIndex import OrderIdIndex
+from SkuIndex import SkuIndex
+from SkuFuzzyMatcher import SkuFuzzyMatcher
+from AddressParser import AddressParser
+from PromoCalendar import PromoCalendar
+from RefCache import RefCache
+from RunMonitor import RunMonitor
+from Schema import Schema
+from SubOrderView import SubOrderView
+from TitleCleaner import TitleCleaner
+from UserOrderIndex import UserOrderIndex
+from UserTimeline import UserTimeline
+
+
+def _prepare_file(dp, filename):
+    """
+    在进程池中处理单个文件：读取 → 标题清洗/sku匹配 → 提取字段。
+    子进程不写任何缓存和索引文件，新增的缓存内容随结果返回，由主进程合并后统一保存
+    """
+    dp.new_order_file = filename
+    dp.save_caches = False
+    dp.monitor = RunMonitor(trace_memory=dp.monitor.trace_memory)
+    titles, prefixes, key_num = set(dp.title_cleaner.cache), set(dp.address_parser.cache), dp.sku_index.keys.shape[0]
+    with dp.monitor.stage('read_data') as rec:
+        dp.read_data()
+        rec['rows_out'] = dp.monitor.rows(dp.df_new)
+    dp.prepare_batch()
+    return {
+        'df_sub_new': dp.df_sub_new,
+        'counters': {name: getattr(dp, name) for name in dp.batch_counters},
+        'title_cache': {t: dp.title_cleaner.cache[t] for t in dp.title_cleaner.cache.keys() - titles},
+        'address_cache': {p: dp.address_parser.cache[p] for p in dp.address_parser.cache.keys() - prefixes},
+        'sku_keys': dp.sku_index.keys.iloc[key_num:],
+        'fuzzy_review': dp.fuzzy_review,
+        'upsert_ids': dp.upsert_ids,
+        'stages': dp.monitor.records,
+    }
+
 
 class DataProcess:
     """
     对新增订单数据进行清洗，并与历史数据进行合并。流程包括：
-    - read_data(): 读取新数据
-    - sku_map(): 将原始订单按宝贝标题拆分至子订单，然后进行标题清洗和sku mapping。
-      注意：匹配过程依赖于从历史订单中整理出来的匹配文件（self.sku_file)，如果本月宝贝标题发生大的变动，需要到文件里进行补充，或者到一面数据库里进行匹配。
+    - load_reference(): 预读参考数据（sku信息、CRM、活动日历、行政区域等），xlsx转成二进制快照缓存，文件不变时直接读快照
+    - main(): 各阶段（及其中的子步骤）的耗时、内存峰值和行数由self.monitor记录，运行结束后写出JSON运行日志，
+      可设置预算（self.monitor.budget），超出时运行失败，见RunMonitor
+    - read_data(): 读取新数据。filename可以是单个文件、文件列表或通配符（如 '数据/2020-*.xlsx'），
+      多个文件时main()走batch_process()：各文件在进程池中并行读取/清洗/匹配/打标签，之后整批统一标注下单序数、一次写入历史订单库
+    - read_chunks() / iter_batches(): 分块流式读取新数据（xlsx按行流式读取，csv按chunksize读取），读取时只保留需要的列，
+      每块依次做标题清洗/sku匹配/字段提取；设置chunksize时main()走这条流程，内存占用只与块大小有关，与导出文件大小无关
+    - sku_map(): 先跳过已入库的订单（查订单号索引self.order_id_index_file，重复导入同一份数据不会重复计数），
+      再将原始订单按宝贝标题拆分至子订单，然后进行标题清洗和sku mapping。
+      标题清洗规则在 TitleCleaner.TITLE_RULES 中维护，每个不同标题只清洗一次并跨月缓存。
+      注意：匹配过程依赖于从历史订单中整理出来的匹配文件（self.sku_file)，该文件会编译成sku索引（self.sku_index_file)，
+      已确认匹配的新标题会自动写回索引；精确匹配不上的标题会做模糊匹配（SkuFuzzyMatcher），相似度达到self.fuzzy_threshold的自动采纳，
+      其余的导出到self.fuzzy_review_file，需要到文件里进行补充，或者到一面数据库里进行匹配。
     - add_fields(): 提取新字段，包括：订单创建日期/月份/星期、订单包含的品类数、用户地域信息（province/city/district/tier)、CRM标签、促销信息
       注意：已购CRM会员信息 和 促销活动信息 需要客户自己更新
-    - mark_rebuy(): 标记这是该用户的第几次下单，以及该订单是否是复购订单。
-    - union_data(): 合并历史数据和新数据，对历史数据进行备份，然后统一存为历史数据
+    - mark_rebuy(): 标记这是该用户的第几次下单，以及该订单是否是复购订单。历史下单次数从用户下单索引（self.user_index_file）读取，并随每批新订单更新。
+      新订单早于该用户已入库的订单时（补录、重新导出），只对这些用户的全部订单重排序数，并改写历史中序数有变化的订单。
+    - rebuild_order_sequence(): 全量重排历史订单的下单序数和复购标记，并重建用户下单索引
+    - union_data(): 把新数据按月份分区追加到历史订单库（self.history_dir），不再整表改写历史文件。
+      订单表存订单级字段（商品字段取订单的第一个商品），订单明细表只存商品级字段（self.item_cols），不再重复存订单字段
+    - update_order_cube(): 每批新订单入库后合并进订单日汇总（OrderCube），订单规律探索的报表从汇总表计算；
+      历史订单有改写（替换已入库订单、重排下单序数）时重建汇总表
+    - update_cohort(): 每批新订单入库后更新首单月份同期群留存（CohortRetention），只重算这批订单涉及的用户；
+      替换已入库订单时重建
+    - load_user_timeline(): 把读取的历史订单按用户、下单时间整理成扁平数组（UserTimeline），存盘后内存映射读取，
+      复购、购买路径、RFM等按用户序列的计算共用，历史订单不变时下次直接读取
+    - load_history(): 按需读取历史数据的部分列/月份，供各分析模块使用。内存中的订单明细只有商品级字段，
+      分析模块需要订单级字段时用SubOrderView按order_id从订单表取出用到的几列。
+      读取后统一转为紧凑类型（见Schema），字符串维度列为category，分析模块中对这些列分组时需加observed=True
 
     """
-    def __init__(self, filename):
+    # 每批新数据的数字统计，分块/多文件处理时逐块累加
+    batch_counters = ['new_order_num', 'new_valid_order_num', 'new_skipped_order_num', 'new_valid_suborder_num',
+                      'new_usable_suborder_num']
+
+    def __init__(self, filename, chunksize=None):
         # 新数据
         self.df_new = None
         self.df_sub_new = None
-        self.new_order_file = filename  # 新订单
-        self.pre_order_file = "数据存档/历史订单_test.csv"  # 历史订单数据
-        self.pre_suborder_file = "数据存档/历史订单明细_test.csv"  # 历史订单明细
+        self.new_order_files = self.expand_files(filename)  # 新订单文件
+        self.new_order_file = self.new_order_files[0] if self.new_order_files else filename  # 当前处理的文件
+        self.save_caches = True  # 进程池中处理时为False，缓存由主进程合并后保存
+        self.chunksize = chunksize  # 分块读取的行数，None表示整表读取
+        self.csv_encoding = 'gb18030'  # 天猫导出的csv一般为GBK编码
+        self.raw_col_map = {
+            '订单付款时间 ':'订单付款时间',
+            '宝贝标题 ': '宝贝标题',
+            '宝贝种类 ': '宝贝种类',
+            '联系电话 ': '联系电话',
+            '物流单号 ': '物流单号',
+            '收货地址 ': '收货地址'
+        }
+        self.raw_cols = ['订单编号', '订单创建时间', '总金额', '宝贝标题', '宝贝种类',
+                         '宝贝总数量', '买家会员名', '买家支付宝账号', '收货人姓名', '收货地址', '联系手机']
+        self.pre_order_file = "数据存档/历史订单_test.csv"  # 旧版历史订单CSV，仅用于首次迁移
+        self.pre_suborder_file = "数据存档/历史订单明细_test.csv"  # 旧版历史订单明细CSV，仅用于首次迁移
+        self.history_dir = "数据存档/历史订单库"  # 按月分区的历史订单库
+        self.order_table = '历史订单'
+        self.suborder_table = '历史订单明细'
+        self.item_cols = SubOrderView.item_cols  # 订单明细表只存商品级字段，其余字段按order_id从订单表关联
+        self.store = HistoryStore(self.history_dir)
+        self.user_index_file = "数据存档/用户下单索引.parquet"  # 每个用户的下单次数、首单/最近一单时间
+        self.user_index = UserOrderIndex(self.user_index_file)
+        self.order_id_index_file = "数据存档/订单号索引.npy"  # 已入库的订单号
+        self.order_id_index = OrderIdIndex(self.order_id_index_file)
+        self.order_cube_file = "数据存档/订单日汇总.parquet"  # 按日期×CRM×促销类型×类别×价值区间×下单次数汇总的订单数/销售额/件数
+        self.order_cube = OrderCube(self.order_cube_file)
+        self.order_cube_ready = False  # 汇总表已读取，且与历史订单一致
+        self.order_cube_stale = False  # 历史订单有改写，汇总表需要重建
+        self.cohort_dir = "数据存档/同期群留存"  # 每个用户的首单月份和各月下单数，及按首单月份×首单后第几个月汇总的留存
+        self.cohort = CohortRetention(self.cohort_dir)
+        self.cohort_ready = False
+        self.cohort_stale = False  # 有订单被替换，需要重建
+        self.user_timeline_dir = "数据存档/用户时间线"  # 按用户、下单时间排列的订单数组（CSR），分析模块共用
+        self.user_timeline = UserTimeline(self.user_timeline_dir)
+        self.duplicate_mode = 'skip'  # 已入库的订单：'skip'跳过；'upsert'用新数据替换历史记录，沿用原来的下单序数
+        self.upsert_ids = np.empty(0, dtype='int64')
+        self.upserted = None  # upsert订单在历史订单库中的旧记录（order_id, user_id, month, nth_order），见load_upserted
+        self.ref_cache = RefCache('数据存档/参考数据缓存')  # 参考数据xlsx的二进制快照，与分析模块共用
         self.sku_file = '数据/sku信息汇总（包括原始标题、清洗标题、统一标题）.xlsx'
+        self.sku_index_file = '数据存档/sku索引.parquet'  # 由sku_file编译而来，并自动积累已确认的新标题
+        self.sku_index = SkuIndex(self.sku_file, self.sku_index_file, reader=self.ref_cache.read_excel)
+        self.fuzzy_threshold = 0.8  # 模糊匹配自动采纳的最低相似度，None表示不做模糊匹配
+        self.fuzzy_review_file = '数据存档/待确认标题.xlsx'  # 模糊匹配未采纳的标题及候选sku
+        self.fuzzy_review = None
+        self.fuzzy_matcher = None
         self.crm_file = '数据/已购CRM_test.xlsx'
         self.promo_file = '数据/活动日历.xlsx'
         self.city_tier_file = '数据/全国行政区域.xlsx'
+        self.address_cache_file = '数据存档/地址清洗缓存.parquet'  # 地址清洗结果缓存，规则见AddressParser
+        self.address_parser = AddressParser(self.address_cache_file)
         self.title_refined_file = '数据/sku标题简化.xlsx'
+        self.title_cache_file = '数据存档/标题清洗缓存.parquet'  # 标题清洗结果缓存，规则见TitleCleaner.TITLE_RULES
+        self.title_cleaner = TitleCleaner(self.title_cache_file)
+        self.monitor = RunMonitor('数据存档/运行日志')  # 各阶段的耗时/内存/行数记录及预算
         # 历史数据
         self.df = None
         self.df_sub = None
         # 数字统计
         self.new_order_num = None
         self.new_valid_order_num = None
+        self.new_skipped_order_num = None
         self.new_valid_suborder_num = None
         self.new_usable_order_num = None
         self.new_usable_suborder_num = None
 
+    @staticmethod
+    def expand_files(filename):
+        """
+        文件列表原样返回；含通配符时按文件名排序展开
+        """
+        if isinstance(filename, (list, tuple)):
+            return list(filename)
+        if any(c in filename for c in '*?['):
+            return sorted(glob.glob(filename))
+        return [filename]
+
+    def load_reference(self):
+        """
+        预读全部参考数据：有快照的直接读取，没有快照的多进程同时解析
+        """
+        paths = {'sku': self.sku_file, 'title_refined': self.title_refined_file, 'city_tier': self.city_tier_file,
+                 'crm': self.crm_file, 'promo': self.promo_file}
+        self.ref_cache.read_many({name: path for name, path in paths.items() if path})
+
     def read_data(self):
-        col_map = {
-            '订单付款时间 ':'订单付款时间',
-            '宝贝标题 ': '宝贝标题',
-            '宝贝种类 ': '宝贝种类',
-            '联系电话 ': '联系电话',
-            '物流单号 ': '物流单号',
-            '收货地址 ': '收货地址'
-        }
-        self.df_new = pd.read_excel(self.new_order_file).rename(columns=col_map)
+        self.df_new = pd.read_excel(self.new_order_file).rename(columns=self.raw_col_map)
+
+    def read_chunks(self, chunksize):
+        """
+        分块读取新订单，每块最多chunksize行，只保留sku_map需要的列和订单状态
+        - xlsx: openpyxl只读模式逐行读取，不把整个工作簿载入内存
+        - csv: pandas按chunksize读取
+        """
+        usecols = self.raw_cols + ['订单状态']
+        if self.new_order_file.lower().endswith('.csv'):
+            reader = pd.read_csv(self.new_order_file, encoding=self.csv_encoding, chunksize=chunksize,
+                                 usecols=lambda c: self.raw_col_map.get(c, c) in usecols)
+            for chunk in reader:
+                yield chunk.rename(columns=self.raw_col_map)[usecols]
+            return
+        from openpyxl import load_workbook
+        wb = load_workbook(self.new_order_file, read_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [self.raw_col_map.get(c, c) for c in next(rows)]
+            pos = [header.index(c) for c in usecols]
+            buffer = []
+            for row in rows:
+                if all(v is None for v in row):
+                    continue
+                # 与pd.read_excel一致：整数值的浮点数转为int（如联系手机）
+                buffer.append([self._cell_value(row[i]) if i < len(row) else None for i in pos])
+                if len(buffer) == chunksize:
+                    yield self._to_frame(buffer, usecols)
+                    buffer = []
+            if buffer:
+                yield self._to_frame(buffer, usecols)
+        finally:
+            wb.close()
+
+    @staticmethod
+    def _cell_value(value):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    @staticmethod
+    def _to_frame(rows, columns):
+        # 与pd.read_excel相同的类型推断（如文本格式的数字列转为数值）
+        return TextParser([columns] + rows, header=0).read()
+
+    def iter_batches(self, chunksize):
+        """
+        流式处理：每读出一块，依次做 标题清洗/sku匹配 → 提取字段，产出这一块处理好的子订单（整块都已入库时为None）
+        """
+        chunks = self.read_chunks(chunksize)
+        while True:
+            with self.monitor.stage('read_chunk') as rec:
+                self.df_new = next(chunks, None)
+                rec['rows_out'] = self.monitor.rows(self.df_new)
+            if self.df_new is None:
+                return
+            self.prepare_batch()
+            yield self.df_sub_new
+
+    def prepare_batch(self):
+        """
+        读出的一批新订单（self.df_new）：标题清洗/sku匹配 → 提取字段，各记为一个阶段
+        """
+        with self.monitor.stage('sku_map', rows_in=self.monitor.rows(self.df_new)) as rec:
+            self.sku_map()
+            rec['rows_out'] = self.monitor.rows(self.df_sub_new)
+        if self.df_sub_new is not None:
+            with self.monitor.stage('add_fields', rows_in=self.monitor.rows(self.df_sub_new)) as rec:
+                self.add_fields()
+                rec['rows_out'] = self.monitor.rows(self.df_sub_new)
+
+    def load_order_ids(self):
+        """
+        读取订单号索引，索引不存在时用历史订单构建一次
+        """
+        if self.order_id_index.ids is None:
+            self.migrate_csv()
+            if not self.order_id_index.load():
+                self.order_id_index.build(self.store.load(self.order_table, columns=['order_id'])['order_id'])
+
+    def filter_loaded_orders(self):
+        """
+        查询订单号索引：本批内重复的订单只保留一条；已入库的订单在skip模式下跳过，upsert模式下记下订单号，入库时替换旧记录
+        """
+        self.load_order_ids()
+        n = self.df_new.shape[0]
+        self.df_new = self.df_new.drop_duplicates('订单编号')
+        loaded = self.order_id_index.contains(self.df_new['订单编号'])
+        if self.duplicate_mode == 'upsert':
+            self.upsert_ids = np.union1d(self.upsert_ids, self.df_new.loc[loaded, '订单编号'].astype('int64'))
+            print(f'已入库的订单{loaded.sum()}个，将替换历史记录')
+        else:
+            self.df_new = self.df_new.loc[~loaded]
+        self.new_skipped_order_num = n - self.df_new.shape[0]
+        if self.new_skipped_order_num:
+            print(f'跳过已入库或重复的订单{self.new_skipped_order_num}个')
 
     def sku_map(self):
         """
@@ -54,68 +281,70 @@ class DataProcess:
         """
 
         ### 1 - SKU MAPPING ###
-        def title_clean(title):
-            if title == ' 味好美黑椒酱230g*3包组合 黑胡椒酱汁牛排酱':
-                title = '味好美黑椒酱230g*3包组合 黑胡椒酱汁牛排酱'
-            # 清除带中括号的活动信息
-            res = re.search(r'.+】(.+)', title)
-            if res:
-                title = res[1]
-            # [9月10日秒杀]味好美新奥尔良烤鸡翅腌料*8包 烤炸鸡烧烤调料
-            if "]" in title:
-                title = title.split(']')[-1]
-            # 1元预定  味好美培煎芝麻沙拉酱200g
-            elif "1元预定" in title or '1元秒杀' in title:
-                title = title.split()[-1]
-            # 薇娅推荐 味好美新奥尔良烤鸡翅腌料 家用烤炸鸡烧烤调料烤肉腌料
-            elif "薇娅推荐" in title:
-                title = title[4:].strip()
-            # 以“X月X日直播专享/秒杀”开头的标题
-            elif re.search(r'直播.+?\s(.+)', title):
-                m = re.search(r'直播.+?\s(.+)', title)
-                title = m.group(1).strip()
-                # 直播商品标题末尾可能含有“秒杀”字样
-                if title[-2:] == '秒杀':
-                    title = title[:-2]
-            # “包邮 | ”开头的标题
-            elif re.match(r'^包邮(.+)', title):
-                title = title[5:]
-            elif re.match(r'^新品(.+)', title):
-                m = re.match(r'^新品(.+)', title)
-                title = m.group(1).strip()
-            elif re.match(r'^预售(.+)', title):
-                m = re.match(r'^预售(.+)', title)
-                title = m.group(1).strip()
-            return title
-
         # 提取有效订单
         self.new_order_num = self.df_new.shape[0]
-        cols = ['订单编号', '订单创建时间', '总金额', '宝贝标题', '宝贝种类',
-                '宝贝总数量', '买家会员名', '买家支付宝账号', '收货人姓名', '收货地址', '联系手机']
-        self.df_new = self.df_new.loc[self.df_new['订单状态'] != '交易关闭', cols]
+        self.df_new = self.df_new.loc[self.df_new['订单状态'] != '交易关闭', self.raw_cols]
         self.new_valid_order_num = self.df_new.shape[0]
+        with self.monitor.stage('filter_loaded_orders', rows_in=self.new_valid_order_num) as rec:
+            self.filter_loaded_orders()
+            rec['rows_out'] = self.df_new.shape[0]
+        if self.df_new.shape[0] == 0:
+            # 没有需要入库的新订单
+            self.df_sub_new = None
+            self.new_valid_suborder_num = self.new_usable_suborder_num = 0
+            return
 
 
         # 标题清洗 + 拆分子订单
-        self.df_new['宝贝标题'] = self.df_new['宝贝标题'].apply(lambda x: x.replace("购，", '购'))  # 处理活动信息 【1元换购，单拍不发货】
-        self.df_new['title_origin'] = self.df_new['宝贝标题'].apply(lambda x: x.split("，"))
+        self.df_new['宝贝标题'] = self.df_new['宝贝标题'].str.replace("购，", '购', regex=False)  # 处理活动信息 【1元换购，单拍不发货】
+        self.df_new['title_origin'] = self.df_new['宝贝标题'].str.split("，")
         self.df_sub_new = self.df_new.explode('title_origin')
-        self.df_sub_new['title_clean'] = self.df_sub_new['title_origin'].apply(title_clean)
+        # 每个不同的标题只清洗一次，清洗结果跨月缓存
+        with self.monitor.stage('title_clean', rows_in=self.df_sub_new.shape[0]):
+            self.df_sub_new['title_clean'] = self.title_cleaner.clean(self.df_sub_new['title_origin'])
+            if self.title_cleaner.new_titles and self.save_caches:
+                self.title_cleaner.save()
         self.new_valid_suborder_num = self.df_sub_new.shape[0]
 
-        # sku_id匹配，先用title_clean，再用title_origin
-        sku_info = pd.read_excel(self.sku_file)
-        title_clean_tmp = sku_info[['title_clean', 'sku_id', 'title', '类别', '品类']]
-        title_origin_tmp = sku_info[['title_origin', 'sku_id', 'title', '类别', '品类']].drop_duplicates(
-            "title_origin").rename(
-            columns={'sku_id': 'sku_id2', 'title': 'title2', '类别': '类别2', '品类': '品类2'})
-        self.df_sub_new = self.df_sub_new.merge(title_clean_tmp, how='left')
-        self.df_sub_new = self.df_sub_new.merge(title_origin_tmp, how='left')
-        self.df_sub_new['sku_id'].fillna(self.df_sub_new['sku_id2'], inplace=True)
-        self.df_sub_new['title'].fillna(self.df_sub_new['title2'], inplace=True)
-        self.df_sub_new['类别'].fillna(self.df_sub_new['类别2'], inplace=True)
-        self.df_sub_new['品类'].fillna(self.df_sub_new['品类2'], inplace=True)
-        self.df_sub_new.drop(['sku_id2', 'title2', '类别2', '品类2'], axis=1, inplace=True)
+        # sku_id匹配：先用title_clean，再用title_origin，两种标题在sku索引里一次查出
+        with self.monitor.stage('sku_resolve', rows_in=self.new_valid_suborder_num):
+            if self.sku_index.keys is None:
+                self.sku_index.load()
+            self.df_sub_new = self.df_sub_new.reset_index(drop=True)
+            self.df_sub_new[SkuIndex.fields] = self.sku_index.resolve(self.df_sub_new['title_clean'],
+                                                                      self.df_sub_new['title_origin'])
+        # 精确匹配不上的标题做模糊匹配：相似度达到阈值的自动采纳，其余的连同候选导出，供人工确认
+        fuzzy = pd.Series(False, index=self.df_sub_new.index)
+        unmatched = self.df_sub_new['sku_id'].isnull() | self.df_sub_new['品类'].isnull()
+        if self.fuzzy_threshold is not None and unmatched.any():
+            with self.monitor.stage('fuzzy_match', rows_in=int(unmatched.sum())) as rec:
+                # 分块处理时LSH索引只构建一次
+                if self.fuzzy_matcher is None:
+                    self.fuzzy_matcher = SkuFuzzyMatcher(threshold=self.fuzzy_threshold).fit(
+                        self.sku_index.keys[self.sku_index.keys['source'] != 'fuzzy'])
+                accepted, candidates = self.fuzzy_matcher.match(self.df_sub_new.loc[unmatched, 'title_clean'])
+                fuzzy = unmatched & self.df_sub_new['title_clean'].isin(accepted['query'])
+                self.df_sub_new.loc[fuzzy, SkuIndex.fields] = accepted.set_index('query')[SkuIndex.fields].reindex(
+                    self.df_sub_new.loc[fuzzy, 'title_clean']).to_numpy()
+                review = pd.DataFrame({'title_clean': self.df_sub_new.loc[unmatched & ~fuzzy, 'title_clean'].unique()})
+                if review.shape[0] > 0:
+                    review = review.merge(candidates.rename(columns={'query': 'title_clean'}), how='left')
+                    # 分块处理时累积各块的待确认标题
+                    self.fuzzy_review = pd.concat([self.fuzzy_review, review]).drop_duplicates(['title_clean', '候选标题'])
+                    if self.save_caches:
+                        self.fuzzy_review.to_excel(self.fuzzy_review_file, index=False)
+                print(f'模糊匹配：自动采纳标题{accepted.shape[0]}个，待确认标题{review["title_clean"].nunique()}个')
+                rec['rows_out'] = int(fuzzy.sum())
+
+        # 本月已确认的新标题写回索引，下个月直接命中
+        with self.monitor.stage('sku_learn', rows_in=self.new_valid_suborder_num) as rec:
+            learned_num = self.sku_index.learn(self.df_sub_new.loc[~fuzzy])
+            learned_num += self.sku_index.learn(self.df_sub_new.loc[fuzzy], source='fuzzy')
+            if learned_num:
+                if self.save_caches:
+                    self.sku_index.save()
+                print(f'sku索引新增标题{learned_num}个')
+            rec['rows_out'] = learned_num
 
         # 字段重命名
         col_dict = {
@@ -139,12 +368,16 @@ class DataProcess:
             columns=col_dict)
         self.new_usable_suborder_num = self.df_sub_new.shape[0]
         print('宝贝ID匹配完成！ 匹配率:', '{:.1%}'.format(self.new_usable_suborder_num / self.new_valid_suborder_num))
+        if self.new_usable_suborder_num == 0:
+            self.df_sub_new = None
+            return
 
         # 标题简化
-        title_refine = pd.read_excel(self.title_refined_file)
-        title_refine_dict = title_refine[['sku_id', 'title_refined']].set_index('sku_id').to_dict()['title_refined']
-        self.df_sub_new['sku_id'] = self.df_sub_new['sku_id'].astype('int64')
-        self.df_sub_new['title_refined'] = self.df_sub_new['sku_id'].map(lambda x: title_refine_dict.get(x, np.nan))
+        with self.monitor.stage('title_refine', rows_in=self.new_usable_suborder_num):
+            title_refine = self.ref_cache.read_excel(self.title_refined_file)
+            title_refine_dict = title_refine[['sku_id', 'title_refined']].set_index('sku_id').to_dict()['title_refined']
+            self.df_sub_new['sku_id'] = self.df_sub_new['sku_id'].astype('int64')
+            self.df_sub_new['title_refined'] = self.df_sub_new['sku_id'].map(lambda x: title_refine_dict.get(x, np.nan))
 
     def add_fields(self):
         """
@@ -152,159 +385,459 @@ class DataProcess:
         - 注意：已购CRM会员信息 和 促销活动信息 需要客户自己更新
         """
         # 1. 标记订单创建日期
-        self.df_sub_new['order_time'] = pd.to_datetime(self.df_sub_new['order_time'])
-        self.df_sub_new['dt'] = self.df_sub_new['order_time'].map(lambda x: x.date())
-        self.df_sub_new['dt'] = self.df_sub_new['dt'].apply(lambda x: str(x.strftime('%Y-%m-%d')))
-        self.df_sub_new['month'] = self.df_sub_new['dt'].apply(lambda x: x[:8] + '01')
-        self.df_sub_new['dt'] = pd.to_datetime(self.df_sub_new['dt'])
-        self.df_sub_new['day_of_week'] = self.df_sub_new['dt'].dt.dayofweek + 1
+        with self.monitor.stage('dates', rows_in=self.df_sub_new.shape[0]):
+            self.df_sub_new['order_time'] = pd.to_datetime(self.df_sub_new['order_time'])
+            self.df_sub_new['dt'] = self.df_sub_new['order_time'].map(lambda x: x.date())
+            self.df_sub_new['dt'] = self.df_sub_new['dt'].apply(lambda x: str(x.strftime('%Y-%m-%d')))
+            self.df_sub_new['month'] = self.df_sub_new['dt'].apply(lambda x: x[:8] + '01')
+            self.df_sub_new['dt'] = pd.to_datetime(self.df_sub_new['dt'])
+            self.df_sub_new['day_of_week'] = self.df_sub_new['dt'].dt.dayofweek + 1
 
         # 2. 统计订单包含的品类数和类别数
-        cate_num = self.df_sub_new.groupby(['order_id']).agg(cate_num=('category', 'nunique'),
-                                                        channel_num=('channel', 'nunique')).reset_index()
-        self.df_sub_new = self.df_sub_new.merge(cate_num, on='order_id', how='left')
-
-        # 3. 标注地域和城市级别
-        city_tier = pd.read_excel("数据/全国行政区域.xlsx")
-        self.df_sub_new['province'] = self.df_sub_new['address'].map(lambda s: s.split()[0])
-        self.df_sub_new['city'] = self.df_sub_new['address'].map(lambda s: s.split()[1])
-        self.df_sub_new['district'] = self.df_sub_new['address'].map(lambda s: s.split()[2])
-
-        # 省、市信息清洗
-        def province_clean(province):
-            if province[-1] == '省':
-                return province[:-1]
-            if province == '广西壮族自治区':
-                return '广西'
-            if province == '内蒙古自治区':
-                return '内蒙古'
-            if province == '宁夏回族自治区':
-                return '宁夏'
-            return province
-
-        def city_clean(city):
-            if city[-1] == '市':
-                return city[:-1]
-            if city == '大理白族自治州':
-                return '大理'
-            if city == '延边朝鲜族自治州':
-                return '延边'
-            s = re.search(r'^(黔东南|黔西南|西双版纳|.{2}).*族自治州$', city)
-            if s:
-                return s.group(1)
-            return city
-
-        self.df_sub_new['province'] = self.df_sub_new['province'].apply(province_clean)
-        self.df_sub_new['city'] = self.df_sub_new['city'].apply(city_clean)
-        # district 信息清洗
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '广东') & (self.df_sub_new['city'] == '东莞'), 'district'] = '东莞市'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '广东') & (self.df_sub_new['city'] == '中山'), 'district'] = '中山市'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '江苏') & (self.df_sub_new['city'] == '苏州') &
-                       (self.df_sub_new['district'].isin(['苏州工业园区', '园区'])), 'district'] = '吴中区'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '湖北') & (self.df_sub_new['city'] == '潜江'), 'district'] = '潜江市'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '湖北') & (self.df_sub_new['city'] == '仙桃'), 'district'] = '仙桃市'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '湖北') & (self.df_sub_new['city'] == '天门'), 'district'] = '天门市'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '安徽') & (self.df_sub_new['city'] == '芜湖') &
-                       (self.df_sub_new['district'] == '无为县'), 'district'] = '无为市'
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '海南') & (~self.df_sub_new['city'].isin(['三亚', '海口'])),
-                       'district'] = self.df_sub_new.loc[
-            (self.df_sub_new['province'] == '海南') & (~self.df_sub_new['city'].isin(['三亚', '海口'])), 'city']
-        self.df_sub_new.loc[(self.df_sub_new['province'] == '海南') & (~self.df_sub_new['city'].isin(['三亚', '海口'])), 'city'] = '海南'
-        self.df_sub_new = self.df_sub_new.merge(city_tier, on=['province', 'city', 'district'], how='left')
-        print('城市级别匹配完成！匹配率:',
-              '{:.1%}'.format(self.df_sub_new[self.df_sub_new['tier'].notnull()].shape[0] / self.new_usable_suborder_num))
+        with self.monitor.stage('cate_num', rows_in=self.df_sub_new.shape[0]) as rec:
+            cate_num = self.df_sub_new.groupby(['order_id']).agg(cate_num=('category', 'nunique'),
+                                                            channel_num=('channel', 'nunique')).reset_index()
+            self.df_sub_new = self.df_sub_new.merge(cate_num, on='order_id', how='left')
+            rec['rows_out'] = self.df_sub_new.shape[0]
+
+        # 3. 标注地域和城市级别：每个不同地址只拆分一次，每个不同的（省, 市, 区）只清洗一次，结果一次映射回子订单
+        with self.monitor.stage('region', rows_in=self.df_sub_new.shape[0]) as rec:
+            city_tier = self.ref_cache.read_excel(self.city_tier_file)
+            region = self.address_parser.parse(self.df_sub_new['address'], city_tier)
+            if self.address_parser.new_prefixes and self.save_caches:
+                self.address_parser.save()
+            self.df_sub_new = pd.concat([self.df_sub_new.reset_index(drop=True), region], axis=1)
+            rec['rows_out'] = self.df_sub_new.shape[0]
+            print('城市级别匹配完成！匹配率:',
+                  '{:.1%}'.format(self.df_sub_new[self.df_sub_new['tier'].notnull()].shape[0] / self.new_usable_suborder_num))
 
         # 4. 标记CRM会员
         if self.crm_file:
-            crm_info = pd.read_excel(self.crm_file).rename(columns={"客户ID": "user_id"})
-            crm_info['is_crm'] = 'CRM'
-            self.df_sub_new = self.df_sub_new.merge(crm_info[['user_id', 'is_crm']], how='left')
-            self.df_sub_new['is_crm'].fillna('非CRM', inplace=True)
+            with self.monitor.stage('crm', rows_in=self.df_sub_new.shape[0]) as rec:
+                crm_info = self.ref_cache.read_excel(self.crm_file).rename(columns={"客户ID": "user_id"})
+                crm_info['is_crm'] = 'CRM'
+                self.df_sub_new = self.df_sub_new.merge(crm_info[['user_id', 'is_crm']], how='left')
+                rec['rows_out'] = self.df_sub_new.shape[0]
+                self.df_sub_new['is_crm'].fillna('非CRM', inplace=True)
 
         # 5. 标记促销
         if self.promo_file:
-            promo_info = pd.read_excel(self.promo_file)
-            promo_info['dt'] = promo_info[['起始日期', '终止日期']].apply(
-                lambda x: pd.date_range(start=x[0], end=x[1], freq='D'), axis=1)
-            promo_info['dt'] = promo_info['dt'].apply(lambda x: [datetime.strftime(e, '%Y-%m-%d') for e in x])
-            promo_info = promo_info.explode('dt')
-            promo_info = promo_info.rename(columns={
-                '促销活动': 'promotion',
-                '促销类型': 'promo_type'
-            })[['dt', 'promotion', 'promo_type', 'sku_id']]
-            promo_info['dt'] = promo_info['dt'].astype('datetime64[ns]')
-            live_info = promo_info.loc[promo_info['promotion'].str.contains('直播')].rename(columns={'promotion':'live_name', 'promo_type':'live'})
-            promo_info = promo_info.loc[~promo_info['promotion'].str.contains('直播'), ['dt', 'promotion', 'promo_type']]
-            # 标记促销
-            self.df_sub_new = self.df_sub_new.merge(promo_info, on=['dt'], how='left')
-            # 标记直播
-            self.df_sub_new = self.df_sub_new.merge(live_info, on=['dt', 'sku_id'], how='left')
-            self.df_sub_new['promotion'].fillna(self.df_sub_new['live_name'], inplace=True)
-            self.df_sub_new['promo_type'].fillna(self.df_sub_new['live'], inplace=True)
-            self.df_sub_new = self.df_sub_new.drop(['live_name', 'live'], axis=1)
-            self.df_sub_new['promotion'].fillna('无', inplace=True)
-            self.df_sub_new['promo_type'].fillna('平日', inplace=True)
+            with self.monitor.stage('promotion', rows_in=self.df_sub_new.shape[0]):
+                # 全店活动优先，其次是该sku的直播；在区间索引上一次查出，不再把活动展开成逐日的表
+                promo_calendar = PromoCalendar(self.ref_cache.read_excel(self.promo_file))
+                promo_tag = promo_calendar.tag(self.df_sub_new['dt'], self.df_sub_new['sku_id'])
+                self.df_sub_new['promotion'] = promo_tag['promotion'].to_numpy()
+                self.df_sub_new['promo_type'] = promo_tag['promo_type'].to_numpy()
 
-    def mark_rebuy(self):
+    def migrate_csv(self):
+        """
+        历史订单库为空时，把旧版历史订单CSV一次性导入分区存储
+        """
+        for csv_file, table in [(self.pre_order_file, self.order_table), (self.pre_suborder_file, self.suborder_table)]:
+            if not self.store.exists(table) and os.path.exists(csv_file):
+                n = self.store.import_csv(csv_file, table, dtype={'联系手机': 'str', 'live': 'str'})
+                print(f'已将{csv_file}迁移至历史订单库，共{n}行')
+
+    def load_history(self, columns=None, sub_columns=None, months=None, start_month=None, end_month=None, report=False):
+        """
+        从历史订单库读取订单和订单明细，只读需要的列和月份，并转为紧凑类型
+        - columns / sub_columns: 订单 / 订单明细需要的列，None表示全部列；
+          sub_columns为None时订单明细只有商品级字段（item_cols），sub_columns中的订单级字段按order_id从订单表关联
+        - months 或 start_month/end_month: 需要的月份，如 '2020-03-01'
+        - report: 是否打印转换前后的内存占用
+        """
+        order_cols = None
+        if columns is not None and sub_columns is not None:
+            order_cols = list(dict.fromkeys(['order_id'] + columns + [c for c in sub_columns if c not in self.item_cols]))
+        orders = Schema.apply(self.store.load(self.order_table, columns=order_cols, months=months,
+                                              start_month=start_month, end_month=end_month))
+        # 旧版明细分区里存有全部字段，只读商品级字段
+        items = Schema.apply(self.store.load(self.suborder_table, columns=self.item_cols, months=months,
+                                             start_month=start_month, end_month=end_month))
+        df = orders if columns is None else orders[[c for c in columns if c in orders.columns]]
+        df_sub = items
+        if sub_columns is not None:
+            df_sub = SubOrderView(orders, items).view(sub_columns)
+            df_sub = df_sub[[c for c in sub_columns if c in df_sub.columns]]
+        if report:
+            for table, data in [(self.order_table, df), (self.suborder_table, df_sub)]:
+                # 与逐列object字符串的存储方式比较
+                before = Schema.memory_mb(data.astype({c: 'object' for c in data.columns if data[c].dtype == 'category'}))
+                print(f'{table}内存占用：{before:.1f}MB → {Schema.memory_mb(data):.1f}MB')
+        return df, df_sub
+
+    def load_user_index(self):
         """
-        读取历史订单数据，然后标记新订单里用户是第几次下单，以及该订单是否是复购订单
-        """
-        # 读取历史文件
-        self.df = pd.read_csv(self.pre_order_file, dtype={'联系手机': 'str', 'live': 'str'})
-        self.df['dt'] = self.df['dt'].astype('datetime64[ns]')
-        self.df_sub = pd.read_csv(self.pre_suborder_file, dtype={'联系手机': 'str', 'live': 'str'})
-        self.df_sub['dt'] = self.df_sub['dt'].astype('datetime64[ns]')
-        # 标注下单序数
-        #逻辑：先对新订单排序，再加上老订单次序
-        order_sort = self.df_sub_new[['user_id', 'order_time']].drop_duplicates().sort_values(['user_id', 'order_time']).reset_index(drop=True)
-        tmp = order_sort.groupby('user_id').agg(order_count = ('order_time', 'count')).reset_index()
-        order_sort = order_sort.merge(tmp)
-        user_order_num = self.df.groupby(['user_id']).agg({'nth_order':'max'}).reset_index()
-        order_sort = order_sort.merge(user_order_num, on='user_id', how='left')
-        order_sort['nth_order'].fillna(value=0, inplace=True)
-        order_sort2 = order_sort[order_sort['order_count'] > 1][['user_id', 'order_time']]
-        order_sort2 = pd.concat([order_sort2,
-                                order_sort2.groupby('user_id').transform(lambda x: list(range(1, len(x) + 1)))
-                                        ], axis=1)
-        order_sort2.columns = ['user_id', 'order_time', 'nth_order_2']
-        order_sort = order_sort.merge(order_sort2, how='left')
-        order_sort['nth_order_2'].fillna(value=1, inplace=True)
-        order_sort['nth_order'] += order_sort['nth_order_2']
-        order_sort['nth_order'] = order_sort['nth_order'].astype('int64')
-        order_sort = order_sort[['user_id', 'order_time', 'nth_order']]
-        self.df_sub_new = self.df_sub_new.merge(order_sort, on=['user_id', 'order_time'], how='left')
+        读取用户下单索引，索引不存在时用历史订单构建一次
+        """
+        self.migrate_csv()
+        if not self.user_index.load():
+            self.user_index.build(self.store.load(self.order_table,
+                                                  columns=['user_id', 'order_time', 'dt', 'order_value', 'nth_order']))
+
+    def order_sequence(self, df_sub_new):
+        """
+        根据用户下单索引计算新订单的下单序数，返回 user_id, order_time, nth_order
+        """
+        self.load_user_index()
+        # 逻辑：新订单按 (user_id, order_time) 组内累计计数，再加上索引中的历史下单次数，只与新订单数量有关
+        # 有补录订单（不晚于该用户最近一次下单）的用户不能直接累加，需连同历史订单一起重排
+        late = self.user_index.late_users(df_sub_new)
+        if len(late) == 0:
+            return self.user_index.assign(df_sub_new)
+        is_late = df_sub_new['user_id'].isin(late)
+        order_sort = self.user_index.assign(df_sub_new.loc[~is_late])
+        return pd.concat([order_sort, self.resequence_users(late, df_sub_new.loc[is_late])], ignore_index=True)
+
+    def resequence_users(self, users=None, new_orders=None):
+        """
+        对用户的全部订单（历史订单 + 本批新订单）重新计算下单序数，users为None表示全部用户。
+        历史订单中序数有变化的，只改写所在的分区文件；用户下单索引中这些用户的状态重新汇总。
+        返回本批新订单的 user_id, order_time, nth_order
+        """
+        cols = ['order_id', 'user_id', 'order_time', 'dt', 'order_value', 'month']
+        orders = self.store.load(self.order_table, columns=cols + ['nth_order'])
+        orders = orders.assign(user_id=orders['user_id'].astype('object'), order_time=pd.to_datetime(orders['order_time']),
+                               dt=orders['dt'].astype('datetime64[ns]'), is_new=False)
+        if users is not None:
+            orders = orders.loc[orders['user_id'].isin(users)]
+        if new_orders is not None:
+            new_orders = new_orders.drop_duplicates('order_id')[cols].assign(is_new=True)
+            orders = pd.concat([orders, new_orders], ignore_index=True)
+        nth_order = UserOrderIndex.sequence(orders)
+        changed = ~orders['is_new'].astype(bool) & (nth_order != orders['nth_order'])
+        if changed.any():
+            values = pd.DataFrame({'nth_order': nth_order[changed].to_numpy(), 'is_rebuy': nth_order[changed].to_numpy() > 1},
+                                  index=orders.loc[changed, 'order_id'])
+            n = self.store.update(self.order_table, 'order_id', values, months=orders.loc[changed, 'month'].unique())
+            self.order_cube_ready, self.order_cube_stale = False, True
+            print(f"{orders.loc[changed, 'user_id'].nunique()}个用户的下单序数重排，改写历史订单{n}个")
+        orders['nth_order'] = nth_order
+        self.user_index.reset_users(orders)
+        new = orders.loc[orders['is_new'].astype(bool), ['user_id', 'order_time', 'nth_order']]
+        return new.drop_duplicates(['user_id', 'order_time']).reset_index(drop=True)
+
+    def rebuild_order_sequence(self):
+        """
+        全量重排历史订单的下单序数和复购标记，并重建用户下单索引
+        """
+        self.migrate_csv()
+        self.user_index.load()
+        self.resequence_users()
+        self.user_index.save()
+        self.load_order_cube()
+
+    def load_upserted(self):
+        """
+        按订单号在全部月份中查找upsert订单的旧记录（只读两三列）：新数据里订单的下单时间可能改到了别的月份，
+        旧记录不一定在新数据所在的月份
+        """
+        if self.upserted is None:
+            old = self.store.load(self.order_table, columns=['order_id', 'user_id', 'month', 'nth_order'])
+            self.upserted = old.loc[old['order_id'].isin(self.upsert_ids)].reset_index(drop=True)
+        return self.upserted
+
+    def kept_order_sequence(self):
+        """
+        upsert的订单沿用历史记录中的下单序数，返回 order_id → nth_order
+        """
+        return self.load_upserted().set_index('order_id')['nth_order']
+
+    def remove_upserted(self):
+        """
+        删除upsert订单在历史订单库中的旧记录（在旧记录所在的月份里删除）
+        """
+        months = self.load_upserted()['month'].unique()
+        n = self.store.delete(self.order_table, 'order_id', self.upsert_ids, months=months)
+        self.store.delete(self.suborder_table, 'order_id', self.upsert_ids, months=months)
+        self.order_cube_ready, self.order_cube_stale = False, True
+        self.cohort_ready, self.cohort_stale = False, True
+        print(f'已替换历史订单{n}个')
+
+    def reset_upserted_users(self, users):
+        """
+        upsert订单写入历史订单库之后调用：订单金额、下单时间可能有变化，涉及的用户（新旧记录中的用户）按历史订单重新汇总用户下单索引
+        """
+        users = np.union1d(self.load_upserted()['user_id'].astype(str), np.asarray(users, dtype=str))
+        orders = self.store.load(self.order_table, columns=['user_id', 'order_time', 'dt', 'order_value', 'nth_order'])
+        orders = orders.loc[orders['user_id'].isin(users)]
+        orders = orders.assign(user_id=orders['user_id'].astype('object'), order_time=pd.to_datetime(orders['order_time']),
+                               dt=orders['dt'].astype('datetime64[ns]'))
+        self.user_index.reset_users(orders, users=users)
+
+    def update_order_cube(self, df_new):
+        """
+        一批新订单写入历史订单库之后调用：把这批订单合并进订单日汇总。
+        汇总表不存在、或历史订单有改写时，用历史订单重建（已包含这批订单）
+        """
+        if self.order_cube_ready or (not self.order_cube_stale and self.order_cube.load()):
+            self.order_cube.add(df_new)
+        else:
+            self.order_cube.build(self.store.load(self.order_table, columns=OrderCube.order_cols))
+        self.order_cube_ready, self.order_cube_stale = True, False
+
+    def load_order_cube(self):
+        """
+        读取订单日汇总，不存在或历史订单有改写时用历史订单重建
+        """
+        if self.order_cube_ready:
+            return
+        if self.order_cube_stale or not self.order_cube.load():
+            self.order_cube.build(self.store.load(self.order_table, columns=OrderCube.order_cols))
+            self.order_cube.save()
+        self.order_cube_ready, self.order_cube_stale = True, False
+
+    def update_cohort(self, df_new):
+        """
+        一批新订单写入历史订单库之后调用：更新同期群留存。状态不存在、或有订单被替换时，用历史订单重建（已包含这批订单）
+        """
+        if self.cohort_ready or (not self.cohort_stale and self.cohort.load()):
+            self.cohort.add(df_new)
+        else:
+            self.cohort.build(self.store.load(self.order_table, columns=CohortRetention.order_cols))
+        self.cohort_ready, self.cohort_stale = True, False
+
+    def load_cohort(self):
+        """
+        读取同期群留存，不存在或有订单被替换时用历史订单重建
+        """
+        if self.cohort_ready:
+            return
+        if self.cohort_stale or not self.cohort.load():
+            self.cohort.build(self.store.load(self.order_table, columns=CohortRetention.order_cols))
+            self.cohort.save()
+        self.cohort_ready, self.cohort_stale = True, False
+
+    def load_user_timeline(self):
+        """
+        读取用户下单时间线（内存映射），与当前读取的历史订单不一致时重新构建并保存
+        """
+        signature = UserTimeline.signature(self.df, self.df_sub)
+        if not self.user_timeline.load(signature):
+            self.user_timeline.build(self.df, self.df_sub)
+            self.user_timeline.save()
+            self.user_timeline.load(signature)
+        return self.user_timeline
+
+    @staticmethod
+    def apply_order_sequence(df_sub_new, order_sort, kept=None):
+        """
+        把下单序数并回子订单，标注是否复购，返回 (子订单, 订单)
+        - kept: upsert订单沿用的下单序数（order_id → nth_order）
+        """
+        df_sub_new = df_sub_new.merge(order_sort, on=['user_id', 'order_time'], how='left')
+        if kept is not None:
+            df_sub_new['nth_order'] = df_sub_new['order_id'].map(kept).fillna(df_sub_new['nth_order']).astype('int64')
         # 标注是否复购订单
-        self.df_sub_new['is_rebuy'] = self.df_sub_new['nth_order'] > 1
+        df_sub_new['is_rebuy'] = df_sub_new['nth_order'] > 1
         # 删除多余字段
-        self.df_sub_new = self.df_sub_new.drop('title_clean', axis=1)
-        self.df_new = self.df_sub_new.drop_duplicates(['order_id'])
-        self.df_new = self.df_new.drop('title_refined', axis=1)
+        df_sub_new = df_sub_new.drop('title_clean', axis=1)
+        df_new = df_sub_new.drop_duplicates(['order_id']).drop('title_refined', axis=1)
+        return df_sub_new, df_new
+
+    def mark_rebuy(self):
+        """
+        根据用户下单索引，标记新订单里用户是第几次下单，以及该订单是否是复购订单
+        """
+        upsert = self.df_sub_new['order_id'].isin(self.upsert_ids)
+        with self.monitor.stage('order_sequence', rows_in=int((~upsert).sum())) as rec:
+            order_sort = self.order_sequence(self.df_sub_new.loc[~upsert])
+            rec['rows_out'] = order_sort.shape[0]
+        kept = None
+        if upsert.any():
+            with self.monitor.stage('kept_order_sequence', rows_in=int(upsert.sum())):
+                kept = self.kept_order_sequence()
+        with self.monitor.stage('apply_order_sequence', rows_in=self.df_sub_new.shape[0]) as rec:
+            self.df_sub_new, self.df_new = self.apply_order_sequence(self.df_sub_new, order_sort, kept)
+            rec['rows_out'] = self.df_new.shape[0]
         self.new_usable_order_num = self.df_new.shape[0]
         print("复购订单标注完成！")
 
     def union_data(self):
         """
-        合并订单数据并储存为历史数据
+        新数据按月份追加到历史订单库，只写新增的分区文件；然后读出全部历史供分析模块使用
         """
-        # 数据备份
-#         now = datetime.today().strftime("%Y%m%d_%H:%M:%S")
-#         self.df.to_csv(f"数据存档/历史订单bak_{now}.csv")
-#         self.df_sub.to_csv(f"数据存档/历史订单明细bak_{now}.csv")
-        # 数据合并
-        self.df = pd.concat([self.df, self.df_new], axis=0, ignore_index=True)
-        self.df_sub = pd.concat([self.df_sub, self.df_sub_new], axis=0, ignore_index=True)
-        self.df.to_csv("数据存档/历史订单_test.csv", index=False)
-        self.df_sub.to_csv("数据存档/历史订单明细_test.csv", index=False)
+        upsert = self.df_new['order_id'].isin(self.upsert_ids)
+        if upsert.any():
+            with self.monitor.stage('remove_upserted', rows_in=int(upsert.sum())):
+                self.remove_upserted()
+        with self.monitor.stage('append_orders', rows_in=self.df_new.shape[0]):
+            self.store.append(Schema.apply(self.df_new), self.order_table)
+        if upsert.any():
+            with self.monitor.stage('reset_upserted_users', rows_in=int(upsert.sum())):
+                self.reset_upserted_users(self.df_new.loc[upsert, 'user_id'].unique())
+        with self.monitor.stage('append_items', rows_in=self.df_sub_new.shape[0]):
+            self.store.append(Schema.apply(self.df_sub_new[self.item_cols]), self.suborder_table)
+        with self.monitor.stage('update_order_cube', rows_in=self.df_new.shape[0]):
+            self.update_order_cube(self.df_new)
+        with self.monitor.stage('update_cohort', rows_in=self.df_new.shape[0]):
+            self.update_cohort(self.df_new)
+        with self.monitor.stage('save_indexes'):
+            self.user_index.save()
+            self.order_id_index.add(self.df_new['order_id'])
+            self.order_id_index.save()
+            self.order_cube.save()
+            self.cohort.save()
+        with self.monitor.stage('load_history') as rec:
+            self.df, self.df_sub = self.load_history(report=True)
+            rec['rows_out'] = self.df_sub.shape[0]
+
+    def stream_process(self):
+        """
+        分块流式处理新订单：每块处理完的子订单先暂存到磁盘，内存中只保留标注下单序数需要的几列；
+        整批标注下单序数后，再逐块标注复购并追加到历史订单库
+        """
+        counters = self.batch_counters
+        total = dict.fromkeys(counters, 0)
+        total['new_usable_order_num'] = 0
+        keys = []
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(self.history_dir) or None) as spool_dir:
+            spool_files = []
+            for i, df_sub_new in enumerate(self.iter_batches(self.chunksize)):
+                for name in counters:
+                    total[name] += getattr(self, name)
+                if df_sub_new is None:
+                    continue
+                path = os.path.join(spool_dir, f'{i}.pkl')
+                with self.monitor.stage('spool_chunk', rows_in=df_sub_new.shape[0]):
+                    df_sub_new.to_pickle(path)
+                spool_files.append(path)
+                keys.append(df_sub_new.drop_duplicates('order_id')[['user_id', 'order_time', 'order_id', 'dt', 'order_value', 'month']])
+                # 后面的块里再出现这些订单时跳过
+                self.order_id_index.add(df_sub_new['order_id'])
+            self.df_new = self.df_sub_new = None
+            keys = pd.concat(keys, ignore_index=True) if keys else pd.DataFrame(
+                columns=['user_id', 'order_time', 'order_id', 'dt', 'order_value', 'month'])
+            upsert = keys['order_id'].isin(self.upsert_ids)
+            with self.monitor.stage('order_sequence', rows_in=int((~upsert).sum())) as rec:
+                order_sort = self.order_sequence(keys.loc[~upsert])
+                rec['rows_out'] = order_sort.shape[0]
+            kept = None
+            upsert_users = keys.loc[upsert, 'user_id'].unique()
+            if upsert.any():
+                with self.monitor.stage('remove_upserted', rows_in=int(upsert.sum())):
+                    kept = self.kept_order_sequence()
+                    self.remove_upserted()
+            del keys
+            for path in spool_files:
+                with self.monitor.stage('write_chunk') as rec:
+                    df_sub_new, df_new = self.apply_order_sequence(pd.read_pickle(path), order_sort, kept)
+                    self.store.append(Schema.apply(df_new), self.order_table)
+                    self.store.append(Schema.apply(df_sub_new[self.item_cols]), self.suborder_table)
+                    self.update_order_cube(df_new)
+                    self.update_cohort(df_new)
+                    rec['rows_in'], rec['rows_out'] = df_sub_new.shape[0], df_new.shape[0]
+                total['new_usable_order_num'] += df_new.shape[0]
+            if len(upsert_users) > 0:
+                with self.monitor.stage('reset_upserted_users', rows_in=len(upsert_users)):
+                    self.reset_upserted_users(upsert_users)
+        for name, value in total.items():
+            setattr(self, name, value)
+        print("复购订单标注完成！")
+        with self.monitor.stage('save_indexes'):
+            self.user_index.save()
+            self.order_id_index.save()
+            if self.order_cube_ready:
+                self.order_cube.save()
+            if self.cohort_ready:
+                self.cohort.save()
+        with self.monitor.stage('load_history') as rec:
+            self.df, self.df_sub = self.load_history(report=True)
+            rec['rows_out'] = self.df_sub.shape[0]
+
+    def batch_process(self, max_workers=None):
+        """
+        多个文件一起导入：各文件的读取/标题清洗/sku匹配/地域和促销标注在进程池中并行，
+        子进程新增的缓存（标题清洗、地址清洗、sku索引、待确认标题）由主进程合并保存；
+        之后整批统一标注下单序数，一次写入历史订单库
+        """
+        self.load_order_ids()
+        if self.sku_index.keys is None:
+            self.sku_index.load()
+        files = self.new_order_files
+        with self.monitor.stage('prepare_files') as rec:
+            with ProcessPoolExecutor(max_workers=max_workers or min(len(files), os.cpu_count() or 1)) as executor:
+                results = list(executor.map(_prepare_file, [self] * len(files), files))
+            rec['rows_out'] = sum(self.monitor.rows(res['df_sub_new']) for res in results)
+
+        total = dict.fromkeys(self.batch_counters, 0)
+        parts = []
+        for i, res in enumerate(results):
+            for name in self.batch_counters:
+                total[name] += res['counters'][name]
+            self.title_cleaner.cache.update(res['title_cache'])
+            self.address_parser.cache.update(res['address_cache'])
+            self.sku_index.add_keys(res['sku_keys'])
+            if res['fuzzy_review'] is not None:
+                self.fuzzy_review = pd.concat([self.fuzzy_review, res['fuzzy_review']]).drop_duplicates(['title_clean', '候选标题'])
+            self.upsert_ids = np.union1d(self.upsert_ids, res['upsert_ids'])
+            self.monitor.extend(res['stages'], prefix=f'file{i}')
+            if res['df_sub_new'] is not None:
+                parts.append(res['df_sub_new'].assign(file_no=i))
+        self.title_cleaner.save()
+        self.address_parser.save()
+        self.sku_index.save()
+        if self.fuzzy_review is not None:
+            self.fuzzy_review.to_excel(self.fuzzy_review_file, index=False)
+        for name, value in total.items():
+            setattr(self, name, value)
+
+        if not parts:
+            self.new_usable_order_num = 0
+            self.df, self.df_sub = self.load_history()
+            return
+        # 多个文件里重复的订单，只保留排在前面的文件中的
+        df_sub_new = pd.concat(parts, ignore_index=True)
+        first_file = df_sub_new.groupby('order_id')['file_no'].transform('min')
+        dup = df_sub_new['file_no'] != first_file
+        self.new_skipped_order_num += df_sub_new.loc[dup, 'order_id'].nunique()
+        self.df_sub_new = df_sub_new.loc[~dup].drop(columns='file_no').reset_index(drop=True)
+        self.new_usable_suborder_num = self.df_sub_new.shape[0]
+        with self.monitor.stage('mark_rebuy', rows_in=self.new_usable_suborder_num) as rec:
+            self.mark_rebuy()
+            rec['rows_out'] = self.new_usable_order_num
+        with self.monitor.stage('union_data', rows_in=self.new_usable_order_num):
+            self.union_data()
 
     def main(self):
-        self.read_data()
-        self.sku_map()
-        self.add_fields()
-        self.mark_rebuy()
-        self.union_data()
+        self.monitor.start()
+        with self.monitor.stage('load_reference'):
+            self.load_reference()
+        if len(self.new_order_files) > 1:
+            with self.monitor.stage('batch_process'):
+                self.batch_process()
+        elif self.chunksize:
+            with self.monitor.stage('stream_process'):
+                self.stream_process()
+        else:
+            with self.monitor.stage('read_data') as rec:
+                self.read_data()
+                rec['rows_out'] = self.monitor.rows(self.df_new)
+            self.prepare_batch()
+            if self.df_sub_new is not None:
+                with self.monitor.stage('mark_rebuy', rows_in=self.new_usable_suborder_num) as rec:
+                    self.mark_rebuy()
+                    rec['rows_out'] = self.new_usable_order_num
+                with self.monitor.stage('union_data', rows_in=self.new_usable_order_num):
+                    self.union_data()
+            else:
+                self.new_usable_order_num = 0
+                with self.monitor.stage('load_history'):
+                    self.df, self.df_sub = self.load_history()
+        if self.user_index.state.shape[0] == 0:
+            # 本次没有新订单（如全部已入库）时没有读过用户下单索引，报表的RFM要用到
+            self.load_user_index()
+        with self.monitor.stage('load_order_cube'):
+            self.load_order_cube()
+        with self.monitor.stage('load_cohort'):
+            self.load_cohort()
+        with self.monitor.stage('load_user_timeline', rows_in=self.df.shape[0]):
+            self.load_user_timeline()
         print("数据处理完成！")
         print("=========== 新增数据概况 ===========")
         print(f"订单数：{self.new_order_num}")
-        print(f"有效订单数：{self.new_valid_order_num}, 有效子订单数:{self.new_valid_suborder_num}")
+        print(f"有效订单数：{self.new_valid_order_num}, 已入库或重复订单数：{self.new_skipped_order_num}, 有效子订单数:{self.new_valid_suborder_num}")
         print(f"可用订单数：{self.new_usable_order_num}, 可用子订单数:{self.new_usable_suborder_num}")
         print("===================================")
+        self.monitor.finish(files=self.new_order_files, chunksize=self.chunksize, duplicate_mode=self.duplicate_mode,
+                            **{name: getattr(self, name) for name in self.batch_counters + ['new_usable_order_num']})
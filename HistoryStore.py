@@ -0,0 +1,150 @@
+import os
+import uuid
+from datetime import datetime
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+class HistoryStore:
+    """
+    历史订单库：按 month 分区的 parquet 列式存储，替代每月整表读写的历史订单CSV。
+    目录结构：{root}/{table}/month=2020-03-01/part-20200405120000-xxxxxx.parquet
+    - append(): 只写入新数据涉及的分区，已有分区追加新的part文件，不改写旧文件
+    - load(): 只读取需要的列和月份
+    - import_csv(): 从旧版历史订单CSV一次性迁移到分区存储
+    - delete() / update(): 删除或改写指定的行，只改写涉及的part文件
+    """
+    def __init__(self, root='数据存档/历史订单库'):
+        self.root = root
+
+    def _table_dir(self, table):
+        return os.path.join(self.root, table)
+
+    def _partition_dir(self, table, month):
+        return os.path.join(self._table_dir(table), f'month={month}')
+
+    def months(self, table):
+        """
+        已存储的月份（升序）
+        """
+        table_dir = self._table_dir(table)
+        if not os.path.isdir(table_dir):
+            return []
+        return sorted(name[len('month='):] for name in os.listdir(table_dir) if name.startswith('month='))
+
+    def exists(self, table):
+        return len(self.months(table)) > 0
+
+    def _files(self, table, months):
+        files = []
+        for month in months:
+            part_dir = self._partition_dir(table, month)
+            files += [os.path.join(part_dir, f) for f in sorted(os.listdir(part_dir)) if f.endswith('.parquet')]
+        return files
+
+    @staticmethod
+    def _to_storable(df):
+        # object列里混有数字和字符串时（如联系手机），统一转为字符串，保证parquet类型一致
+        df = df.copy()
+        for col in df.columns[df.dtypes == 'object']:
+            kind = pd.api.types.infer_dtype(df[col], skipna=True)
+            if kind not in ('string', 'empty'):
+                df[col] = df[col].map(lambda x: x if pd.isnull(x) else str(x))
+        return df
+
+    def append(self, df, table):
+        """
+        按month拆分写入，只新增本批数据涉及的分区文件
+        """
+        df = self._to_storable(df)
+        batch_id = datetime.today().strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:6]
+        for month, part in df.groupby('month', sort=True):
+            part_dir = self._partition_dir(table, month)
+            os.makedirs(part_dir, exist_ok=True)
+            path = os.path.join(part_dir, f'part-{batch_id}.parquet')
+            part.to_parquet(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)  # 写完再改名，避免中断时留下半个文件
+
+    def load(self, table, columns=None, months=None, start_month=None, end_month=None):
+        """
+        parameters:
+        - columns: 需要读取的列，None表示全部列
+        - months: 需要读取的月份列表，如 ['2020-03-01', '2020-04-01']
+        - start_month/end_month: 月份范围（闭区间），与months二选一
+        """
+        all_months = self.months(table)
+        if months is not None:
+            months = [m for m in all_months if m in set(months)]
+        else:
+            months = [m for m in all_months
+                      if (start_month is None or m >= start_month) and (end_month is None or m <= end_month)]
+        frames = []
+        for path in self._files(table, months):
+            cols = columns
+            if columns is not None:
+                names = pq.read_schema(path).names
+                cols = [c for c in columns if c in names]
+            frames.append(pd.read_parquet(path, columns=cols))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, axis=0, ignore_index=True)
+
+    def import_csv(self, csv_file, table, dtype=None, date_cols=('dt',)):
+        """
+        把旧版整表CSV迁移进分区存储（只需执行一次）
+        """
+        df = pd.read_csv(csv_file, dtype=dtype)
+        for col in date_cols:
+            if col in df.columns:
+                df[col] = df[col].astype('datetime64[ns]')
+        if 'order_time' in df.columns:
+            df['order_time'] = pd.to_datetime(df['order_time'])
+        self.append(df, table)
+        return df.shape[0]
+
+    def _matched_parts(self, table, column, values, months):
+        """
+        逐个part文件只读column列，返回含有 values 中取值的 (文件路径, 行掩码)
+        """
+        if months is None:
+            months = self.months(table)
+        months = [m for m in self.months(table) if m in set(months)]
+        for path in self._files(table, months):
+            mask = pd.read_parquet(path, columns=[column])[column].isin(values).to_numpy()
+            if mask.any():
+                yield path, mask
+
+    @staticmethod
+    def _write_part(part, path):
+        part.to_parquet(path + '.tmp', index=False)
+        os.replace(path + '.tmp', path)
+
+    def delete(self, table, column, values, months=None):
+        """
+        删除 column 取值在 values 中的行：只改写含有这些行的part文件，返回删除的行数
+        - months: 只在这些月份里查找，None表示全部月份
+        """
+        n = 0
+        for path, mask in list(self._matched_parts(table, column, values, months)):
+            n += int(mask.sum())
+            if mask.all():
+                os.remove(path)
+            else:
+                self._write_part(pd.read_parquet(path).loc[~mask], path)
+        return n
+
+    def update(self, table, key, values, months=None):
+        """
+        按key改写部分列：values是以key为索引的DataFrame，列为需要改写的字段；只改写含有这些key的part文件，返回改写的行数
+        - months: 只在这些月份里查找，None表示全部月份
+        """
+        n = 0
+        for path, mask in list(self._matched_parts(table, key, values.index, months)):
+            n += int(mask.sum())
+            part = pd.read_parquet(path)
+            matched = part.loc[mask, key]
+            for col in values.columns:
+                part.loc[mask, col] = matched.map(values[col]).to_numpy()
+            self._write_part(part, path)
+        return n
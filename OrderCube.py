@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from TimeIndex import TimeIndex
+
+
+class OrderCube:
+    """
+    订单日汇总：按 日期(dt) × CRM人群(is_crm) × 促销类型(promo_type) × 类别(channel) × 订单价值区间(value_bin) × 第n次下单(nth_order)
+    预先汇总订单数、销售额和购买件数。订单规律探索（OrderPattern）的月度/周内/每日分布、订单价值分布、各类别销售、
+    各次下单情况都从这张表算出，不再扫描全部订单。
+    - channel: 单类别订单为该类别，多类别订单记为 mixed_channel
+    - value_bin: 订单价值所在区间的编号（value_bins左闭右开），不在任何区间内为-1
+    - nth_order: 超过 max_nth 的记为 max_nth
+    - add(): 每批新入库的订单汇总后合并进来；历史订单有改写（替换已入库订单、重排下单序数）时用build()重建
+    """
+    keys = ['dt', 'is_crm', 'promo_type', 'channel', 'value_bin', 'nth_order']
+    value_bins = [0, 18, 28, 39, 50, 60, 80, 100, 130, 200, 20000]
+    max_nth = 7
+    mixed_channel = '多类别'
+    order_cols = ['dt', 'is_crm', 'promo_type', 'channel', 'channel_num', 'order_value', 'goods_num', 'nth_order']
+
+    def __init__(self, cube_file='数据存档/订单日汇总.parquet'):
+        self.cube_file = cube_file
+        self.data = self._empty()
+
+    def _empty(self):
+        return pd.DataFrame({
+            'dt': pd.Series(dtype='datetime64[ns]'),
+            'is_crm': pd.Series(dtype='object'),
+            'promo_type': pd.Series(dtype='object'),
+            'channel': pd.Series(dtype='object'),
+            'value_bin': pd.Series(dtype='int8'),
+            'nth_order': pd.Series(dtype='int8'),
+            'order_num': pd.Series(dtype='int64'),
+            'order_value': pd.Series(dtype='float64'),
+            'goods_num': pd.Series(dtype='int64'),
+        })
+
+    def load(self):
+        """
+        读取已保存的汇总表，文件不存在时返回False
+        """
+        if not os.path.exists(self.cube_file):
+            return False
+        self.data = pd.read_parquet(self.cube_file)
+        return True
+
+    def save(self):
+        self.data.to_parquet(self.cube_file + '.tmp', index=False)
+        os.replace(self.cube_file + '.tmp', self.cube_file)
+
+    @classmethod
+    def aggregate(cls, orders):
+        """
+        orders: 订单级数据（每单一行），包含order_cols；返回汇总后的DataFrame
+        """
+        value = orders['order_value'].to_numpy(dtype='float64')
+        value_bin = np.searchsorted(cls.value_bins, value, side='right') - 1
+        value_bin[(value < cls.value_bins[0]) | (value >= cls.value_bins[-1]) | np.isnan(value)] = -1
+        channel = orders['channel'].astype('object').where(orders['channel_num'].to_numpy() == 1, cls.mixed_channel)
+        keys = pd.DataFrame({
+            'dt': orders['dt'].astype('datetime64[ns]').to_numpy(),
+            'is_crm': orders['is_crm'].astype('object').to_numpy(),
+            'promo_type': orders['promo_type'].astype('object').to_numpy(),
+            'channel': channel.to_numpy(),
+            'value_bin': value_bin.astype('int8'),
+            'nth_order': np.minimum(orders['nth_order'].to_numpy(), cls.max_nth).astype('int8'),
+            'order_num': 1,
+            'order_value': value,
+            'goods_num': orders['goods_num'].to_numpy(dtype='int64'),
+        })
+        return cls._combine(keys)
+
+    @classmethod
+    def _combine(cls, data):
+        return data.groupby(cls.keys, dropna=False, sort=True).agg(
+            order_num=('order_num', 'sum'), order_value=('order_value', 'sum'), goods_num=('goods_num', 'sum')
+        ).reset_index()
+
+    def build(self, orders):
+        """
+        用全部历史订单重建
+        """
+        self.data = self._empty() if orders.shape[0] == 0 else self.aggregate(orders)
+
+    def add(self, orders):
+        """
+        合并一批新入库订单的汇总
+        """
+        if orders.shape[0] > 0:
+            self.data = self._combine(pd.concat([self.data, self.aggregate(orders)], ignore_index=True))
+
+    def frame(self, start=None, end=None):
+        """
+        返回汇总表，附加 month / day_of_week 两列，与订单表的字段一致；
+        start / end: 日期范围（含），汇总表按日期排序，直接二分查找截取
+        """
+        data = self.data
+        if start is not None or end is not None:
+            lo, hi = TimeIndex.bounds(data['dt'].to_numpy(dtype='datetime64[ns]'), start, end)
+            data = data.iloc[lo:hi]
+        return data.assign(month=data['dt'].dt.strftime('%Y-%m-01'), day_of_week=data['dt'].dt.dayofweek + 1)
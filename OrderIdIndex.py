@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+
+class OrderIdIndex:
+    """
+    已入库订单号索引：全部已入库订单号排好序存成一个int64数组（.npy）。
+    查询用二分查找，耗时只与本批订单数有关，不需要扫描历史订单；追加时按二分查找的位置插入，不重新排序。
+    - load() / build() / save(): 读取、用历史订单构建、保存
+    - contains(): 判断订单号是否已入库
+    - add(): 把新入库的订单号插入到有序数组中
+    """
+    def __init__(self, index_file='数据存档/订单号索引.npy'):
+        self.index_file = index_file
+        self.ids = None  # 未读取
+
+    def load(self):
+        """
+        读取已保存的索引，文件不存在时返回False
+        """
+        if not os.path.exists(self.index_file):
+            return False
+        self.ids = np.load(self.index_file)
+        return True
+
+    def build(self, order_ids):
+        self.ids = np.unique(np.asarray(order_ids, dtype='int64'))
+
+    def save(self):
+        with open(self.index_file + '.tmp', 'wb') as f:
+            np.save(f, self.ids)
+        os.replace(self.index_file + '.tmp', self.index_file)
+
+    def contains(self, order_ids):
+        order_ids = np.asarray(order_ids, dtype='int64')
+        if len(self.ids) == 0:
+            return np.zeros(len(order_ids), dtype=bool)
+        pos = np.minimum(np.searchsorted(self.ids, order_ids), len(self.ids) - 1)
+        return self.ids[pos] == order_ids
+
+    def add(self, order_ids):
+        """
+        插入尚未入库的订单号，返回新增个数
+        """
+        order_ids = np.unique(np.asarray(order_ids, dtype='int64'))
+        order_ids = order_ids[~self.contains(order_ids)]
+        self.ids = np.insert(self.ids, np.searchsorted(self.ids, order_ids), order_ids)
+        return len(order_ids)
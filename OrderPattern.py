@@ -30,6 +30,12 @@ from graphviz import Digraph
 # Excel输出
 import xlsxwriter
 
+from Binning import Binning
+from OrderCube import OrderCube
+from Schema import Schema
+from SubOrderView import SubOrderView
+from TimeIndex import TimeIndex
+
 class OrderPattern:
     """
     1. 订单的月度/周内/每日分布
@@ -37,27 +43,40 @@ class OrderPattern:
     3. 各类别商品销售情况
     4. 零售人群和餐饮人群数量变化
     5. 消费者下单次数分布
+    订单分布、订单价值分布、各类别销售和各次下单情况从订单日汇总（OrderCube）计算，不扫描全部订单；
+    cube为None时用df汇总一次
+    - start / end: 只分析这段日期内的订单（含起止日期），如一个季度或一次活动；用time_index（TimeIndex）二分查找截取，
+      不传time_index时临时建一个
     """
-    def __init__(self, df, df_sub):
+    def __init__(self, df, df_sub, cube=None, start=None, end=None, time_index=None):
+        if start is not None or end is not None:
+            df, df_sub = (time_index if time_index is not None else TimeIndex(df, df_sub)).slice(start, end)
         self.df = df
         self.df_sub = df_sub
+        if cube is None:
+            cube = OrderCube()
+            cube.build(df)
+            start = end = None
+        self.cube = Schema.apply(cube.frame(start, end))  # 字段类型与订单表一致
 
     def order_time_dist(self):
         """
         订单月度分布
         """
         # 月度分布
-        res_monthly = self.df.groupby('month').agg(
-            订单数 = ('order_id', 'count'),
+        res_monthly = self.cube.groupby('month').agg(
+            订单数 = ('order_num', 'sum'),
             总销售额 = ('order_value', 'sum'),
-            订单平均价值 = ('order_value', 'mean'),
-            每单购买件数 = ('goods_num', 'mean'),
-        ).astype({'总销售额':'int64', '订单平均价值':'int64'}).reset_index()
+            件数 = ('goods_num', 'sum'),
+        )
+        res_monthly['订单平均价值'] = res_monthly['总销售额'] / res_monthly['订单数']
+        res_monthly['每单购买件数'] = res_monthly.pop('件数') / res_monthly['订单数']
+        res_monthly = res_monthly.astype({'总销售额':'int64', '订单平均价值':'int64'}).reset_index()
         # 周内分布【区分CRM人群】
-        res_dayofweek = self.df[(self.df['promo_type'] == '平日')
-                                ].groupby(['is_crm', 'day_of_week', 'dt']).agg(订单数=('order_id', 'count'),
-                                                                          销售额=('order_value','sum')).reset_index()
-        res_dayofweek = res_dayofweek.groupby(['is_crm', 'day_of_week']).agg(
+        res_dayofweek = self.cube[(self.cube['promo_type'] == '平日')
+                                  ].groupby(['is_crm', 'day_of_week', 'dt'], observed=True).agg(订单数=('order_num', 'sum'),
+                                                                            销售额=('order_value','sum')).reset_index()
+        res_dayofweek = res_dayofweek.groupby(['is_crm', 'day_of_week'], observed=True).agg(
             频次=('day_of_week', 'count'),
             总订单数=('订单数', 'sum'),
             总销售额=('销售额', 'sum'),
@@ -66,33 +85,43 @@ class OrderPattern:
         ).astype('int64')
         res_dayofweek = res_dayofweek.unstack(0).stack(0).unstack(-1)
         # 日度分布 数据量太多，只导出图，不导出表格
-        res_daily = self.df.groupby('dt').agg(销售额 = ('order_value', 'sum')).reset_index()
+        res_daily = self.cube.groupby('dt').agg(销售额 = ('order_value', 'sum')).reset_index()
 
         return res_monthly, res_dayofweek, res_daily
 
-    def order_value_dist(self):
-        bins = [0, 18, 28, 39, 50, 60, 80, 100, 130, 200, 20000]
-        df_tmp = self.df.copy(deep=True)
-        df_tmp['订单价值区间'] = pd.cut(df_tmp['order_value'], bins=bins, right=False, include_lowest=True)
-        res_month = df_tmp.groupby(['month', '订单价值区间']).agg(订单数=('order_id', 'count')).unstack(0)
+    def order_value_dist(self, bins=None):
+        """
+        订单价值分布（区分月份、区分CRM人群）
+        - bins: 订单价值区间的边界（左闭右开），默认为OrderCube.value_bins。
+          bins都是汇总表的区间边界时直接合并汇总表中的区间，否则用订单表的订单价值重新分箱
+        """
+        bins = OrderCube.value_bins if bins is None else list(bins)
+        binning = Binning(bins, closed='left', name='订单价值区间')
+        if set(bins) <= set(OrderCube.value_bins):
+            # 汇总表每个区间的左端点落在哪个新区间，整个区间就属于哪个新区间；不在任何区间内的（-1）取到末尾的空值
+            values = np.append(OrderCube.value_bins[:-1], np.nan)[self.cube['value_bin'].to_numpy()]
+            data, weights = self.cube, self.cube['order_num']
+        else:
+            values, data, weights = self.df['order_value'], self.df, None
+        res_month = binning.count(values, data['month'], weights).astype('int64')
+        res_month = pd.concat({'订单数': res_month}, axis=1)
         res_month[('订单数', 'Total')] = res_month.sum(axis=1)
         # 区分CRM人群
-        res_crm = df_tmp.groupby(['is_crm', '订单价值区间']).agg(订单数=('order_id', 'count')).reset_index()
-        res_crm['占比'] = res_crm.groupby(['is_crm']).transform(lambda x: x / x.sum())
-#         res_crm['占比'] = res_crm['占比'].apply(lambda x: '{:.1%}'.format(x))
-        res_crm = res_crm.set_index(['is_crm', '订单价值区间']).unstack(0).stack(0).unstack(-1)
+        res_crm = binning.count(values, data['is_crm'], weights).astype('int64')
+        res_crm = pd.concat({'订单数': res_crm, '占比': res_crm / res_crm.sum()}, axis=1).swaplevel(axis=1)
         res_crm = res_crm[[( 'CRM', '订单数'),( 'CRM',  '占比'),('非CRM', '订单数'), ('非CRM',  '占比')]]
         return res_month, res_crm
 
     def channel_sales(self):
        # 只取单类别订单
-        df_one_channel = self.df_sub[self.df_sub['channel_num'] == 1].drop_duplicates('order_id')
-        res_channel_ttl = df_one_channel.groupby('channel').agg(
-            订单数 = ('order_id', 'count'),
+        df_one_channel = self.cube[self.cube['channel'] != OrderCube.mixed_channel]
+        res_channel_ttl = df_one_channel.groupby('channel', observed=True).agg(
+            订单数 = ('order_num', 'sum'),
             销售额 = ('order_value', 'sum'),
-            每单购买件数 = ('goods_num', 'mean'),
-            订单平均价值 = ('order_value', 'mean')
+            件数 = ('goods_num', 'sum')
         )
+        res_channel_ttl['每单购买件数'] = res_channel_ttl['件数'] / res_channel_ttl['订单数']
+        res_channel_ttl['订单平均价值'] = res_channel_ttl['销售额'] / res_channel_ttl['订单数']
         res_channel_ttl['订单数占比'] = res_channel_ttl['订单数'] / sum(res_channel_ttl['订单数'])
         res_channel_ttl['GMV占比'] = res_channel_ttl['销售额'] / sum(res_channel_ttl['销售额'])
         cols = ['订单数', '订单数占比', '销售额', 'GMV占比', '每单购买件数', '订单平均价值']
@@ -100,7 +129,7 @@ class OrderPattern:
         res_channel_ttl[['销售额', '订单平均价值']] = res_channel_ttl[['销售额', '订单平均价值']].astype('int64')
 
         # 销售额指数
-        res_channel_monthly = df_one_channel.groupby(['channel', 'month']).agg(销售额=('order_value', 'sum'))
+        res_channel_monthly = df_one_channel.groupby(['channel', 'month'], observed=True).agg(销售额=('order_value', 'sum'))
         res_channel_monthly = res_channel_monthly.unstack(0)
         for col_name in res_channel_monthly.columns: ## 后面试试有没有更简单的方法！！！
             a, channel = col_name
@@ -109,53 +138,53 @@ class OrderPattern:
         return res_channel_ttl, res_channel_monthly
 
     def uv_type(self):
-        # 计算各月的累计餐饮人群、零售人群、交叉人群
-        res_uv_type = pd.DataFrame(columns=['month', '餐饮人群', '餐饮人群占比', '零售人群', '零售人群占比', '交叉人群', '交叉人群占比', '总人数'])
-        start_month = min(self.df['month'])
-        end_month = max(self.df['dt'])
-        for mon in pd.date_range(start=start_month, end=end_month, freq='M'):
-            mon = str(mon.strftime('%Y-%m-01'))
-            tmp = self.df_sub[(self.df_sub['channel'].isin(['RT', 'FS'])) & (self.df_sub['month'] <= mon)].drop_duplicates(['user_id', 'channel'])
-            tmp = tmp.groupby(['user_id']).agg(channel_num=('channel', 'nunique'), channel=('channel', 'max'))
-            total_uv = tmp.shape[0]
-            fs_uv = tmp[(tmp['channel'] == 'FS') & (tmp['channel_num'] == 1)].shape[0]
-            rt_uv = tmp[(tmp['channel'] == 'RT') & (tmp['channel_num'] == 1)].shape[0]
-            cross_uv = tmp[tmp['channel_num'] == 2].shape[0]
-            res_uv_type = res_uv_type.append({
-                'month': mon,
-                '餐饮人群': fs_uv,
-                '餐饮人群占比': fs_uv / total_uv,
-                '零售人群': rt_uv,
-                '零售人群占比': rt_uv / total_uv,
-                '交叉人群': cross_uv,
-                '交叉人群占比': cross_uv / total_uv,
-                '总人数': total_uv
-            }, ignore_index=True)
+        """
+        计算各月的累计餐饮人群、零售人群、交叉人群。
+        一次求出每个用户首次购买餐饮(FS)/零售(RT)商品的月份，各月人数由首购月份的计数按月累加得到，不再逐月重新筛选全部明细
+        """
+        sub = SubOrderView(self.df, self.df_sub).view(['user_id'])
+        sub = sub.loc[sub['channel'].isin(['RT', 'FS']), ['user_id', 'channel', 'month']]
+        first = sub.assign(channel=sub['channel'].astype('object')).groupby(['user_id', 'channel'], observed=True)['month'].min()
+        first = first.unstack('channel').reindex(columns=['FS', 'RT']).apply(pd.to_datetime)
+        months = pd.date_range(start=min(self.df['month']), end=max(self.df['dt']), freq='M').to_period('M').to_timestamp()
+
+        def cum_uv(first_month):
+            # 首购月份不晚于各月的人数
+            return first_month.value_counts().reindex(months, fill_value=0).cumsum().to_numpy()
+
+        fs_any = cum_uv(first['FS'])
+        rt_any = cum_uv(first['RT'])
+        cross_uv = cum_uv(first.max(axis=1, skipna=False))  # 两类都买过：两个首购月份中较晚的一个
+        total_uv = cum_uv(first.min(axis=1))  # 任一类：两个首购月份中较早的一个
+        res_uv_type = pd.DataFrame({
+            'month': months.strftime('%Y-%m-01'),
+            '餐饮人群': fs_any - cross_uv,
+            '零售人群': rt_any - cross_uv,
+            '交叉人群': cross_uv,
+            '总人数': total_uv
+        })
+        for col in ['餐饮人群', '零售人群', '交叉人群']:
+            res_uv_type.insert(res_uv_type.columns.get_loc(col) + 1, col + '占比', res_uv_type[col] / res_uv_type['总人数'])
         return res_uv_type
 
     def order_num_dist(self):
         # 累计下单次数分布
-        max_order_num = self.df['nth_order'].max() + 1
-        res_order_num = self.df[['user_id', 'nth_order', 'is_crm']].groupby(['user_id', 'is_crm']).agg(
-            累计下单次数 = ('nth_order', 'max')
-        ).reset_index()
-        res_order_num['累计下单次数分布'] = pd.cut(res_order_num['累计下单次数'], bins=[0, 1, 2, 3, 4, 5, 6, max_order_num], labels=[1, 2, 3, 4, 5, 6, '7次及以上'])
-        res_order_num = res_order_num.groupby(['is_crm', '累计下单次数分布']).agg(人数=('user_id', 'count')).unstack(0)
+        nth_edges = [0, 1, 2, 3, 4, 5, 6]
+        user_order_num = self.df.groupby(['user_id', 'is_crm'], observed=True)['nth_order'].max()
+        binning = Binning(nth_edges, closed='right', open_end=True, labels=[1, 2, 3, 4, 5, 6, '7次及以上'], name='累计下单次数分布')
+        res_order_num = binning.count(user_order_num, user_order_num.index.get_level_values('is_crm')).astype('int64')
+        res_order_num = pd.concat({'人数': res_order_num}, axis=1)
         res_order_num[('人数', '合计')] = res_order_num.sum(axis=1)
         for col_name in res_order_num.columns: ## 后面试试有没有更简单的方法！！！
             a, b = col_name
             res_order_num[('占比', b)] = res_order_num[col_name] / res_order_num[col_name].sum()
 
-        # 各次下单订单数和总金额
-        res_nth_order = self.df.groupby(['nth_order', 'is_crm']).agg(
-            订单数 = ('order_id', 'count'),
-            总金额 = ('order_value', 'sum')
-        ).reset_index()
-        res_nth_order['第n次下单'] = pd.cut(res_nth_order['nth_order'], bins=[0, 1, 2, 3, 4, 5, 6, 210], labels=[1, 2, 3, 4, 5, 6, '7及以上'])
-        res_nth_order = res_nth_order.groupby(['第n次下单', 'is_crm']).agg(
-            订单数 = ('订单数', 'sum'),
-            总金额 = ('总金额', 'sum')
-        )
+        # 各次下单订单数和总金额（汇总表中第7次及以后的下单已合并为7）
+        binning = Binning(nth_edges, closed='right', open_end=True, labels=[1, 2, 3, 4, 5, 6, '7及以上'], name='第n次下单')
+        res_nth_order = pd.DataFrame({
+            '订单数': binning.count(self.cube['nth_order'], self.cube['is_crm'], self.cube['order_num']).astype('int64').stack(),
+            '总金额': binning.count(self.cube['nth_order'], self.cube['is_crm'], self.cube['order_value']).stack()
+        })
         res_nth_order['订单平均价值'] = (res_nth_order['总金额'] / res_nth_order['订单数'])
         res_nth_order = res_nth_order.stack().unstack(0).unstack(0).stack(-1)
 
@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+
+
+class PromoCalendar:
+    """
+    促销日历：把活动日历里的每个活动当作一个日期区间 [起始日期, 终止日期]，建立有序的区间索引。
+    打标时对订单日期做一次 searchsorted，不需要把活动展开成逐日的表，也不需要日期和字符串互相转换。
+    - 名称中含“直播”的活动只对活动对应的 sku_id 生效，其余活动对全店生效
+    - 活动日期有重叠时：起始日期晚的优先；起始日期相同时，日历中排在前面的优先
+    """
+    key_step = 1 << 20  # 直播活动按 sku编码 * key_step + 天数 编成一维键，不同sku的区间互不重叠
+
+    def __init__(self, promo_info):
+        """
+        promo_info: 活动日历（促销活动, 促销类型, 起始日期, 终止日期, sku_id）
+        """
+        promo = promo_info.rename(columns={'促销活动': 'promotion', '促销类型': 'promo_type'}).reset_index(drop=True)
+        promo['起始日期'] = pd.to_datetime(promo['起始日期'])
+        promo['终止日期'] = pd.to_datetime(promo['终止日期'])
+        promo['天数'] = (promo['终止日期'] - promo['起始日期']).dt.days + 1
+        promo['is_live'] = promo['promotion'].str.contains('直播')
+        self.promo = promo
+
+        start = self.to_days(promo['起始日期'])
+        end = self.to_days(promo['终止日期'])
+        # 全店活动
+        store = np.flatnonzero(~promo['is_live'].to_numpy())
+        self._store = self._build(store, start[store], end[store])
+        # 直播活动：按sku区分
+        live = np.flatnonzero(promo['is_live'].to_numpy() & promo['sku_id'].notnull().to_numpy())
+        self.live_skus = pd.Index(promo.loc[live, 'sku_id'].astype('int64').unique())
+        sku_code = self.live_skus.get_indexer(promo.loc[live, 'sku_id'].astype('int64'))
+        self._live = self._build(live, sku_code * self.key_step + start[live], sku_code * self.key_step + end[live])
+
+    @staticmethod
+    def to_days(dt):
+        return pd.to_datetime(pd.Series(dt)).to_numpy().astype('datetime64[D]').astype('int64')
+
+    def _build(self, rows, start, end):
+        """
+        把可能重叠的区间切成互不重叠的小段，每段记录生效的活动行号（无活动为-1）
+        """
+        bounds = np.unique(np.concatenate([start, end + 1]))
+        owner = np.full(len(bounds), -1, dtype='int64')
+        # 按优先级从低到高依次覆盖：起始日期早的先写，起始日期相同时日历中靠后的先写
+        for i in np.lexsort((-rows, start)):
+            lo, hi = np.searchsorted(bounds, [start[i], end[i] + 1])
+            owner[lo:hi] = rows[i]
+        return bounds, owner
+
+    @staticmethod
+    def _find(index, keys):
+        bounds, owner = index
+        if len(bounds) == 0:
+            return np.full(len(keys), -1, dtype='int64')
+        seg = np.searchsorted(bounds, keys, side='right') - 1
+        return np.where(seg >= 0, owner[np.clip(seg, 0, None)], -1)
+
+    def lookup(self, dt, sku_id=None):
+        """
+        返回 (全店活动行号, 直播活动行号)，没有活动为-1
+        """
+        days = self.to_days(dt)
+        store_row = self._find(self._store, days)
+        live_row = np.full(len(days), -1, dtype='int64')
+        if sku_id is not None:
+            sku_code = self.live_skus.get_indexer(pd.Series(sku_id).astype('int64'))
+            has_live = sku_code >= 0
+            live_row[has_live] = self._find(self._live, sku_code[has_live] * self.key_step + days[has_live])
+        return store_row, live_row
+
+    def _take(self, col, rows):
+        values = np.append(self.promo[col].to_numpy(dtype=object), np.nan)
+        return values[rows]  # rows为-1时取到末尾的空值
+
+    def tag(self, dt, sku_id=None):
+        """
+        返回与dt等长的 promotion, promo_type：全店活动优先，其次是该sku的直播，都没有则为 无/平日
+        """
+        store_row, live_row = self.lookup(dt, sku_id)
+        rows = np.where(store_row >= 0, store_row, live_row)
+        res = pd.DataFrame({'promotion': self._take('promotion', rows), 'promo_type': self._take('promo_type', rows)})
+        return res.fillna({'promotion': '无', 'promo_type': '平日'})
+
+    def span(self, dt, promotion, promo_type):
+        """
+        查询 (dt, promotion, promo_type) 所属活动的起始日期和天数，不属于任何活动时为空
+        """
+        query = pd.DataFrame({'dt': pd.to_datetime(pd.Series(dt)).to_numpy(),
+                              'promotion': np.asarray(promotion), 'promo_type': np.asarray(promo_type)})
+        keys = query.drop_duplicates()
+        cand = keys.merge(self.promo[['promotion', 'promo_type', '起始日期', '终止日期', '天数']],
+                          on=['promotion', 'promo_type'])
+        cand = cand.loc[(cand['起始日期'] <= cand['dt']) & (cand['dt'] <= cand['终止日期'])]
+        cand = cand.sort_values('起始日期', ascending=False, kind='mergesort').drop_duplicates(['dt', 'promotion', 'promo_type'])
+        res = query.merge(cand, on=['dt', 'promotion', 'promo_type'], how='left')
+        return res[['起始日期', '天数']]
@@ -29,10 +29,18 @@ from graphviz import Digraph
 # Excel输出
 import xlsxwriter
 
+from SubOrderView import SubOrderView
+
 class PurchasePath:
-    def __init__(self, df, df_sub):
+    def __init__(self, df, df_sub, timeline=None):
+        """
+        - timeline: 用户下单时间线（UserTimeline），传入后对全部订单/订单明细画图时，每一层“第n单买了什么”直接在时间线的数组上筛选，
+          不再对订单表逐层筛选和isin；传入其他数据（如某个子集）时仍按原来的方式计算
+        - df_sub只需要商品级字段，画图用到的user_id、nth_order按order_id从df关联（SubOrderView）
+        """
         self.df = df
         self.df_sub = df_sub
+        self.timeline = timeline
         self.output_dir = '报表测试/购买路径图/'
 
     def draw_promo_purchase_path(self, df, max_level = 3, min_buy_rate = 0.02, min_buy_uv = 200, output_pic=True):
@@ -47,8 +55,28 @@ class PurchasePath:
         """
 
         dot = Digraph()
-        df = df.drop_duplicates()
-        uv_ttl = df.loc[df['nth_order'] == 1, 'user_id'].unique()
+        if self.timeline is not None and df is self.df:
+            # 时间线上：第level单中属于上一层用户的订单，按促销类型分组
+            tl = self.timeline
+            order_user = tl.order_user()
+
+            def level_groups(level, pre_uv):
+                orders = tl.nth(level)
+                orders = orders[np.isin(order_user[orders], pre_uv)]
+                codes = tl.promo_code[orders]
+                return [(tl.promo_types[c], np.unique(order_user[orders[codes == c]])) for c in np.unique(codes[codes >= 0])]
+
+            uv_ttl = np.unique(order_user[tl.nth(1)])
+        else:
+            df = df.drop_duplicates()
+
+            def level_groups(level, pre_uv):
+                df_curr = df.loc[(df['nth_order'] == level) & (df['user_id'].isin(pre_uv))]
+                tmp = df_curr.groupby('promo_type', observed=True).agg({'user_id':'count'}).reset_index()
+                return [(curr_promo, df_curr.loc[(df_curr['promo_type'] == curr_promo), 'user_id'].unique())
+                        for curr_promo in tmp['promo_type']]
+
+            uv_ttl = df.loc[df['nth_order'] == 1, 'user_id'].unique()
         dot.node('0', '首单' + ' ' + str(len(uv_ttl)))
 
         q = deque([['0', '首单', uv_ttl]])
@@ -58,12 +86,7 @@ class PurchasePath:
             level += 1
             for i in range(len(q)):
                 pre_node, pre_promo, pre_uv = q.popleft()
-                df_curr = df.loc[(df['nth_order'] == level) & (df['user_id'].isin(pre_uv))]
-                tmp = df_curr.groupby('promo_type').agg({'user_id':'count'}).reset_index()
-
-                for j in range(tmp.shape[0]):
-                    curr_promo = tmp.loc[j, 'promo_type']
-                    curr_uv = df_curr.loc[(df_curr['promo_type'] == curr_promo), 'user_id'].unique()
+                for j, (curr_promo, curr_uv) in enumerate(level_groups(level, pre_uv)):
                     curr_node = str(level) + str(i) + str(j)
                     buy_rate = len(curr_uv) / len(pre_uv)
                     if buy_rate > min_buy_rate and len(curr_uv) > min_buy_uv:
@@ -87,6 +110,7 @@ class PurchasePath:
 
         dot = Digraph()
 
+        df_sub = SubOrderView(self.df, df_sub).view(['user_id', 'nth_order'])
         df_sub = df_sub.loc[df_sub['nth_order'] == nth_order, ['user_id', 'promo_type', 'title_refined']].drop_duplicates(['user_id', 'title_refined'])
         uv_ttl = df_sub['user_id'].nunique()
 
@@ -106,7 +130,7 @@ class PurchasePath:
             dot.node(promo_label, promo_type + '' + str(promo_uv))
             dot.edge('0', promo_label, '{:.1%}'.format(promo_uv / uv_ttl), arrowhead="none")
             # 计算各sku比例
-            tmp = df_promo.groupby('title_refined').agg(人数=('user_id', 'count')).sort_values('人数', ascending=False).reset_index()
+            tmp = df_promo.groupby('title_refined', observed=True).agg(人数=('user_id', 'count')).sort_values('人数', ascending=False).reset_index()
             for j in range(tmp.shape[0]):
                 sku_label = promo_label + str(j)
                 title = tmp.loc[j, 'title_refined']
@@ -128,11 +152,41 @@ class PurchasePath:
         绘制各品类的复购路径图
         """
         dot = Digraph()
-        # 根节点
-        uv_ttl = df_sub.loc[df_sub['nth_order'] == 1, 'user_id'].unique()
-        dot.node('0', '消费者总数' + ' ' + str(len(uv_ttl)))
+        if self.timeline is not None and df_sub is self.df_sub:
+            # 时间线上：第level单的商品中属于上一层用户的，按品类分组，按商品数从多到少排列
+            tl = self.timeline
+            item_order = tl.item_order()
+            item_user, item_nth = tl.order_user()[item_order], tl.nth_order[item_order]
+            cate_code = pd.Index(tl.categories).get_indexer([category])[0]  # 不在时间线中为-1，筛选后为空
+
+            def level_groups(level, pre_uv):
+                items = np.flatnonzero(item_nth == level)
+                items = items[np.isin(item_user[items], pre_uv)]
+                codes = tl.category_code[items]
+                if level == 1 and category is not None:
+                    items, codes = items[codes == cate_code], codes[codes == cate_code]
+                items, codes = items[codes >= 0], codes[codes >= 0]
+                num = np.bincount(codes, minlength=len(tl.categories))
+                num = pd.Series(num, index=np.arange(len(num)))[num > 0].sort_values(ascending=False)
+                return [(tl.categories[c], np.unique(item_user[items[codes == c]])) for c in num.index]
+
+            uv_ttl = np.unique(item_user[item_nth == 1])
+        else:
+            df_sub = SubOrderView(self.df, df_sub).view(['user_id', 'nth_order'])
 
-        df_sub = df_sub[['user_id', 'nth_order', 'category']]
+            def level_groups(level, pre_uv):
+                if level == 1 and category is not None:
+                    df_curr = df_sub.loc[(df_sub['nth_order'] == level) & (df_sub['user_id'].isin(pre_uv)) & (df_sub['category'] == category)]
+                else:
+                    df_curr = df_sub.loc[(df_sub['nth_order'] == level) & (df_sub['user_id'].isin(pre_uv))]
+                tmp = df_curr.groupby('category', observed=True).agg(人数=('user_id','count')).sort_values('人数', ascending=False).reset_index()
+                return [(curr_cate, df_curr.loc[(df_curr['category'] == curr_cate), 'user_id'].unique())
+                        for curr_cate in tmp['category']]
+
+            # 根节点
+            uv_ttl = df_sub.loc[df_sub['nth_order'] == 1, 'user_id'].unique()
+            df_sub = df_sub[['user_id', 'nth_order', 'category']]
+        dot.node('0', '消费者总数' + ' ' + str(len(uv_ttl)))
 
         q = deque([['0', '消费者总数', uv_ttl]])
 
@@ -141,16 +195,8 @@ class PurchasePath:
             level += 1
             for i in range(len(q)):
                 pre_label, pre_cate, pre_uv = q.popleft()
-                if level == 1 and category is not None:
-                    df_curr = df_sub.loc[(df_sub['nth_order'] == level) & (df_sub['user_id'].isin(pre_uv)) & (df_sub['category'] == category)]
-                else:
-                    df_curr = df_sub.loc[(df_sub['nth_order'] == level) & (df_sub['user_id'].isin(pre_uv))]
-                tmp = df_curr.groupby('category').agg(人数=('user_id','count')).sort_values('人数', ascending=False).reset_index()
-
-                for j in range(tmp.shape[0]):
+                for j, (curr_cate, curr_uv) in enumerate(level_groups(level, pre_uv)):
                     curr_label = str(level) + str(i) + str(j)
-                    curr_cate = tmp.loc[j, 'category']
-                    curr_uv = df_curr.loc[(df_curr['category'] == curr_cate), 'user_id'].unique()
                     buy_rate = len(curr_uv) / len(pre_uv)
                     if buy_rate > min_buy_rate and len(curr_uv) > min_buy_uv:
                         q.append([curr_label, curr_cate, curr_uv])
@@ -173,6 +219,7 @@ class PurchasePath:
         """
         dot = Digraph()
 
+        df_sub = SubOrderView(self.df, df_sub).view(['user_id', 'nth_order'])
         store_uv = df_sub.loc[(df_sub['nth_order'] == 1), 'user_id'].unique()
         uv_root = df_sub.loc[(df_sub['nth_order'] == 1) & (df_sub['category'] == category), 'user_id'].unique()
         df_sub = df_sub.loc[df_sub['user_id'].isin(uv_root), ['user_id', 'nth_order', 'category', 'title_refined', 'title']]
@@ -209,7 +256,7 @@ class PurchasePath:
                     df_curr = df_sub.loc[(df_sub['nth_order'] == level) & (df_sub['category'].str.contains("\$"))]
                 else: # 第二单及以后
                     df_curr = df_sub.loc[(df_sub['nth_order'] == level) & (df_sub['user_id'].isin(pre_uv))]
-                tmp = df_curr.groupby('category').agg(人数=('user_id','count')).sort_values('人数', ascending=False).reset_index()
+                tmp = df_curr.groupby('category', observed=True).agg(人数=('user_id','count')).sort_values('人数', ascending=False).reset_index()
 
                 for j in range(tmp.shape[0]):
                     curr_label = str(level) + str(i) + str(j)
@@ -0,0 +1,83 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from statistics import NormalDist
+
+import numpy as np
+from scipy.stats import beta
+
+
+def _bootstrap_chunk(flags, sizes, n_boot, alpha, seed, max_draws):
+    """
+    进程池中执行：一块取值的重抽样。flags为这些取值的0/1标记依次拼接，sizes为各取值的人数；
+    每轮对所有取值同时抽样（一次生成全部随机位置，reduceat按取值求和），轮数按max_draws分批以控制内存
+    """
+    rng = np.random.default_rng(seed)
+    sizes = np.asarray(sizes, dtype='int64')
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    key_start = np.repeat(starts, sizes)
+    key_size = np.repeat(sizes, sizes)
+    block = max(1, min(n_boot, max_draws // max(len(flags), 1)))
+    rates = np.empty((n_boot, len(sizes)))
+    for i in range(0, n_boot, block):
+        b = min(block, n_boot - i)
+        pos = key_start + (rng.random((b, len(flags))) * key_size).astype('int64')
+        rates[i:i + b] = np.add.reduceat(flags[pos], starts, axis=1) / sizes
+    return np.quantile(rates, [alpha / 2, 1 - alpha / 2], axis=0)
+
+
+class RateInterval:
+    """
+    比率（如复购率 = 复购人数 / 下单人数）的置信区间，所有取值一次算出，返回 (下限, 上限) 两个数组。
+    - wilson(): Wilson区间；exact(): Clopper-Pearson精确区间（按二项分布），人数很少时也不会越出[0, 1]
+    - bootstrap(): 对每个取值的用户0/1标记（如是否复购）有放回地重抽样，取重抽样比率的分位数。
+      各取值的标记拼成一个扁平数组，按人数分块交给进程池并行，seed与max_workers相同时结果可复现
+    人数少的取值区间很宽，按比率排序时应参考下限
+    """
+    methods = ['wilson', 'exact', 'bootstrap']
+
+    @staticmethod
+    def wilson(k, n, alpha=0.05):
+        k, n = np.asarray(k, dtype='float64'), np.asarray(n, dtype='float64')
+        z = NormalDist().inv_cdf(1 - alpha / 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = k / n
+            center = (p + z ** 2 / (2 * n)) / (1 + z ** 2 / n)
+            half = z / (1 + z ** 2 / n) * np.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2))
+        return center - half, center + half
+
+    @staticmethod
+    def exact(k, n, alpha=0.05):
+        k, n = np.asarray(k, dtype='float64'), np.asarray(n, dtype='float64')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lower = np.where(k > 0, beta.ppf(alpha / 2, k, n - k + 1), 0.0)
+            upper = np.where(k < n, beta.ppf(1 - alpha / 2, k + 1, n - k), 1.0)
+        return np.where(n > 0, lower, np.nan), np.where(n > 0, upper, np.nan)
+
+    @staticmethod
+    def bootstrap(flags, sizes, alpha=0.05, n_boot=2000, seed=0, max_workers=None, max_draws=4_000_000):
+        """
+        - flags: 各取值的用户0/1标记依次拼接；sizes: 各取值的人数（与拼接顺序一致）
+        - max_workers: 进程数，为1时在本进程中计算；max_draws: 每批随机数的个数上限（控制内存）
+        """
+        flags = np.asarray(flags, dtype='float64')
+        sizes = np.asarray(sizes, dtype='int64')
+        lower, upper = np.full(len(sizes), np.nan), np.full(len(sizes), np.nan)
+        keys = np.flatnonzero(sizes > 0)
+        if len(keys) == 0:
+            return lower, upper
+        # 按人数把取值分成大致等量的块
+        bounds = np.r_[0, np.cumsum(sizes)]
+        workers = max_workers or os.cpu_count() or 1
+        cuts = np.searchsorted(np.cumsum(sizes[keys]), np.linspace(0, sizes.sum(), workers + 1)[1:-1], side='right')
+        chunks = [c for c in np.split(keys, cuts) if len(c) > 0]
+        seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+        tasks = [(np.concatenate([flags[bounds[i]:bounds[i + 1]] for i in c]), sizes[c], n_boot, alpha, s, max_draws)
+                 for c, s in zip(chunks, seeds)]
+        if workers == 1 or len(chunks) == 1:
+            results = [_bootstrap_chunk(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                results = list(executor.map(_bootstrap_chunk, *zip(*tasks)))
+        for c, (lo, hi) in zip(chunks, results):
+            lower[c], upper[c] = lo, hi
+        return lower, upper
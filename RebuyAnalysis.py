@@ -16,7 +16,6 @@ import pandas as pd
 # import ipywidgets
 import itertools
 import re
-from datetime import datetime
 
 # associative analysis
 from mlxtend.preprocessing import TransactionEncoder
@@ -30,187 +29,290 @@ from graphviz import Digraph
 # Excel输出
 import xlsxwriter
 
+from Binning import Binning
+from CohortRetention import CohortRetention
+from PromoCalendar import PromoCalendar
+from RateInterval import RateInterval
+from RefCache import RefCache
+from SubOrderView import SubOrderView
+from TimeIndex import TimeIndex
+
 class RebuyAnalysis:
-    def __init__(self, df, df_sub):
+    """
+    - interval_bins / interval_labels: 复购周期分布默认的区间（天，左开右闭）和标签
+    - start / end: 只分析这段日期内的订单（含起止日期），复购周期也只在窗口内计算；用time_index（TimeIndex）二分查找截取
+    - timeline: 用户下单时间线（UserTimeline），传入后按用户、下单时间排列的订单和订单明细直接按时间线的行号取出，不再排序；
+      按日期截取时不使用（时间线是全部历史的）
+    - df_sub只需要商品级字段，用到的订单级字段（user_id、dt、order_value等）按order_id从df关联（SubOrderView）；
+      按订单统计的指标（连带复购、province/tier等订单级字段的复购）直接用df，不对明细去重
+    - cohort: 同期群留存（CohortRetention，随每批新订单更新），传入后cohort_retention直接读取，不扫描订单；
+      按日期截取时只看首单在窗口内的同期群
+    """
+    interval_bins = [-1, 0, 7, 15, 30, 60, 90, 180, 365, 600]
+    interval_labels = ['0', '1-7', '7-15', '15-30', '30-60', '60-90', '90-180', '180-365', '365-以上']
+
+    def __init__(self, df, df_sub, start=None, end=None, time_index=None, timeline=None, cohort=None):
+        self.history = df  # 截取前的全部订单，没有cohort时同期群的首单要从全部历史中找
+        if start is not None or end is not None:
+            df, df_sub = (time_index if time_index is not None else TimeIndex(df, df_sub)).slice(start, end)
+            timeline = None
         self.df = df
         self.df_sub = df_sub
-        self.df_sub_sorted = df_sub.sort_values(['user_id', 'order_time'])
-        self.store_uv = df_sub['user_id'].nunique()
+        self.sub_view = SubOrderView(df, df_sub)
+        sub_cols = ['user_id', 'order_time', 'dt', 'order_value']
+        if timeline is not None:
+            self.df_sorted = df.iloc[timeline.order_rows]
+            self.df_sub_sorted = self.sub_view.view(sub_cols, rows=timeline.item_rows)
+        else:
+            self.df_sorted = df.sort_values(['user_id', 'order_time'], kind='mergesort')
+            self.df_sub_sorted = self.sub_view.view(sub_cols).sort_values(['user_id', 'order_time'], kind='mergesort')
+        self.store_uv = df['user_id'].nunique()
+        self.cohort = cohort
+        self.start, self.end = start, end
         self.promo_file = '数据/味好美活动日历.xlsx'
+        self.ref_cache = RefCache('数据存档/参考数据缓存')
 
-    def compute_rebuy_interval(self, df):
-        df = df.drop_duplicates('order_id')
-        df = df.assign(next_dt = df.groupby('user_id')['dt'].shift(-1, axis=0))
+    def compute_rebuy_interval(self, df=None):
+        """
+        df: 按用户、下单时间排列的订单，默认为df_sorted；next_dt为该用户下一单的日期
+        """
+        df = self.df_sorted if df is None else df
+        df = df.assign(next_dt = df.groupby('user_id', observed=True)['dt'].shift(-1, axis=0))
         df['rebuy_interval'] = (df['next_dt'] - df['dt']).dt.days.astype('Int64')
         return df
 
-    def rebuy_index(self, df):
+    def compute_field_rebuy_interval(self, field):
         """
-        本品复购，df只是本品的订单数据
-        本品可以是品类、sku、省份、城市级别
+        按field的每个取值（本品）一次算出复购周期：同一订单在本品内只算一次，
+        next_dt为该用户在本品内的下一次下单日期，rebuy_interval为相隔天数（没有复购为空）
+        field为订单级字段（province、tier）时直接用订单表
         """
-        df = df.drop_duplicates('order_id')
-        order_num = df.shape[0] # 订单总数
-        aov = int(df['order_value'].mean()) # 订单平均价值
-        rebuy_interval_median = np.nan # 复购周期中位数
-        if df[df['rebuy_interval'].notnull()].shape[0] > 0:
-            rebuy_interval_median = int(df['rebuy_interval'].median())
-        buy_uv = df['user_id'].nunique() # 购买人数
-        rebuy_uv = df.loc[df['next_dt'].notnull(), 'user_id'].nunique() #本品复购人数
-        rebuy_rate = '{:.4f}'.format(rebuy_uv / buy_uv)
+        if SubOrderView.is_order_field(field):
+            df = self.df_sorted
+            df = df.loc[df[field].notnull()]
+        else:
+            df = self.df_sub_sorted
+            df = df.loc[df[field].notnull()].drop_duplicates([field, 'order_id'])
+        next_dt = df.groupby([field, 'user_id'], observed=True, sort=False)['dt'].shift(-1)
+        return df.assign(next_dt=next_dt, rebuy_interval=(next_dt - df['dt']).dt.days)
 
-        rebuy_dict = {'订单总数': order_num, '订单平均价值':aov, '下单人数': buy_uv, '下单人数占比': buy_uv/self.store_uv,
-                      '复购人数': rebuy_uv, '复购率': rebuy_rate, '复购周期中位数': rebuy_interval_median}
-        return rebuy_dict
+    def rebuy_index(self, df, field, ci=None, alpha=0.05, n_boot=2000, max_workers=None):
+        """
+        本品复购，一次算出field每个取值的指标；df为compute_field_rebuy_interval的结果
+        本品可以是品类、sku、省份、城市级别
+        - ci: 复购率的置信区间（RateInterval），None不计算；'wilson'、'exact'按复购人数/下单人数计算，
+          'bootstrap'对每个取值的用户复购标记重抽样n_boot次（进程池并行）
+        """
+        grouped = df.groupby(field, observed=True, sort=False)
+        res = grouped.agg(
+            订单总数=('order_id', 'size'),
+            订单平均价值=('order_value', 'mean'),
+            下单人数=('user_id', 'nunique'),
+            复购周期中位数=('rebuy_interval', 'median'),
+        )
+        res['订单平均价值'] = np.trunc(res['订单平均价值']).astype('int64')
+        res['下单人数占比'] = res['下单人数'] / self.store_uv
+        res['复购人数'] = df.loc[df['next_dt'].notnull()].groupby(field, observed=True)['user_id'].nunique().reindex(
+            res.index, fill_value=0)
+        res['复购率'] = (res['复购人数'] / res['下单人数']).map('{:.4f}'.format)
+        if ci == 'bootstrap':
+            # 每个用户在本品内是否复购，按field的取值依次排列
+            flags = df.groupby([field, 'user_id'], observed=True)['next_dt'].count().gt(0)
+            sizes = flags.groupby(level=0, observed=True).size()
+            lower, upper = RateInterval.bootstrap(flags.to_numpy(), sizes.to_numpy(), alpha, n_boot, max_workers=max_workers)
+            bounds = pd.DataFrame({'复购率下限': lower, '复购率上限': upper}, index=sizes.index).reindex(res.index)
+            res['复购率下限'], res['复购率上限'] = bounds['复购率下限'], bounds['复购率上限']
+        elif ci is not None:
+            res['复购率下限'], res['复购率上限'] = getattr(RateInterval, ci)(res['复购人数'], res['下单人数'], alpha)
+        res['复购周期中位数'] = np.trunc(res['复购周期中位数']).astype('Int64')
+        return res
 
-    def joint_rebuy_index(self, df, field='category'):
+    def joint_rebuy_index(self, df=None, field='category'):
         """
-        计算连带复购（即复购的东西可以是非本品）人数，df应该是所有品类的订单数据
+        计算连带复购（即复购的东西可以是非本品）人数，df应该是所有品类的订单数据（按用户、下单时间排列，默认为df_sorted），
+        订单的商品字段取订单的第一个商品
         field可选：category, sku_id, province, tier
         """
         df = self.compute_rebuy_interval(df)
         df = df.drop_duplicates([field, 'user_id'], keep='first')
         df = df[df['next_dt'].notnull()]
-        df = df.groupby(field).agg(连带复购人数=('user_id', 'count')).reset_index()
+        df = df.groupby(field, observed=True).agg(连带复购人数=('user_id', 'count')).reset_index()
         return df
 
-    def rebuy_result(self, field='category'):
+    def rebuy_result(self, field='category', ci=None, alpha=0.05, n_boot=2000, max_workers=None):
         """
         field可选：category, sku_id, province, tier
+        ci可选：None, 'wilson', 'exact', 'bootstrap'，给出复购率的 1-alpha 置信区间（见rebuy_index）
         """
         cols = ['订单总数','订单平均价值', '下单人数','下单人数占比', '复购人数', '复购率', '复购周期中位数']
+        if ci is not None:
+            cols[cols.index('复购率') + 1:cols.index('复购率') + 1] = ['复购率下限', '复购率上限']
         if field == 'sku_id':
             cols = ['sku_id', 'title', 'channel', 'category'] + cols
             field_range = self.df_sub[['sku_id', 'title', 'channel', 'category']].drop_duplicates().reset_index(drop=True).astype({'sku_id':'int64'})
         else:
             cols = [field] + cols
-            field_range = pd.DataFrame(self.df_sub.loc[self.df_sub[field].notnull(), field].drop_duplicates().reset_index(drop=True))
-
-        res_rebuy = pd.DataFrame(columns = cols)
-        # 本品复购
-        for _, row in field_range.iterrows():
-            tmp = row[field]
-            df_tmp = self.compute_rebuy_interval(self.df_sub_sorted.loc[self.df_sub_sorted[field] == tmp])
-            rebuy_dict = self.rebuy_index(df_tmp)
-            rebuy_dict[field] = tmp
-            if field == 'sku_id':
-                for e in ['title', 'channel', 'category']:
-                    rebuy_dict[e] = row[e]
-            res_rebuy = res_rebuy.append(rebuy_dict, ignore_index=True)
+            source = self.df if SubOrderView.is_order_field(field) else self.df_sub
+            field_range = pd.DataFrame(source.loc[source[field].notnull(), field].drop_duplicates().reset_index(drop=True))
+
+        # 本品复购：所有取值一次算出，再按field_range的顺序排列
+        res_rebuy = self.rebuy_index(self.compute_field_rebuy_interval(field), field, ci, alpha, n_boot, max_workers)
+        res_rebuy = field_range.merge(res_rebuy.reset_index(), on=field, how='left')[cols]
         # 连带复购
         if field in ['category', 'sku_id', 'channel']:
-            res_joint_rebuy = self.joint_rebuy_index(self.df_sub_sorted, field=field)
+            res_joint_rebuy = self.joint_rebuy_index(field=field)
             res_rebuy = res_rebuy.merge(res_joint_rebuy, on=field, how='left')
             res_rebuy['连带复购率'] = res_rebuy['连带复购人数'] / res_rebuy['下单人数']
-            res_rebuy = res_rebuy.rename(columns={'复购率':'本品复购率', '复购人数':'本品复购人数', '复购周期中位数':'本品复购周期中位数'})
-        res_rebuy = res_rebuy.sort_values('订单总数', ascending=False)
+            res_rebuy = res_rebuy.rename(columns={'复购率':'本品复购率', '复购人数':'本品复购人数', '复购周期中位数':'本品复购周期中位数',
+                                                  '复购率下限':'本品复购率下限', '复购率上限':'本品复购率上限'})
+        res_rebuy = res_rebuy.sort_values('订单总数', ascending=False, kind='mergesort')
         return res_rebuy
 
-    def cate_rebuy_interval_dist(self):
-        res_num = pd.DataFrame()
-        for cate in self.df['category'].unique():
-            df_cate = self.compute_rebuy_interval(self.df_sub_sorted[self.df_sub_sorted['category'] == cate])
-            df_cate['下单时间间隔区间'] \
-                    = pd.cut(df_cate.loc[df_cate['rebuy_interval'].notnull(), 'rebuy_interval'], [-1, 0,7,15,30,60,90,180,365,600],
-                             labels=[0, '1-7', '7-15', '15-30', '30-60', '60-90', '90-180', '180-365', '365-以上'])
-            tmp = pd.DataFrame(df_cate['下单时间间隔区间'].value_counts()).reset_index()
-            tmp.columns=['下单时间间隔区间', cate]
-            tmp['下单时间间隔区间'] = tmp['下单时间间隔区间'].astype('str')
-            tmp = tmp.set_index('下单时间间隔区间')
-            res_num = res_num.append(tmp.T, sort=False)
+    def cate_rebuy_interval_dist(self, field='category', bins=None, labels=None):
+        """
+        各品类复购周期分布：每个取值一行，各复购周期区间的复购订单占比，最后一列为复购订单数（总订单数）
+        - field可选：category, sku_id, channel, province, tier
+        - bins: 复购周期（天）的区间边界，左开右闭，默认为interval_bins；labels: 各区间的标签
+        所有取值一次分箱计数，耗时与取值的个数基本无关
+        """
+        if bins is None:
+            bins = self.interval_bins
+            labels = self.interval_labels if labels is None else labels
+        df = self.compute_field_rebuy_interval(field)
+        source = self.df if SubOrderView.is_order_field(field) else self.df_sub
+        keys = source.loc[source[field].notnull(), field].drop_duplicates()
+        binning = Binning(bins, closed='right', labels=labels, name='下单时间间隔区间')
+        res_num = binning.count(df['rebuy_interval'], groups=df[field]).T.reindex(keys.to_numpy()).fillna(0).astype('int64')
+        res_num.index.name = None
+        res_num.columns = res_num.columns.astype('str')
         res_num['总订单数'] = res_num.sum(axis=1)
         # 计算百分比
         res_pct = res_num.div(res_num['总订单数'], axis=0)
         res_pct['总订单数'] = res_num['总订单数']
         return res_pct
 
+    def cohort_retention(self, value='users', by=None, rate=False):
+        """
+        首单月份同期群留存：行为首单月份，列为首单后第几个自然月（第0个月为首单当月）
+        - value: 'users'（下单人数）、'order_num'（订单数）或 'gmv'（销售额）
+        - by: 再按首单的 'category'（品类）或 'promo_type'（促销类型）细分
+        - rate: 为True时除以首单当月的值，得到留存率
+        按日期截取时只看首单日期在窗口内的用户；没有传入cohort时用截取前的全部订单汇总一次，
+        首单同样从全部历史中找，与传入cohort时的结果一致
+        """
+        cohort = self.cohort
+        if cohort is None:
+            cohort = CohortRetention()
+            cohort.build(self.history)
+        res = cohort.table(value, by=by and 'first_' + by, start=self.start, end=self.end)
+        if rate:
+            res = res.div(res[0].where(res[0] != 0), axis=0)
+        return res
+
+    def sku_names(self, sku_ids):
+        """
+        sku的名称：取该sku的标题，多个sku标题相同（或没有标题）时附上sku_id
+        """
+        items = self.df_sub.loc[self.df_sub['sku_id'].notnull(), ['sku_id', 'title']].drop_duplicates('sku_id')
+        titles = pd.Series(items['title'].astype('object').to_numpy(), index=items['sku_id'].astype('int64').to_numpy())
+        titles = titles.reindex(sku_ids)
+        dup = titles.duplicated(keep=False) | titles.isnull()
+        return [f'{t}({sku_id})' if d else t for sku_id, t, d in zip(sku_ids, titles, dup)]
+
+    def daily_order_matrix(self):
+        """
+        日期 × sku 的每日订单数（同一订单只算一次），第一列为全店的订单数，其余列为各sku_id；
+        日期覆盖第一单到最后一单的每一天，没有订单的日期为0
+        """
+        dates = pd.date_range(self.df['dt'].min(), self.df['dt'].max(), freq='D')
+        items = self.sub_view.view(['dt'])
+        items = items.loc[items['sku_id'].notnull()].drop_duplicates(['order_id', 'sku_id'])
+        sku_ids = np.sort(items['sku_id'].astype('int64').unique())
+        day_code = dates.get_indexer(items['dt'])
+        sku_code = np.searchsorted(sku_ids, items['sku_id'].astype('int64').to_numpy())
+        counts = np.bincount(day_code * len(sku_ids) + sku_code, minlength=len(dates) * len(sku_ids))
+        counts = counts.reshape(len(dates), len(sku_ids))
+        store = np.bincount(dates.get_indexer(self.df['dt']), minlength=len(dates))
+        return pd.DataFrame(np.column_stack([store, counts]), index=dates,
+                            columns=pd.Index(['全店'] + sku_ids.tolist(), dtype='object'))
+
+    def outbreak_coeff(self, n=30, promo_calendar=None):
+        """
+        全店和所有sku在每次促销活动中的爆发系数 = 活动期间日均订单数 / 活动开始前n天的日均订单数，
+        每行为 一次活动 × 一个sku（全店的sku_id为空），按爆发系数排序即可比较各sku的促销拉动。
+        在日期 × sku 的每日订单数上一次算出：前n天日均用累计和相减，没有订单的日期按0计入
+        - 全店只看全店活动；sku看全店活动和该sku的直播（全店活动优先，与订单打标一致）
+        - 活动开始前n天早于第一单（sku为该sku的第一单）时，前n天日均和爆发系数为空
+        - 统计天数：活动在订单日期范围内的天数
+        """
+        if promo_calendar is None:
+            promo_calendar = PromoCalendar(self.ref_cache.read_excel(self.promo_file))
+        daily = self.daily_order_matrix()
+        counts = daily.to_numpy(dtype='int64')
+        day_num, key_num = counts.shape
+        sku_ids = daily.columns[1:].to_numpy(dtype='int64')
+
+        # 每天每列生效的活动（促销日历的行号，无活动为-1）
+        store_row, _ = promo_calendar.lookup(daily.index)
+        rows = np.repeat(store_row[:, None], key_num, axis=1)
+        live = np.flatnonzero(np.isin(sku_ids, promo_calendar.live_skus)) + 1
+        if len(live) > 0:
+            _, live_row = promo_calendar.lookup(np.tile(daily.index.to_numpy(), len(live)),
+                                                np.repeat(daily.columns[live].to_numpy(dtype='int64'), day_num))
+            rows[:, live] = np.where(rows[:, live] >= 0, rows[:, live], live_row.reshape(len(live), day_num).T)
+
+        # 活动期间：按 (活动, sku) 汇总订单数和天数
+        day_idx, key_idx = np.nonzero(rows >= 0)
+        res = pd.DataFrame({'row': rows[day_idx, key_idx], 'key': key_idx, '订单数': counts[day_idx, key_idx]})
+        res = res.groupby(['row', 'key']).agg(统计天数=('订单数', 'size'), 订单数=('订单数', 'sum')).reset_index()
+
+        # 活动开始前n天的日均
+        cum = np.vstack([np.zeros((1, key_num), dtype='int64'), counts.cumsum(axis=0)])
+        first_day = np.argmax(counts > 0, axis=0)
+        promo = self._promo_info(promo_calendar, res['row'].to_numpy())
+        start = ((promo['起始日期'].to_numpy() - daily.index[0].to_datetime64()) // np.timedelta64(1, 'D')).astype('int64')
+        key = res['key'].to_numpy()
+        valid = start - n >= first_day[key]
+        hi, lo = np.clip(start, 0, day_num), np.clip(start - n, 0, day_num)
+        baseline = np.where(valid, (cum[hi, key] - cum[lo, key]) / n, np.nan)
+
+        res = pd.concat([promo, res.drop(columns='row')], axis=1)
+        res['sku_id'] = pd.Series(np.append(np.nan, sku_ids)[key], dtype='Int64')
+        res['商品'] = np.array(['全店'] + self.sku_names(sku_ids), dtype='object')[key]
+        res['日均订单数'] = res['订单数'] / res['统计天数']
+        res['前n天日均'] = baseline
+        res['爆发系数'] = res['日均订单数'] / res['前n天日均'].where(res['前n天日均'] > 0)
+        return res[['promotion', 'promo_type', '起始日期', '天数', 'sku_id', '商品', '统计天数', '订单数',
+                    '日均订单数', '前n天日均', '爆发系数']]
+
+    @staticmethod
+    def _promo_info(promo_calendar, rows):
+        return promo_calendar.promo.loc[rows, ['promotion', 'promo_type', '起始日期', '天数']].reset_index(drop=True)
+
     def promo_outbreak_coeff(self, n = 30):
+        """
+        各促销类型、各次促销活动中全店和每个sku的爆发系数（见outbreak_coeff），返回 (促销类型表, 促销活动表)，
+        每个sku一列；促销类型的爆发系数为各次活动的爆发系数按统计天数加权平均
+        """
         total_days = len(self.df['dt'].unique())
         if n > total_days:
             print("订单日期覆盖数过少，请增加订单或调小参数！")
             return
 
-        def process_promo_info():
-            promo_info = pd.read_excel(self.promo_file)
-            promo_info['dt'] = promo_info[['起始日期', '终止日期']].apply(lambda x: pd.date_range(start=x[0], end=x[1], freq='D'), axis=1)
-            promo_info['dt'] = promo_info['dt'].apply(lambda x: [datetime.strftime(e,'%Y-%m-%d') for e in x])
-            promo_info['天数'] = promo_info['dt'].apply(len)
-            promo_info = promo_info.explode('dt')
-            promo_info = promo_info.rename(columns={
-                '促销活动': 'promotion',
-                '促销类型': 'promo_type'
-            })[['dt', 'promotion', 'promo_type', '起始日期', '终止日期', '天数']].reset_index(drop=True)
-            promo_info['dt'] = promo_info['dt'].astype('datetime64[ns]')
-            return promo_info[['dt', 'promotion', 'promo_type', '起始日期', '天数']]
-
-        def compute_outbreak_coeff(promo_info, df_sub, n_days=7, sku_id=None):
-            """
-            - df_sub: 订单明细
-            - n_days: 往前推几天，默认7天
-            - sku_id：如果sku_id=None，则计算全店的爆发系数
-            """
-            # 订单数据处理
-            if sku_id:
-                df = df_sub.loc[df_sub['sku_id'] == sku_id].drop_duplicates('order_id')
-            else:
-                df = df_sub.drop_duplicates('order_id')
-            df = df.groupby(['dt', 'promotion', 'promo_type']).agg(订单数 = ('order_id', 'count')).reset_index()
-
-            # 标记促销
-            df = df.merge(promo_info, on=['dt', 'promotion', 'promo_type'], how='left')
-            df['起始日期'].fillna(df['dt'], inplace=True)
-            df.loc[df['promotion'] == '无', 'promotion'] = np.nan
-            df.loc[df['promo_type'] == '平日', 'promo_type'] = np.nan
-
-            # 计算每一天往后n天的日均订单，存到dict里
-            df['dt'] = df['dt'].astype('str')
-            daily_order_list = df[['dt', '订单数']].values.tolist()
-            daily_order_mean_dict = {}
-            sum_tmp = sum(daily_order_list[i][1] for i in range(n_days))
-            daily_order_mean_dict[daily_order_list[0][0]] = sum_tmp / n_days
-            for i in range(n_days, len(daily_order_list)):
-                sum_tmp += daily_order_list[i][1]
-                sum_tmp -= daily_order_list[i - n_days][1]
-                start_dt = daily_order_list[i - n_days + 1][0]
-                daily_order_mean_dict[start_dt] = sum_tmp / n_days
-
-            # 往前推n天日均
-            df['dt'] = df['dt'].astype('datetime64[ns]')
-            df['往前推n天'] = df['起始日期'] - pd.to_timedelta(n_days, unit='d')
-            df.loc[df['往前推n天'].isna(), '往前推n天'] = df['dt'] - pd.to_timedelta(n_days, unit='d')
-            df['往前推n天'] = df['往前推n天'].apply(lambda x: datetime.strftime(x, '%Y-%m-%d'))
-            df['前n天日均'] = df['往前推n天'].map(lambda x: daily_order_mean_dict.get(x, np.nan))
-
-            # 计算爆发系数
-            promo_daily_order = df.groupby(['起始日期', 'promotion', 'promo_type']).agg(日均订单数 = ('订单数', 'mean')).reset_index()
-            df = df.merge(promo_daily_order, on=['起始日期', 'promotion', 'promo_type'], how='left')
-            df['日均订单数'].fillna(df['订单数'], inplace=True)
-            df['爆发系数'] = df['日均订单数'] / df['前n天日均']
-            return df
-
-        # 挑选的sku
-        hot_sku = {
-            None: '全店',
-            577749158548: '新奥*8包',
-            564067342028: '番茄酱330g*4',
-            566885211307: '黑胡椒酱230g*3',
-            589690895211: '麻辣锅物(url)'
-        }
-
-        promo_info = process_promo_info()
-        res_promotype = pd.DataFrame()
-        for sku_id, sku_name in hot_sku.items():
-            sku_daily = compute_outbreak_coeff(promo_info, self.df_sub, n_days=n, sku_id=sku_id)
-            sku_daily = sku_daily.groupby('promo_type').agg(爆发系数=('爆发系数', 'mean'))
-            sku_daily.columns = [sku_name]
-            res_promotype = pd.concat([res_promotype, sku_daily], axis=1, join='outer', sort=False)
-
-        res_promotion = pd.DataFrame()
-        for sku_id, sku_name in hot_sku.items():
-            sku_daily = compute_outbreak_coeff(promo_info, self.df_sub, n_days=n, sku_id=sku_id)
-            sku_daily = sku_daily.groupby(['promotion','promo_type', '起始日期', '天数']).agg(爆发系数=('爆发系数', 'mean')).rename(columns={'爆发系数': sku_name})
-            res_promotion = pd.concat([res_promotion, sku_daily], axis=1, join='outer', sort=False)
-        res_promotion = res_promotion.reset_index().sort_values('起始日期')
+        res = self.outbreak_coeff(n)
+        names = list(dict.fromkeys(res.sort_values('sku_id', na_position='first')['商品']))
+
+        res['加权系数'] = res['爆发系数'] * res['统计天数']
+        res['权重'] = res['统计天数'].where(res['爆发系数'].notnull())
+        res_promotype = res.groupby(['promo_type', '商品']).agg(加权系数=('加权系数', lambda x: x.sum(min_count=1)),
+                                                              权重=('权重', 'sum'))
+        res_promotype = (res_promotype['加权系数'] / res_promotype['权重']).unstack('商品').reindex(columns=names)
+        res_promotype.columns.name = None
+
+        res_promotion = res.groupby(['promotion', 'promo_type', '起始日期', '天数', '商品'])['爆发系数'].mean()
+        res_promotion = res_promotion.unstack('商品').reindex(columns=names)
+        res_promotion.columns.name = None
+        res_promotion = res_promotion.reset_index().sort_values('起始日期', kind='mergesort')
         res_promotion['天数'] = res_promotion['天数'].astype('int64')
 
         return res_promotype, res_promotion
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+
+def _read_excel(path, kwargs):
+    return pd.read_excel(path, **kwargs)
+
+
+class RefCache:
+    """
+    参考数据（sku信息汇总、CRM名单、活动日历、全国行政区域等xlsx）的二进制快照缓存，各模块共用同一个缓存目录。
+    - 文件的修改时间和大小没变：直接读取快照
+    - 修改时间变了但内容没变（文件哈希相同）：更新记录后读取快照
+    - 内容变了：重新解析xlsx并更新快照
+    read_many() 冷启动时用多进程同时解析多个文件。
+    """
+    def __init__(self, cache_dir='数据存档/参考数据缓存'):
+        self.cache_dir = cache_dir
+        self._memo = {}  # 本次运行内已读过的表
+
+    def _key(self, path, kwargs):
+        return hashlib.md5((os.path.abspath(path) + repr(sorted(kwargs.items()))).encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl'), os.path.join(self.cache_dir, key + '.json')
+
+    @staticmethod
+    def _file_hash(path):
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+
+    def _lookup(self, path, kwargs):
+        """
+        返回 (快照中的DataFrame或None, 当前文件的元信息)
+        """
+        key = self._key(path, kwargs)
+        snapshot_file, meta_file = self._paths(key)
+        stat = os.stat(path)
+        meta = {'path': path, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+        if not (os.path.exists(snapshot_file) and os.path.exists(meta_file)):
+            return None, meta
+        with open(meta_file, encoding='utf-8') as f:
+            old = json.load(f)
+        if old['mtime_ns'] == meta['mtime_ns'] and old['size'] == meta['size']:
+            return pd.read_pickle(snapshot_file), old
+        meta['sha1'] = self._file_hash(path)
+        if old.get('sha1') == meta['sha1']:
+            self._write_meta(meta_file, meta)
+            return pd.read_pickle(snapshot_file), meta
+        return None, meta
+
+    @staticmethod
+    def _write_meta(meta_file, meta):
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def _store(self, path, kwargs, df, meta):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        snapshot_file, meta_file = self._paths(self._key(path, kwargs))
+        if 'sha1' not in meta:
+            meta['sha1'] = self._file_hash(path)
+        df.to_pickle(snapshot_file + '.tmp')
+        os.replace(snapshot_file + '.tmp', snapshot_file)
+        self._write_meta(meta_file, meta)
+
+    def read_excel(self, path, **kwargs):
+        memo_key = self._key(path, kwargs)
+        if memo_key not in self._memo:
+            df, meta = self._lookup(path, kwargs)
+            if df is None:
+                df = pd.read_excel(path, **kwargs)
+                self._store(path, kwargs, df, meta)
+            self._memo[memo_key] = df
+        return self._memo[memo_key].copy()
+
+    def read_many(self, paths, max_workers=None):
+        """
+        paths: {名称: 文件路径}，返回 {名称: DataFrame}；没有快照的文件并行解析
+        """
+        res, missing = {}, {}
+        for name, path in paths.items():
+            memo_key = self._key(path, {})
+            if memo_key in self._memo:
+                res[name] = self._memo[memo_key].copy()
+                continue
+            df, meta = self._lookup(path, {})
+            if df is None:
+                missing[name] = (path, meta)
+            else:
+                self._memo[memo_key] = df
+                res[name] = df.copy()
+        if len(missing) == 1:
+            (name, (path, meta)), = missing.items()
+            missing_dfs = {name: pd.read_excel(path)}
+        elif missing:
+            with ProcessPoolExecutor(max_workers=max_workers or len(missing)) as executor:
+                futures = {name: executor.submit(_read_excel, path, {}) for name, (path, meta) in missing.items()}
+                missing_dfs = {name: future.result() for name, future in futures.items()}
+        else:
+            missing_dfs = {}
+        for name, df in missing_dfs.items():
+            path, meta = missing[name]
+            self._store(path, {}, df, meta)
+            self._memo[self._key(path, {})] = df
+            res[name] = df.copy()
+        return res
@@ -0,0 +1,210 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+try:
+    import resource  # Windows下没有，进程内存峰值记为空
+except ImportError:
+    resource = None
+
+
+class BudgetExceeded(RuntimeError):
+    """
+    运行超出预算（见RunMonitor.check_budget）
+    """
+
+
+class RunMonitor:
+    """
+    数据处理的运行监控：按阶段记录墙钟耗时、CPU耗时、内存峰值和输入/输出行数，运行结束后写出JSON运行日志，
+    不同月份的运行日志可以直接对比（compare），也可以按预算判定运行失败（check_budget）。
+    - stage(): 上下文管理器，阶段可以嵌套，子步骤记为 '父阶段/子步骤'；分块处理时同名阶段会出现多次，汇总时累加
+    - 内存：rss_peak_mb 为阶段结束时进程的RSS峰值（进程启动以来），某个阶段明显抬高了它，说明内存峰值出在这个阶段；
+      trace_memory=True 时另用tracemalloc记录阶段内Python/numpy分配的净峰值（mem_peak_mb），开启后运行会变慢
+    - budget: {阶段名: {'wall_s': 秒, 'cpu_s': 秒, 'rss_peak_mb': MB, 'mem_peak_mb': MB, 'ratio': 相对上次运行的最大倍数}}，
+      也可以是JSON文件路径；阶段名用 '*' 表示整个运行
+    """
+    metrics = ['wall_s', 'cpu_s', 'rss_peak_mb', 'mem_peak_mb']
+
+    def __init__(self, log_dir='数据存档/运行日志', budget=None, trace_memory=False):
+        self.log_dir = log_dir
+        self.budget = budget
+        self.trace_memory = trace_memory
+        self.records = []  # 每个阶段一条：name, wall_s, cpu_s, rss_peak_mb, mem_peak_mb, rows_in, rows_out
+        self.info = {}  # 本次运行的说明信息（文件、参数、数字统计等），一起写入日志
+        self._stack = []
+        self._started = None
+
+    @staticmethod
+    def _rss_peak_mb():
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux下单位为KB
+
+    @staticmethod
+    def rows(df):
+        return 0 if df is None else int(df.shape[0])
+
+    def start(self):
+        self.records = []
+        self._started = (datetime.now(), time.perf_counter(), time.process_time())
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """
+        记录一个阶段：with monitor.stage('sku_map', rows_in=n) as rec: ...; rec['rows_out'] = m
+        """
+        if self._stack:
+            name = self._stack[-1]['name'] + '/' + name
+        tracing = self.trace_memory and tracemalloc.is_tracing()
+        if tracing:
+            # 父阶段到目前为止的峰值先记下，再从当前内存重新统计
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent['_peak'] = max(parent['_peak'], peak)
+            tracemalloc.reset_peak()
+        rec = {'name': name, 'rows_in': rows_in, 'rows_out': None,
+               '_wall': time.perf_counter(), '_cpu': time.process_time(),
+               '_base': current if tracing else 0, '_peak': 0}
+        self._stack.append(rec)
+        try:
+            yield rec
+        finally:
+            self._stack.pop()
+            rec['wall_s'] = round(time.perf_counter() - rec.pop('_wall'), 4)
+            rec['cpu_s'] = round(time.process_time() - rec.pop('_cpu'), 4)
+            rec['rss_peak_mb'] = self._rss_peak_mb()
+            base, peak = rec.pop('_base'), rec.pop('_peak')
+            if tracing:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                rec['mem_peak_mb'] = round((peak - base) / 1024 ** 2, 2)
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent['_peak'] = max(parent['_peak'], peak)
+                tracemalloc.reset_peak()
+            else:
+                rec['mem_peak_mb'] = None
+            self.records.append(rec)
+
+    def extend(self, records, prefix):
+        """
+        合并子进程中记录的阶段，阶段名前加上prefix（在某个阶段内合并时，再加上该阶段名）
+        """
+        if self._stack:
+            prefix = self._stack[-1]['name'] + '/' + prefix
+        for rec in records:
+            self.records.append({**rec, 'name': prefix + '/' + rec['name']})
+
+    def summary(self):
+        """
+        按阶段汇总：耗时和行数累加，内存取最大，count为阶段出现的次数；'*'为整个运行
+        """
+        if not self.records:
+            return pd.DataFrame(columns=['count', 'rows_in', 'rows_out'] + self.metrics)
+        df = pd.DataFrame(self.records)
+        res = df.groupby('name', sort=False).agg(
+            count=('name', 'size'), rows_in=('rows_in', lambda x: x.sum(min_count=1)),
+            rows_out=('rows_out', lambda x: x.sum(min_count=1)), wall_s=('wall_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+            rss_peak_mb=('rss_peak_mb', 'max'), mem_peak_mb=('mem_peak_mb', 'max'))
+        if self._started is not None:
+            res.loc['*', ['count', 'wall_s', 'cpu_s', 'rss_peak_mb']] = [
+                1, round(time.perf_counter() - self._started[1], 4), round(time.process_time() - self._started[2], 4),
+                self._rss_peak_mb()]
+            res['count'] = res['count'].astype(int)
+        return res
+
+    def save(self):
+        """
+        写出运行日志 run_年月日_时分秒_微秒.json，返回文件路径（同一秒内的多次运行不会互相覆盖）
+        """
+        os.makedirs(self.log_dir, exist_ok=True)
+        started = self._started[0] if self._started else datetime.now()
+        summary = self.summary()
+        log = {
+            'started': started.strftime('%Y-%m-%d %H:%M:%S'),
+            'info': self.info,
+            'stages': self.records,
+            'summary': json.loads(summary.reset_index().to_json(orient='records', force_ascii=False)),
+        }
+        path = os.path.join(self.log_dir, started.strftime('run_%Y%m%d_%H%M%S_%f.json'))
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(log, f, ensure_ascii=False, indent=1, default=str)
+        return path
+
+    def previous_log(self, exclude=None):
+        """
+        运行日志目录里最近的一份日志（不含exclude），没有时返回None
+        """
+        if not os.path.isdir(self.log_dir):
+            return None
+        logs = sorted(f for f in os.listdir(self.log_dir) if f.startswith('run_') and f.endswith('.json'))
+        logs = [os.path.join(self.log_dir, f) for f in logs]
+        logs = [f for f in logs if exclude is None or os.path.abspath(f) != os.path.abspath(exclude)]
+        return logs[-1] if logs else None
+
+    @staticmethod
+    def load_summary(log_file):
+        with open(log_file, encoding='utf-8') as f:
+            return pd.DataFrame(json.load(f)['summary']).set_index('name')
+
+    def compare(self, log_file):
+        """
+        与另一次运行的日志按阶段对比，返回两次的耗时/内存和倍数（本次/对比）
+        """
+        cur, old = self.summary(), self.load_summary(log_file)
+        res = cur[['wall_s', 'cpu_s', 'rss_peak_mb']].join(old[['wall_s', 'cpu_s', 'rss_peak_mb']], rsuffix='_old', how='outer')
+        for col in ['wall_s', 'cpu_s', 'rss_peak_mb']:
+            res[col + '_ratio'] = (res[col] / res[col + '_old'].where(res[col + '_old'] > 0)).round(2)
+        return res
+
+    def check_budget(self, baseline=None, strict=True):
+        """
+        检查各阶段是否超出预算，返回超出预算的说明列表；strict为True时有超出就抛出BudgetExceeded。
+        预算中的 ratio 与 baseline（另一次运行的日志）的墙钟耗时比较，baseline为None时跳过
+        """
+        budget = self.budget
+        if budget is None:
+            return []
+        if isinstance(budget, str):
+            with open(budget, encoding='utf-8') as f:
+                budget = json.load(f)
+        summary = self.summary()
+        old = self.load_summary(baseline) if baseline else None
+        exceeded = []
+        for name, limits in budget.items():
+            if name not in summary.index:
+                continue
+            for metric, limit in limits.items():
+                if metric == 'ratio':
+                    if old is None or name not in old.index or not old.loc[name, 'wall_s'] > 0:
+                        continue
+                    value = summary.loc[name, 'wall_s'] / old.loc[name, 'wall_s']
+                else:
+                    value = summary.loc[name, metric]
+                if pd.notnull(value) and value > limit:
+                    exceeded.append(f'{name} {metric}={value:.2f} 超出预算 {limit}')
+        if exceeded and strict:
+            raise BudgetExceeded('；'.join(exceeded))
+        return exceeded
+
+    def finish(self, **info):
+        """
+        运行结束：写出日志、打印各阶段耗时，并检查预算（与上一次运行的日志比较倍数）
+        """
+        self.info.update(info)
+        baseline = self.previous_log()
+        path = self.save()
+        summary = self.summary()
+        print("=========== 各阶段耗时 ===========")
+        print(summary[['count', 'rows_in', 'rows_out', 'wall_s', 'cpu_s', 'rss_peak_mb']].to_string())
+        print(f'运行日志：{path}')
+        self.check_budget(baseline)
+        return path
@@ -0,0 +1,45 @@
+import pandas as pd
+
+# 订单 / 订单明细的紧凑存储类型
+# - 字典编码列：重复值多的字符串（用户、地域、类别、促销、标题等）存为category，每行只存整数编码。
+#   类别按字符串排序且设为有序，排序、max/min 的结果与字符串一致（如 is_crm 取max）
+# - 整数列：按取值范围缩小位宽
+# 注意：分组统计时需加 observed=True，否则会把数据里没有出现的类别也列出来
+CATEGORY_COLS = ['user_id', 'alipay_id', 'user_name', 'address', 'items', 'title_origin', 'title', 'title_refined',
+                 'channel', 'category', 'province', 'city', 'district', 'tier', 'is_crm', 'promotion', 'promo_type']
+INT_COLS = {'goods_type': 'int16', 'goods_num': 'int16', 'day_of_week': 'int8', 'cate_num': 'int8',
+            'channel_num': 'int8', 'nth_order': 'int32'}
+DATETIME_COLS = ['order_time', 'dt']
+
+
+class Schema:
+    """
+    订单数据的紧凑类型：读取历史订单库后、写入历史订单库前统一转换，分析模块拿到的都是转换后的数据。
+    parquet会保存字典编码和整数位宽，读取时不需要重新编码（多个分区文件合并后再统一一次类别）。
+    """
+    category_cols = CATEGORY_COLS
+    int_cols = INT_COLS
+    datetime_cols = DATETIME_COLS
+
+    @classmethod
+    def apply(cls, df):
+        """
+        返回转换后的DataFrame，不存在的列跳过
+        """
+        df = df.copy()
+        for col in cls.datetime_cols:
+            if col in df.columns and df[col].dtype != 'datetime64[ns]':
+                df[col] = pd.to_datetime(df[col])
+        for col, dtype in cls.int_cols.items():
+            if col in df.columns and df[col].notnull().all():
+                df[col] = df[col].astype(dtype)
+        for col in cls.category_cols:
+            if col in df.columns:
+                values = df[col].astype('object') if df[col].dtype == 'category' else df[col]
+                categories = sorted(values.dropna().unique(), key=str)
+                df[col] = pd.Categorical(values, categories=categories, ordered=True)
+        return df
+
+    @staticmethod
+    def memory_mb(df):
+        return df.memory_usage(deep=True).sum() / 1024 ** 2
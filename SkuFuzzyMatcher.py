@@ -0,0 +1,92 @@
+import re
+import zlib
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+class SkuFuzzyMatcher:
+    """
+    对精确匹配不上的标题做模糊匹配：字符n-gram → MinHash签名 → LSH分桶。
+    查询时只和落在同一个桶里的候选标题计算相似度（n-gram的Jaccard系数），不需要和全部sku标题逐一比较。
+    - fit(): 用sku索引里的标题构建LSH索引
+    - query(): 返回每个标题的候选sku及相似度
+    - match(): 相似度不低于threshold、且最优候选唯一时自动采纳
+    """
+    prime = (1 << 31) - 1
+
+    def __init__(self, ngram=2, num_perm=64, bands=16, threshold=0.8, seed=1):
+        """
+        - ngram: 字符n-gram的长度
+        - num_perm: MinHash签名长度，需能被bands整除
+        - bands: LSH的分段数。分段越多，相似度较低的标题越容易成为候选
+        - threshold: 自动采纳的最低相似度
+        """
+        self.ngram = ngram
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        rng = np.random.RandomState(seed)
+        self.perm_a = rng.randint(1, self.prime, size=num_perm).astype('uint64')
+        self.perm_b = rng.randint(0, self.prime, size=num_perm).astype('uint64')
+        self.keys = None
+        self.shingle_sets = []
+        self.buckets = defaultdict(list)
+
+    def shingles(self, title):
+        title = re.sub(r'\s+', '', str(title)).lower()
+        if len(title) <= self.ngram:
+            return {title}
+        return {title[i:i + self.ngram] for i in range(len(title) - self.ngram + 1)}
+
+    def signature(self, shingles):
+        x = np.array([zlib.crc32(s.encode('utf-8')) % self.prime for s in shingles], dtype='uint64')
+        return ((self.perm_a[:, None] * x[None, :] + self.perm_b[:, None]) % self.prime).min(axis=1)
+
+    def _band_keys(self, sig):
+        return [(i, sig[i * self.rows:(i + 1) * self.rows].tobytes()) for i in range(self.bands)]
+
+    def fit(self, keys):
+        """
+        keys: 含 key（标题）及 sku_id/title/类别/品类 的DataFrame，一般取 SkuIndex.keys
+        """
+        self.keys = keys.drop_duplicates('key').reset_index(drop=True)
+        self.shingle_sets = [self.shingles(k) for k in self.keys['key']]
+        self.buckets = defaultdict(list)
+        for row, sh in enumerate(self.shingle_sets):
+            for band_key in self._band_keys(self.signature(sh)):
+                self.buckets[band_key].append(row)
+        return self
+
+    def query(self, titles, top_n=3):
+        """
+        返回列：query, 候选标题, 相似度, sku_id, title, 类别, 品类（每个标题最多top_n个候选）
+        """
+        res = []
+        for title in pd.unique(pd.Series(titles).dropna()):
+            sh = self.shingles(title)
+            candidates = set()
+            for band_key in self._band_keys(self.signature(sh)):
+                candidates.update(self.buckets.get(band_key, []))
+            scores = [(len(sh & self.shingle_sets[row]) / len(sh | self.shingle_sets[row]), row) for row in candidates]
+            for score, row in sorted(scores, key=lambda x: (-x[0], x[1]))[:top_n]:
+                res.append((title, self.keys.at[row, 'key'], score, row))
+        res = pd.DataFrame(res, columns=['query', '候选标题', '相似度', 'row'])
+        fields = self.keys.loc[res['row'], ['sku_id', 'title', '类别', '品类']].reset_index(drop=True)
+        return pd.concat([res.drop('row', axis=1), fields], axis=1)
+
+    def match(self, titles):
+        """
+        返回 (accepted, candidates)：
+        - accepted: 自动采纳的匹配，每个标题一行
+        - candidates: 全部候选，供人工确认
+        """
+        candidates = self.query(titles)
+        best = candidates.loc[candidates['相似度'] >= self.threshold]
+        # 最高分有多个不同sku时不自动采纳
+        best = best.loc[best['相似度'] == best.groupby('query')['相似度'].transform('max')]
+        ambiguous = best.groupby('query')['sku_id'].transform('nunique') > 1
+        accepted = best.loc[~ambiguous].drop_duplicates('query')
+        return accepted.reset_index(drop=True), candidates
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class SkuIndex:
+    """
+    标题→sku 查找索引：把sku信息汇总表编译成以 title_clean 和 title_origin 为键的哈希索引，存为parquet。
+    - load(): 读取索引；sku信息汇总表有更新时自动重新编译（已学习到的标题会保留）
+    - resolve(): 一次向量化查找，先用title_clean，再用title_origin补全 sku_id/title/类别/品类
+    - learn(): 把本批已确认匹配、但索引中还没有的标题写回索引，下个月直接命中
+    """
+    fields = ['sku_id', 'title', '类别', '品类']
+
+    def __init__(self, sku_file, index_file='数据存档/sku索引.parquet', reader=pd.read_excel):
+        """
+        - reader: 读取sku信息汇总表的函数，可传入RefCache.read_excel
+        """
+        self.sku_file = sku_file
+        self.reader = reader
+        self.index_file = index_file
+        self.keys = None  # 列：key, key_type('clean'/'origin'), source('master'/'learned'/...), sku_id, title, 类别, 品类
+        self._lookup = {}
+
+    def _master_signature(self):
+        stat = os.stat(self.sku_file)
+        return f'{stat.st_mtime_ns}-{stat.st_size}'
+
+    def _compile_master(self):
+        sku_info = self.reader(self.sku_file)
+        keys = []
+        for key_type in ['clean', 'origin']:
+            tmp = sku_info[[f'title_{key_type}'] + self.fields].rename(columns={f'title_{key_type}': 'key'})
+            keys.append(tmp.assign(key_type=key_type))
+        keys = pd.concat(keys, ignore_index=True).dropna(subset=['key'])
+        keys['source'] = 'master'
+        return keys
+
+    def load(self):
+        signature = self._master_signature()
+        keys = None
+        if os.path.exists(self.index_file):
+            keys = pd.read_parquet(self.index_file)
+            meta = pq.read_schema(self.index_file).metadata or {}
+            if meta.get(b'master_signature', b'').decode() == signature:
+                self._set_keys(keys)
+                return
+        # sku信息汇总表有更新：重新编译，保留汇总表中没有的已学习标题
+        master = self._compile_master()
+        if keys is not None:
+            learned = keys[keys['source'] != 'master']
+            keys = pd.concat([master, learned], ignore_index=True)
+        else:
+            keys = master
+        self._set_keys(keys)
+        self.save(signature)
+
+    def _set_keys(self, keys):
+        # 同一标题以先出现的为准（汇总表在前，学习到的在后）
+        self.keys = keys.drop_duplicates(['key_type', 'key'], keep='first').reset_index(drop=True)
+        self._lookup = {}
+        for key_type, tmp in self.keys.groupby('key_type'):
+            # 末尾追加一行空值，查不到的标题（indexer=-1）正好取到这一行
+            values = tmp[self.fields].reset_index(drop=True)
+            values = pd.concat([values, pd.DataFrame(np.nan, index=[len(values)], columns=self.fields)])
+            self._lookup[key_type] = (pd.Index(tmp['key']), values)
+
+    def add_keys(self, keys):
+        """
+        合并其他进程中学习到的标题（SkuIndex.keys的新增行），返回新增的标题数
+        """
+        key_num = self.keys.shape[0]
+        self._set_keys(pd.concat([self.keys, keys], ignore_index=True))
+        return self.keys.shape[0] - key_num
+
+    def save(self, signature=None):
+        if signature is None:
+            signature = self._master_signature()
+        table = pa.Table.from_pandas(self.keys.astype({'key': 'str'}), preserve_index=False)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'master_signature': signature.encode()})
+        pq.write_table(table, self.index_file + '.tmp')
+        os.replace(self.index_file + '.tmp', self.index_file)
+
+    def _get(self, key_type, titles):
+        if key_type not in self._lookup:
+            return pd.DataFrame(np.nan, index=range(len(titles)), columns=self.fields)
+        index, values = self._lookup[key_type]
+        return values.iloc[index.get_indexer(titles)].reset_index(drop=True)
+
+    def contains(self, key_type, titles):
+        if key_type not in self._lookup:
+            return np.zeros(len(titles), dtype=bool)
+        return self._lookup[key_type][0].get_indexer(titles) >= 0
+
+    def resolve(self, title_clean, title_origin):
+        """
+        返回与输入等长的 sku_id/title/类别/品类：title_clean命中的优先，缺失字段再用title_origin补全
+        """
+        by_clean = self._get('clean', title_clean)
+        by_origin = self._get('origin', title_origin)
+        return by_clean.fillna(by_origin)
+
+    def learn(self, df_sub, source='learned'):
+        """
+        df_sub: 已完成匹配的子订单（含 title_clean/title_origin 和 sku字段）
+        把匹配成功、但某一种标题还不在索引里的记录加入索引，返回新增的标题数
+        """
+        matched = df_sub.loc[df_sub['sku_id'].notnull() & df_sub['品类'].notnull()]
+        new_keys = []
+        for key_type in ['clean', 'origin']:
+            col = f'title_{key_type}'
+            tmp = matched.loc[~self.contains(key_type, matched[col]), [col] + self.fields]
+            new_keys.append(tmp.rename(columns={col: 'key'}).drop_duplicates('key').assign(key_type=key_type, source=source))
+        new_keys = pd.concat(new_keys, ignore_index=True)
+        if new_keys.shape[0] > 0:
+            self._set_keys(pd.concat([self.keys, new_keys], ignore_index=True))
+        return new_keys.shape[0]
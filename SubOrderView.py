@@ -0,0 +1,50 @@
+import pandas as pd
+
+
+class SubOrderView:
+    """
+    订单明细的按需关联视图：内存中只保留订单表（df）和只有商品级字段的订单明细（df_sub，列见item_cols），
+    分析模块需要订单级字段（user_id、dt、nth_order……）时，只把用到的几列按order_id从订单表取到明细上，
+    不再让每个商品行都重复保存全部订单字段。
+    - 明细各行在订单表中的行号只算一次，之后取列都是按行号取值，不做merge
+    - df_sub里已经有的列直接使用，传入旧的宽表时结果不变
+    """
+    # 订单明细表只存这些商品级字段，其余字段按order_id从订单表关联
+    item_cols = ['order_id', 'title_origin', 'sku_id', 'title', 'channel', 'category', 'title_refined',
+                 'promotion', 'promo_type', 'month']
+
+    def __init__(self, df, df_sub):
+        self.df = df
+        self.df_sub = df_sub
+        self._order_rows = None
+
+    def order_rows(self):
+        """
+        明细各行对应订单在df中的行号，订单表里没有的为-1
+        """
+        if self._order_rows is None:
+            self._order_rows = pd.Index(self.df['order_id']).get_indexer(self.df_sub['order_id'])
+        return self._order_rows
+
+    @classmethod
+    def is_order_field(cls, field):
+        """
+        订单级字段（province、tier等）：每个订单只有一个取值，按订单统计时直接用订单表，不需要对明细去重
+        """
+        return field not in cls.item_cols
+
+    def view(self, columns=None, rows=None):
+        """
+        df_sub的全部列，加上columns中df_sub没有、订单表里有的字段（按订单表的列顺序排在后面）；
+        columns为None时关联订单表的全部字段。
+        - rows: 只取df_sub的这些行（行号），如按时间线排好的item_rows
+        """
+        sub = self.df_sub if rows is None else self.df_sub.iloc[rows]
+        cols = self.df.columns if columns is None else columns
+        cols = [c for c in self.df.columns if c in set(cols) and c not in sub.columns]
+        if not cols:
+            return sub
+        pos = self.order_rows() if rows is None else self.order_rows()[rows]
+        missing = (pos < 0).any()
+        data = {c: self.df[c].array.take(pos, allow_fill=missing) for c in cols}
+        return pd.concat([sub, pd.DataFrame(data, index=sub.index)], axis=1)
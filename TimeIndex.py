@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+
+from SubOrderView import SubOrderView
+
+
+class TimeIndex:
+    """
+    订单的时间索引：订单表和订单明细各按下单时间做一次稳定排序，保存排序后的日期和对应的行号。
+    按日期范围截取时二分查找起止位置，只取出窗口内的行，开销与窗口内的行数有关，不需要对全部历史做布尔筛选。
+    - 截取结果保持原数据的行顺序，窗口覆盖全部历史时与原数据一致
+    - 各分析模块可共用同一个索引（传入time_index），只排序一次
+    - 订单明细没有下单时间（只有商品级字段）时，按order_id取订单的下单时间
+    """
+    def __init__(self, df, df_sub):
+        self.df = df
+        self.df_sub = df_sub
+        if 'order_time' not in df_sub.columns:
+            df_sub = SubOrderView(df, df_sub).view(['order_time', 'dt'])
+        self._sorted = {'df': self._build(df), 'df_sub': self._build(df_sub)}
+
+    @staticmethod
+    def _build(data):
+        order = np.argsort(data['order_time'].to_numpy(dtype='datetime64[ns]'), kind='mergesort')
+        return order, data['dt'].to_numpy(dtype='datetime64[ns]')[order]
+
+    @staticmethod
+    def bounds(dates, start=None, end=None):
+        """
+        dates: 升序的日期；返回 [start, end]（含起止日期）在其中的起止位置，None表示不限
+        """
+        lo = 0 if start is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(start), 'ns'), side='left')
+        hi = len(dates) if end is None else np.searchsorted(dates, np.datetime64(pd.Timestamp(end), 'ns'), side='right')
+        return lo, hi
+
+    def _take(self, name, start, end):
+        order, dates = self._sorted[name]
+        lo, hi = self.bounds(dates, start, end)
+        return getattr(self, name).iloc[np.sort(order[lo:hi])]
+
+    def slice(self, start=None, end=None):
+        """
+        返回 [start, end] 内的 (df, df_sub)，如 slice('2020-04-01', '2020-06-30')
+        """
+        if start is None and end is None:
+            return self.df, self.df_sub
+        return self._take('df', start, end), self._take('df_sub', start, end)
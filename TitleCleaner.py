@@ -0,0 +1,69 @@
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+# 标题清洗规则表：(说明, 正则, 匹配方式, 是否去除首尾空格)
+# - 匹配方式为 'always' 的规则按顺序全部执行；'first' 的规则只执行第一条匹配上的
+# - 匹配上时，标题替换为正则的第1个分组
+TITLE_RULES = [
+    ('标题开头多余的空格', r'^ (味好美黑椒酱230g\*3包组合 黑胡椒酱汁牛排酱)$', 'always', False),
+    ('清除带中括号的活动信息 【...】', r'.+】(.+)', 'always', False),
+    ('[9月10日秒杀]味好美新奥尔良烤鸡翅腌料*8包 烤炸鸡烧烤调料', r'.*\](.*)', 'first', False),
+    ('1元预定  味好美培煎芝麻沙拉酱200g：取最后一段', r'^(?=.*(?:1元预定|1元秒杀)).*?(\S+)\s*$', 'first', False),
+    ('薇娅推荐 味好美新奥尔良烤鸡翅腌料：去掉前4个字', r'^(?=.*薇娅推荐).{4}(.*)$', 'first', True),
+    ('以“X月X日直播专享/秒杀”开头，末尾可能含有“秒杀”字样', r'直播.+?\s(?=.)\s*(.*?)(?:秒杀)?\s*$', 'first', False),
+    ('“包邮 | ”开头：去掉前5个字', r'^(?=包邮.).{0,5}(.*)$', 'first', False),
+    ('新品开头', r'^新品(.+)', 'first', True),
+    ('预售开头', r'^预售(.+)', 'first', True),
+]
+
+
+class TitleCleaner:
+    """
+    宝贝标题清洗：规则见 TITLE_RULES。
+    每个不同的标题只清洗一次，结果再映射回所有子订单；清洗结果缓存在 cache_file 中，跨月复用。
+    规则表修改后缓存自动失效。
+    """
+    def __init__(self, cache_file='数据存档/标题清洗缓存.parquet', rules=TITLE_RULES):
+        self.cache_file = cache_file
+        self.rules = [(name, re.compile(pattern), mode, strip) for name, pattern, mode, strip in rules]
+        self.version = hashlib.md5(repr(rules).encode('utf-8')).hexdigest()
+        self.cache = self._load_cache()
+        self.new_titles = 0  # 本次新清洗的标题数
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_file):
+            return {}
+        cache = pd.read_parquet(self.cache_file)
+        cache = cache[cache['rule_version'] == self.version]
+        return dict(zip(cache['title_origin'], cache['title_clean']))
+
+    def save(self):
+        cache = pd.DataFrame({'title_origin': list(self.cache.keys()), 'title_clean': list(self.cache.values())})
+        cache['rule_version'] = self.version
+        cache.to_parquet(self.cache_file + '.tmp', index=False)
+        os.replace(self.cache_file + '.tmp', self.cache_file)
+
+    def clean_one(self, title):
+        matched = False
+        for _, pattern, mode, strip in self.rules:
+            if mode == 'first' and matched:
+                continue
+            m = pattern.search(title)
+            if m:
+                title = m.group(1).strip() if strip else m.group(1)
+                matched = matched or mode == 'first'
+        return title
+
+    def clean(self, titles):
+        """
+        titles: 原始标题Series，返回清洗后的标题Series（索引不变）
+        """
+        uniques = titles.dropna().unique()
+        missing = [t for t in uniques if t not in self.cache]
+        for t in missing:
+            self.cache[t] = self.clean_one(t)
+        self.new_titles = len(missing)
+        return titles.map(self.cache)
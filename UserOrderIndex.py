@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class UserOrderIndex:
+    """
+    用户下单索引：每个用户一行，记录该用户截至目前的下单状态，每批新订单只更新涉及的用户。
+    - nth_order: 已下单次数（同一下单时间算一次，与订单的nth_order一致）
+    - order_num / order_value: 累计订单数 / 累计订单金额
+    - first_dt: 首单日期
+    - last_order_time / last_dt: 最近一次下单时间 / 日期
+    标注复购只需要查这张表，不再扫描全部历史订单；RFM、复购周期等需要“上一单”状态的计算也可以直接使用。
+    新订单早于用户最近一次下单（补录、退款后重新导出）时，该用户的序数不能直接累加，需用sequence()对其全部订单重新计算，
+    再用reset_users()更新索引。
+    """
+    cols = ['nth_order', 'order_num', 'order_value', 'first_dt', 'last_order_time', 'last_dt']
+
+    def __init__(self, index_file='数据存档/用户下单索引.parquet'):
+        self.index_file = index_file
+        self.state = self._empty()
+
+    def _empty(self):
+        state = pd.DataFrame({
+            'nth_order': pd.Series(dtype='int64'),
+            'order_num': pd.Series(dtype='int64'),
+            'order_value': pd.Series(dtype='float64'),
+            'first_dt': pd.Series(dtype='datetime64[ns]'),
+            'last_order_time': pd.Series(dtype='datetime64[ns]'),
+            'last_dt': pd.Series(dtype='datetime64[ns]'),
+        })
+        state.index.name = 'user_id'
+        return state
+
+    def load(self):
+        """
+        读取已保存的索引，文件不存在时返回False
+        """
+        if not os.path.exists(self.index_file):
+            return False
+        self.state = pd.read_parquet(self.index_file).set_index('user_id')
+        return True
+
+    def save(self):
+        self.state.reset_index().to_parquet(self.index_file + '.tmp', index=False)
+        os.replace(self.index_file + '.tmp', self.index_file)
+
+    @staticmethod
+    def _summarize(orders):
+        """
+        orders: 订单级数据，包含 user_id, order_time, dt, order_value, nth_order
+        """
+        return orders.groupby('user_id', observed=True).agg(
+            nth_order=('nth_order', 'max'),
+            order_num=('order_time', 'count'),
+            order_value=('order_value', 'sum'),
+            first_dt=('dt', 'min'),
+            last_order_time=('order_time', 'max'),
+            last_dt=('dt', 'max'),
+        ).astype({'order_value': 'float64'})
+
+    def build(self, orders):
+        """
+        用历史订单（订单级）全量构建索引，只在索引文件不存在时执行一次
+        """
+        self.state = self._empty()
+        if orders.shape[0] > 0:
+            orders = orders.assign(user_id=orders['user_id'].astype('object'),
+                                   order_time=pd.to_datetime(orders['order_time']),
+                                   dt=orders['dt'].astype('datetime64[ns]'))
+            self.state = self._summarize(orders)[self.cols]
+
+    @staticmethod
+    def sequence(orders):
+        """
+        orders: 订单级数据，包含 user_id, order_time
+        按 (user_id, order_time) 排序后组内累计计数，同一用户同一下单时间算一次，返回与orders对齐的nth_order
+        """
+        user = pd.factorize(orders['user_id'])[0]
+        order_time = pd.to_datetime(orders['order_time']).to_numpy().view('int64')
+        idx = np.lexsort((order_time, user))
+        user, order_time = user[idx], order_time[idx]
+        new_user = np.r_[True, user[1:] != user[:-1]]
+        new_time = new_user | np.r_[True, order_time[1:] != order_time[:-1]]
+        visit = np.cumsum(new_time)
+        first_visit = np.maximum.accumulate(np.where(new_user, visit, 0))
+        nth_order = np.empty(len(idx), dtype='int64')
+        nth_order[idx] = visit - first_visit + 1
+        return pd.Series(nth_order, index=orders.index, name='nth_order')
+
+    def late_users(self, df_sub):
+        """
+        本批订单中，有订单不晚于索引中最近一次下单时间的用户
+        """
+        first = df_sub.groupby('user_id', observed=True)['order_time'].min()
+        last = self.state['last_order_time'].reindex(first.index)
+        return first.index[(first <= last).to_numpy()]
+
+    def reset_users(self, orders, users=None):
+        """
+        orders: 若干用户的全部订单（已标注nth_order），用它们重新汇总这些用户的索引状态
+        users: 需要重置的用户，默认为orders中的用户；其中已经没有订单的用户从索引中删除
+        """
+        batch = self._summarize(orders)[self.cols]
+        rest = self.state.loc[~self.state.index.isin(batch.index) & ~self.state.index.isin([] if users is None else users)]
+        self.state = pd.concat([rest, batch]).astype({'nth_order': 'int64', 'order_num': 'int64'})
+        self.state.index.name = 'user_id'
+
+    def lookup(self, user_ids):
+        """
+        查询用户在本批订单之前的状态，新用户返回空值
+        """
+        return self.state.reindex(pd.Index(user_ids, name='user_id'))
+
+    def assign(self, df_sub):
+        """
+        给新订单标注下单序数，并把新订单计入索引。
+        逻辑：新订单的 (user_id, order_time) 排序后组内累计计数，再加上索引里该用户的历史下单次数
+        返回：user_id, order_time, nth_order
+        """
+        order_sort = df_sub[['user_id', 'order_time']].drop_duplicates().sort_values(['user_id', 'order_time'])
+        base = order_sort['user_id'].map(self.state['nth_order']).fillna(0)
+        order_sort['nth_order'] = (order_sort.groupby('user_id').cumcount() + 1 + base).astype('int64')
+
+        # 更新索引
+        orders = df_sub.drop_duplicates('order_id')[['user_id', 'order_time', 'dt', 'order_value']]
+        orders = orders.merge(order_sort, on=['user_id', 'order_time'], how='left')
+        batch = self._summarize(orders)
+        old = self.state.reindex(batch.index)
+        batch['order_num'] += old['order_num'].fillna(0).astype('int64')
+        batch['order_value'] += old['order_value'].fillna(0)
+        batch['first_dt'] = old['first_dt'].where(old['first_dt'] < batch['first_dt'], batch['first_dt'])
+        for col in ['last_order_time', 'last_dt']:
+            batch[col] = old[col].where(old[col] > batch[col], batch[col])
+        self.state = batch[self.cols].combine_first(self.state)[self.cols].astype(
+            {'nth_order': 'int64', 'order_num': 'int64'})
+        return order_sort.reset_index(drop=True)
@@ -29,21 +29,38 @@ from graphviz import Digraph
 # Excel输出
 import xlsxwriter
 
+from SubOrderView import SubOrderView
+from TimeIndex import TimeIndex
+
 class UserProfile:
-    def __init__(self, df, df_sub):
+    def __init__(self, df, df_sub, user_index=None, start=None, end=None, time_index=None, timeline=None):
+        """
+        - user_index: DataProcess维护的用户下单索引（UserOrderIndex），传入后RFM直接使用索引中的累计下单状态
+        - start / end: 只分析这段日期内的订单（含起止日期），用time_index（TimeIndex）二分查找截取；
+          此时RFM按窗口内的订单计算，不使用user_index（索引是全部历史的累计状态）
+        - timeline: 用户下单时间线（UserTimeline），没有user_index时RFM的下单次数、金额和最近一单直接在时间线上按用户汇总；
+          按日期截取时同样不使用
+        - df_sub只需要商品级字段，用到的订单级字段按order_id从df关联（SubOrderView）
+        """
+        if start is not None or end is not None:
+            df, df_sub = (time_index if time_index is not None else TimeIndex(df, df_sub)).slice(start, end)
+            user_index = None
+            timeline = None
         self.df = df
         self.df_sub = df_sub
-        self.df_sort = df.sort_values(['user_id', 'order_time'])
+        self.user_index = user_index
+        self.timeline = timeline
+        self.df_sort = None  # 按用户、下单时间排序的订单，RFM不使用user_index和timeline时才排序
 
     def crm_analysis(self):
-        res_crm = self.df.groupby('user_id').agg(
+        res_crm = self.df.groupby('user_id', observed=True).agg(
             is_crm = ('is_crm', 'max'),
             order_value = ('order_value', 'sum'),
             order_count = ('order_id', 'count'),
             is_rebuy = ('nth_order', 'max')
         ).reset_index()
         res_crm['is_rebuy'] = res_crm['is_rebuy'] > 1
-        res_crm = res_crm.groupby('is_crm').agg(
+        res_crm = res_crm.groupby('is_crm', observed=True).agg(
             总人数 = ('user_id', 'count'),
             总订单数 = ('order_count', 'sum'),
             人均订单数 = ('order_count', 'mean'),
@@ -81,12 +98,28 @@ class UserProfile:
             elif r > r_ref and f <= f_ref and m <= m_ref:
                 return '流失客户'
 
-        df_rfm = self.df_sort.groupby('user_id').agg(
-            is_crm=('is_crm', 'max'),
-            order_num=('order_id', 'count'),
-            order_value=('order_value', 'sum'),
-            recent_order_dt=('dt', 'last'),
-        ).reset_index()
+        if self.user_index is not None:
+            df_rfm = self.df.groupby('user_id', observed=True).agg(is_crm=('is_crm', 'max')).join(
+                self.user_index.state[['order_num', 'order_value', 'last_dt']]
+            ).rename(columns={'last_dt': 'recent_order_dt'}).reset_index()
+        elif self.timeline is not None:
+            tl = self.timeline
+            df_rfm = pd.DataFrame({
+                'user_id': tl.users,
+                'is_crm': self.df.groupby('user_id', observed=True)['is_crm'].max().reindex(tl.users).to_numpy(),
+                'order_num': np.diff(tl.offsets),
+                'order_value': tl.user_sum(tl.order_value),
+                'recent_order_dt': tl.dt[tl.last_order()].astype('datetime64[ns]'),
+            })
+        else:
+            if self.df_sort is None:
+                self.df_sort = self.df.sort_values(['user_id', 'order_time'])
+            df_rfm = self.df_sort.groupby('user_id', observed=True).agg(
+                is_crm=('is_crm', 'max'),
+                order_num=('order_id', 'count'),
+                order_value=('order_value', 'sum'),
+                recent_order_dt=('dt', 'last'),
+            ).reset_index()
 
         end_dt = pd.Timestamp(max(self.df['dt']))
         df_rfm['recency'] = (end_dt + pd.DateOffset(1) - df_rfm['recent_order_dt']).dt.days
@@ -100,7 +133,7 @@ class UserProfile:
         df_rfm[["最近一次购买距今时间/R", "历史购买总次数/F", "历史购买总金额/M"]] = (df_rfm[['recency', 'order_num', 'order_value']] > [r_ref, f_ref, m_ref])
         df_rfm.replace({False: '低于平均值', True:'高于平均值'}, inplace=True)
 
-        res_rfm = df_rfm.groupby(['RFM标签', "最近一次购买距今时间/R", "历史购买总次数/F", "历史购买总金额/M", 'is_crm']).agg(人数=('user_id', 'count'))
+        res_rfm = df_rfm.groupby(['RFM标签', "最近一次购买距今时间/R", "历史购买总次数/F", "历史购买总金额/M", 'is_crm'], observed=True).agg(人数=('user_id', 'count'))
         res_rfm = res_rfm.unstack(-1)
         idx = [
             ('重要价值客户', '低于平均值', '高于平均值', '高于平均值'),
@@ -126,12 +159,13 @@ class UserProfile:
 
     def province_cate_favor(self):
         # 店铺总体
-        df_tmp = self.df_sub.loc[self.df_sub['category'].isin(['新奥尔良料', '番茄酱', '世界风味酱', '锅物'])].drop_duplicates(['category', 'order_id'])
-        res_store = df_tmp.groupby('category').agg(订单数=('order_id', 'count')).reset_index()
+        df_sub = SubOrderView(self.df, self.df_sub).view(['province'])
+        df_tmp = df_sub.loc[df_sub['category'].isin(['新奥尔良料', '番茄酱', '世界风味酱', '锅物'])].drop_duplicates(['category', 'order_id'])
+        res_store = df_tmp.groupby('category', observed=True).agg(订单数=('order_id', 'count')).reset_index()
         res_store['订单占比'] = res_store['订单数'] / self.df.shape[0]
 
         # 各省情况
-        tmp = self.df[self.df['province'].notnull()].groupby('province').agg(订单总数=('order_id', 'count'))
-        res_province = df_tmp.groupby(['province', 'category']).agg(订单占比=('order_id', 'count')).unstack(-1).div(tmp['订单总数'], axis=0)
+        tmp = self.df[self.df['province'].notnull()].groupby('province', observed=True).agg(订单总数=('order_id', 'count'))
+        res_province = df_tmp.groupby(['province', 'category'], observed=True).agg(订单占比=('order_id', 'count')).unstack(-1).div(tmp['订单总数'], axis=0)
         res_province['订单总数'] = tmp['订单总数']
         return res_store, res_province
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+class UserTimeline:
+    """
+    用户下单时间线：全部订单按 (用户, 下单时间) 排好，存成扁平的NumPy数组（CSR结构），每次读取历史订单后只构建一次，各分析模块共用。
+    - 用户按user_id排序后编码，第u个用户的订单为 offsets[u]:offsets[u+1]，订单数组：order_id, dt, nth_order, order_value, promo_code
+    - 每个订单的商品为 item_offsets[o]:item_offsets[o+1]，商品数组：category_code, sku_code；item_rows为其在订单明细中的行号
+    - 编码对应的取值：users, promo_types, categories, sku_ids；空值编码为-1
+    “某个用户第k单买了什么、什么时候买的”这类问题直接在数组上切片，不需要对订单表排序、筛选和关联。
+    - save() / load(): 各数组存为 .npy 文件，读取时默认内存映射（mmap），不把数组整个读进内存；
+      signature用于判断时间线与当前的历史订单是否一致
+    """
+    arrays = ['users', 'offsets', 'order_rows', 'order_id', 'dt', 'nth_order', 'order_value', 'promo_code', 'promo_types',
+              'item_offsets', 'item_rows', 'category_code', 'categories', 'sku_code', 'sku_ids']
+
+    def __init__(self, timeline_dir='数据存档/用户时间线'):
+        self.timeline_dir = timeline_dir
+        self.signature_value = None
+        for name in self.arrays:
+            setattr(self, name, None)
+        self._cache = {}
+
+    @staticmethod
+    def signature(df, df_sub):
+        """
+        订单数、明细数和时间线用到的各列的哈希，历史订单有增减或改写（替换订单、重排序数）时会变化。
+        order_rows / item_rows 是行号，行的顺序变了（如替换订单后分区文件重写）时签名也要变，所以按行的顺序计算哈希
+        """
+        order_hash = hashlib.sha1(pd.util.hash_pandas_object(
+            df[['user_id', 'order_id', 'order_time', 'nth_order', 'order_value', 'promo_type']], index=False).to_numpy().tobytes())
+        item_hash = hashlib.sha1(pd.util.hash_pandas_object(
+            df_sub[['order_id', 'category', 'sku_id']], index=False).to_numpy().tobytes())
+        return f"{df.shape[0]}-{df_sub.shape[0]}-{order_hash.hexdigest()}-{item_hash.hexdigest()}"
+
+    def build(self, df, df_sub):
+        """
+        df / df_sub: 读取的历史订单和订单明细（load_history的结果），item_rows / order_rows 为它们的行号
+        """
+        user_code, users = pd.factorize(df['user_id'], sort=True)
+        order_time = df['order_time'].to_numpy(dtype='datetime64[ns]').view('int64')
+        order_rows = np.lexsort((order_time, user_code))
+        self.users = np.asarray(users, dtype=str)
+        self.offsets = np.r_[0, np.cumsum(np.bincount(user_code, minlength=len(users)))]
+        self.order_rows = order_rows
+        self.order_id = df['order_id'].to_numpy(dtype='int64')[order_rows]
+        self.dt = df['dt'].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')[order_rows]
+        self.nth_order = df['nth_order'].to_numpy(dtype='int32')[order_rows]
+        self.order_value = df['order_value'].to_numpy(dtype='float64')[order_rows]
+        promo_code, promo_types = pd.factorize(df['promo_type'], sort=True)
+        self.promo_code = promo_code.astype('int8')[order_rows]
+        self.promo_types = np.asarray(promo_types, dtype=str)
+
+        # 商品按所属订单在时间线中的位置排列，同一订单内保持原来的顺序
+        order_pos = pd.Index(self.order_id).get_indexer(df_sub['order_id'])
+        rows = np.flatnonzero(order_pos >= 0)
+        item_rows = rows[np.argsort(order_pos[rows], kind='mergesort')]
+        self.item_rows = item_rows
+        self.item_offsets = np.r_[0, np.cumsum(np.bincount(order_pos[rows], minlength=len(order_rows)))]
+        category_code, categories = pd.factorize(df_sub['category'], sort=True)
+        self.category_code = category_code.astype('int32')[item_rows]
+        self.categories = np.asarray(categories, dtype=str)
+        sku_id = df_sub['sku_id'].to_numpy(dtype='float64')[item_rows]
+        self.sku_ids = np.unique(sku_id[~np.isnan(sku_id)]).astype('int64')
+        self.sku_code = np.where(np.isnan(sku_id), -1, np.searchsorted(self.sku_ids, np.nan_to_num(sku_id))).astype('int32')
+
+        self.signature_value = self.signature(df, df_sub)
+        self._cache = {}
+        return self
+
+    def save(self):
+        os.makedirs(self.timeline_dir, exist_ok=True)
+        for name in self.arrays:
+            path = os.path.join(self.timeline_dir, name + '.npy')
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, getattr(self, name))
+            os.replace(path + '.tmp', path)
+        # meta最后写，读取时以它为准
+        with open(os.path.join(self.timeline_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature_value}, f, ensure_ascii=False)
+
+    def load(self, signature=None, mmap=True):
+        """
+        读取已保存的时间线；文件不存在、或与signature不一致时返回False
+        """
+        meta_file = os.path.join(self.timeline_dir, 'meta.json')
+        if not os.path.exists(meta_file):
+            return False
+        with open(meta_file, encoding='utf-8') as f:
+            meta = json.load(f)
+        if signature is not None and meta['signature'] != signature:
+            return False
+        for name in self.arrays:
+            setattr(self, name, np.load(os.path.join(self.timeline_dir, name + '.npy'), mmap_mode='r' if mmap else None))
+        self.signature_value = meta['signature']
+        self._cache = {}
+        return True
+
+    def user_num(self):
+        return len(self.offsets) - 1
+
+    def order_user(self):
+        """
+        每个订单所属用户的编码
+        """
+        if 'order_user' not in self._cache:
+            self._cache['order_user'] = np.repeat(np.arange(self.user_num()), np.diff(self.offsets))
+        return self._cache['order_user']
+
+    def item_order(self):
+        """
+        每个商品所属订单在时间线中的位置
+        """
+        if 'item_order' not in self._cache:
+            self._cache['item_order'] = np.repeat(np.arange(len(self.order_id)), np.diff(self.item_offsets))
+        return self._cache['item_order']
+
+    def user_orders(self, user_id):
+        """
+        某个用户的全部订单（时间线中的位置），按下单时间排列
+        """
+        u = np.searchsorted(self.users, str(user_id))
+        if u == len(self.users) or self.users[u] != str(user_id):
+            return slice(0, 0)
+        return slice(self.offsets[u], self.offsets[u + 1])
+
+    def order_items(self, order):
+        return slice(self.item_offsets[order], self.item_offsets[order + 1])
+
+    def nth(self, k):
+        """
+        所有用户第k次下单的订单（nth_order == k）
+        """
+        return np.flatnonzero(self.nth_order == k)
+
+    def next_order(self):
+        """
+        每个订单的下一单（同一用户）在时间线中的位置，没有下一单为-1
+        """
+        nxt = np.arange(1, len(self.order_id) + 1)
+        nxt[self.offsets[1:] - 1] = -1
+        return nxt
+
+    def last_order(self):
+        """
+        每个用户最近一单在时间线中的位置
+        """
+        return self.offsets[1:] - 1
+
+    def user_sum(self, values):
+        """
+        按用户对订单级的数组求和（如order_value）
+        """
+        if self.user_num() == 0:
+            return np.zeros(0, dtype=np.asarray(values).dtype)
+        return np.add.reduceat(np.asarray(values), self.offsets[:-1])